@@ -0,0 +1,96 @@
+import asyncio
+import heapq
+import metrics
+
+
+admission_active = metrics.gauge('db_admission_active', 'Запросы, допущенные к базе данных')
+admission_queue_depth = metrics.gauge('db_admission_queue_depth', 'Запросы в очереди допуска к базе данных')
+admission_admitted = metrics.counter('db_admission_admitted_total', 'Допущенные к базе данных запросы')
+admission_rejected = metrics.counter('db_admission_rejected_total', 'Отклонённые из-за перегрузки запросы')
+
+
+class Overloaded(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        self.reason = reason
+        self.retry_after = retry_after
+
+    def __str__(self):
+        return f'Overloaded, {self.reason}'
+
+
+class AdmissionGate:
+    """
+    Ограничивает число одновременных обращений к базе данных.
+    Запросы сверх limit ждут в очереди по приоритету (меньшее значение обслуживается раньше).
+    Если очередь заполнена или ожидание дольше timeout секунд, выбрасывается Overloaded,
+    чтобы сервер сразу ответил 503, а не копил соединения до max_connections.
+
+    Attributes:
+        limit (int): Максимальное число одновременно допущенных запросов.
+        queue_size (int): Максимальная длина очереди ожидания.
+        timeout (float): Максимальное время ожидания в очереди в секундах.
+        retry_after (int): Значение заголовка Retry-After для отклонённых запросов.
+    """
+
+    def __init__(self, limit: int, queue_size: int = 100, timeout: float = 5.0, retry_after: int = 1):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.active = 0
+        self.waiting = 0
+        self._queue = []
+        self._sequence = 0
+
+    async def acquire(self, priority: int = 0):
+        if self.active < self.limit and not self.waiting:
+            self._admit()
+            return
+        if self.waiting >= self.queue_size:
+            admission_rejected.inc(reason='queue_full')
+            raise Overloaded('очередь заполнена', self.retry_after)
+
+        future = asyncio.get_running_loop().create_future()
+        self._sequence += 1
+        heapq.heappush(self._queue, (priority, self._sequence, future))
+        self._set_waiting(self.waiting + 1)
+        try:
+            await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            admission_rejected.inc(reason='timeout')
+            raise Overloaded('истекло время ожидания', self.retry_after)
+        except BaseException:
+            # Запрос отменён после того, как ему уже передали место: место нужно вернуть
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+        finally:
+            self._set_waiting(self.waiting - 1)
+
+    def try_acquire(self) -> bool:
+        """Занимает место без ожидания в очереди. Возвращает False, если свободных мест нет."""
+
+        if self.active < self.limit and not self.waiting:
+            self._admit()
+            return True
+        return False
+
+    def release(self):
+        # Место передаётся первому живому ожидающему, иначе освобождается
+        while self._queue:
+            _, _, future = heapq.heappop(self._queue)
+            if not future.done():
+                future.set_result(None)
+                admission_admitted.inc()
+                return
+        self.active -= 1
+        admission_active.set(self.active)
+
+    def _admit(self):
+        self.active += 1
+        admission_active.set(self.active)
+        admission_admitted.inc()
+
+    def _set_waiting(self, value: int):
+        self.waiting = value
+        admission_queue_depth.set(value)
@@ -0,0 +1,85 @@
+import threading
+import time
+import metrics
+
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+breaker_state = metrics.gauge('db_circuit_state', 'Состояние автомата отключения базы данных: 0 - закрыт, 1 - проверка, 2 - открыт')
+breaker_transitions = metrics.counter('db_circuit_transitions_total', 'Переходы автомата отключения базы данных')
+breaker_rejected = metrics.counter('db_circuit_rejected_total', 'Запросы, отклонённые без обращения к недоступной базе данных')
+
+
+class CircuitOpen(Exception):
+    def __init__(self, retry_after: int):
+        self.retry_after = retry_after
+
+    def __str__(self):
+        return 'CircuitOpen, база данных недоступна'
+
+
+class CircuitBreaker:
+    """
+    Автомат отключения базы данных.
+    После failure_threshold ошибок соединения подряд автомат открывается, и запросы сразу получают CircuitOpen,
+    не дожидаясь таймаута подключения. Через reset_timeout секунд пропускается один пробный запрос (half_open):
+    его успех закрывает автомат, ошибка снова открывает.
+
+    Attributes:
+        failure_threshold (int): Число ошибок подряд, после которого автомат открывается.
+        reset_timeout (float): Через сколько секунд после открытия пропускается пробный запрос.
+        retry_after (int): Значение заголовка Retry-After для отклонённых запросов.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 5.0, retry_after: int = 1):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.retry_after = retry_after
+        self.state = CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probe_started = 0.0
+        self._lock = threading.Lock()
+        breaker_state.set(STATE_VALUES[CLOSED])
+
+    def allow(self):
+        """Пропускает запрос к базе или выбрасывает CircuitOpen, если база считается недоступной."""
+
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            now = time.monotonic()
+            if self.state == OPEN and now - self._opened_at >= self.reset_timeout:
+                self._transition(HALF_OPEN)
+                self._probe_started = now
+                return
+            # Если пробный запрос не сообщил результат, через reset_timeout пропускается следующий
+            if self.state == HALF_OPEN and now - self._probe_started >= self.reset_timeout:
+                self._probe_started = now
+                return
+        breaker_rejected.inc()
+        raise CircuitOpen(self.retry_after)
+
+    def success(self):
+        if self.state == CLOSED and not self.failures:
+            return
+        with self._lock:
+            self.failures = 0
+            if self.state != CLOSED:
+                self._transition(CLOSED)
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                self._transition(OPEN)
+
+    def _transition(self, state: str):
+        breaker_transitions.inc(**{'from': self.state, 'to': state})
+        self.state = state
+        breaker_state.set(STATE_VALUES[state])
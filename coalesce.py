@@ -0,0 +1,78 @@
+import threading
+import time
+import metrics
+
+
+reads_coalesced = metrics.counter('db_reads_coalesced_total', 'Чтения, получившие результат чужого запроса')
+reads_executed = metrics.counter('db_reads_executed_total', 'Чтения, выполненные в базе данных через SingleFlight')
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.finished_at = None
+
+
+class SingleFlight:
+    """
+    Объединяет одинаковые одновременные чтения: пока запрос с ключом key выполняется,
+    остальные вызовы с тем же ключом ждут его и получают тот же результат (или ту же ошибку).
+    Если ttl больше нуля, успешный результат ещё ttl секунд отдаётся без обращения к базе.
+
+    Attributes:
+        ttl (float): Время в секундах, в течение которого готовый результат переиспользуется.
+    """
+
+    # При таком количестве ключей устаревшие результаты удаляются
+    sweep_size = 1000
+
+    def __init__(self, ttl: float = 0.0):
+        self.ttl = ttl
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, timeout: float | None = None):
+        """
+        Выполняет func или ждёт результат одновременного вызова с тем же ключом.
+        Если ожидание чужого вызова дольше timeout секунд, выбрасывает TimeoutError, сам вызов продолжается.
+        """
+
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None and call.finished_at is not None and time.monotonic() - call.finished_at > self.ttl:
+                del self._calls[key]
+                call = None
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if not call.done.wait(timeout):
+                raise TimeoutError('Не дождались результата объединённого чтения')
+            reads_coalesced.inc()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        reads_executed.inc()
+        try:
+            call.result = func()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                call.finished_at = time.monotonic()
+                if self.ttl <= 0 or call.error is not None:
+                    self._calls.pop(key, None)
+                elif len(self._calls) > self.sweep_size:
+                    self._sweep(call.finished_at)
+            call.done.set()
+        return call.result
+
+    def _sweep(self, now: float):
+        for key, call in list(self._calls.items()):
+            if call.finished_at is not None and now - call.finished_at > self.ttl:
+                del self._calls[key]
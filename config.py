@@ -1,13 +1,79 @@
 import os
+from functools import cache
 from dotenv import load_dotenv
 
 
-load_dotenv('.env')
+def _route_timeouts(value: str) -> dict[str, float]:
+    timeouts = {}
+    for item in value.split(','):
+        path, _, seconds = item.partition('=')
+        if path.strip() and seconds.strip():
+            timeouts[path.strip()] = float(seconds)
+    return timeouts
 
-DB_NAME = os.getenv('DB_NAME')
-DB_USER = os.getenv('DB_USER')
-DB_PASSWORD = os.getenv('DB_PASSWORD')
-DB_HOST = os.getenv('DB_HOST')
-DB_PORT = os.getenv('DB_PORT')
-DB_TABLE = os.getenv('DB_TABLE')
-ACCESS_TOKEN = os.getenv('ACCESS_TOKEN')
+
+@cache
+def load() -> dict:
+    """Читает .env и переменные окружения. Выполняется при первом обращении к настройке, а не при импорте."""
+
+    load_dotenv('.env')
+    return {
+        'DB_NAME': os.getenv('DB_NAME'),
+        'DB_USER': os.getenv('DB_USER'),
+        'DB_PASSWORD': os.getenv('DB_PASSWORD'),
+        'DB_HOST': os.getenv('DB_HOST'),
+        'DB_PORT': os.getenv('DB_PORT'),
+        'DB_TABLE': os.getenv('DB_TABLE'),
+        'ACCESS_TOKEN': os.getenv('ACCESS_TOKEN'),
+        # Соединения, которые открываются и прогреваются до готовности сервера
+        'DB_POOL_MIN': int(os.getenv('DB_POOL_MIN', 2)),
+        'DB_POOL_MAX': int(os.getenv('DB_POOL_MAX', 10)),
+        # Таймаут подключения (секунды) и повторы чтения при потере соединения: число повторов и пауза перед ними
+        'DB_CONNECT_TIMEOUT': int(os.getenv('DB_CONNECT_TIMEOUT', 3)),
+        'DB_READ_RETRIES': int(os.getenv('DB_READ_RETRIES', 2)),
+        'DB_RETRY_DELAY': float(os.getenv('DB_RETRY_DELAY', 0.1)),
+        'DB_RETRY_MAX_DELAY': float(os.getenv('DB_RETRY_MAX_DELAY', 2)),
+        # Ошибки соединения подряд, после которых запросы сразу получают 503, и пауза до пробного запроса (секунды)
+        'BREAKER_FAILURES': int(os.getenv('BREAKER_FAILURES', 5)),
+        'BREAKER_RESET_TIMEOUT': float(os.getenv('BREAKER_RESET_TIMEOUT', 5)),
+        # Одновременные обращения к базе данных, длина очереди и время ожидания в ней (секунды)
+        'ADMISSION_LIMIT': int(os.getenv('ADMISSION_LIMIT', os.getenv('DB_POOL_MAX', 10))),
+        'ADMISSION_QUEUE': int(os.getenv('ADMISSION_QUEUE', 100)),
+        'ADMISSION_TIMEOUT': float(os.getenv('ADMISSION_TIMEOUT', 5)),
+        'ADMISSION_RETRY_AFTER': int(os.getenv('ADMISSION_RETRY_AFTER', 1)),
+        # Сколько секунд результат объединённого чтения отдаётся повторно, 0 - только одновременным запросам
+        'COALESCE_TTL': float(os.getenv('COALESCE_TTL', 0)),
+        # Период записи накопленных счётчиков пользователей (секунды) и размер буфера для досрочной записи
+        'COUNTERS_FLUSH_INTERVAL': float(os.getenv('COUNTERS_FLUSH_INTERVAL', 1)),
+        'COUNTERS_MAX_USERS': int(os.getenv('COUNTERS_MAX_USERS', 1000)),
+        # Сколько дней хранится журнал изменений для GET /api/changes
+        'CHANGE_LOG_RETENTION_DAYS': int(os.getenv('CHANGE_LOG_RETENTION_DAYS', 30)),
+        # На сколько месяцев вперёд создаются секции orders, сколько месяцев секции остаются в orders
+        # (0 - не архивировать) и удалять ли старые секции вместо переноса в схему archive
+        'ORDERS_PARTITIONS_AHEAD': int(os.getenv('ORDERS_PARTITIONS_AHEAD', 3)),
+        'ORDERS_HOT_MONTHS': int(os.getenv('ORDERS_HOT_MONTHS', 0)),
+        'ORDERS_ARCHIVE_DROP': os.getenv('ORDERS_ARCHIVE_DROP', 'false').lower() in ('1', 'true', 'yes'),
+        # Профилирование запросов: значение заголовка X-Profile для профиля по запросу, доля случайно
+        # профилируемых запросов к /api/, каталог для файлов профилей, период снятия стеков (секунды)
+        # и сколько последних профилей хранится в каталоге (более старые удаляются)
+        'PROFILE_TOKEN': os.getenv('PROFILE_TOKEN'),
+        'PROFILE_SAMPLE_RATE': float(os.getenv('PROFILE_SAMPLE_RATE', 0)),
+        'PROFILE_DIR': os.getenv('PROFILE_DIR', 'profiles'),
+        'PROFILE_INTERVAL': float(os.getenv('PROFILE_INTERVAL', 0.005)),
+        'PROFILE_KEEP': int(os.getenv('PROFILE_KEEP', 200)),
+        # Реплики для чтения: DSN через запятую, например 'host=10.0.0.2 dbname=mbt user=postgres password=...'
+        'DB_REPLICAS': [dsn.strip() for dsn in os.getenv('DB_REPLICAS', '').split(',') if dsn.strip()],
+        'DB_REPLICA_POLICY': os.getenv('DB_REPLICA_POLICY', 'round_robin'),
+        'DB_REPLICA_MAX_LAG': float(os.getenv('DB_REPLICA_MAX_LAG', 5)),
+        'DB_REPLICA_STICKY_SECONDS': float(os.getenv('DB_REPLICA_STICKY_SECONDS', 2)),
+        # Срок выполнения запроса к /api/ (секунды) и сроки отдельных маршрутов, например '/api/users/=30,/api/changes=60'
+        'REQUEST_TIMEOUT': float(os.getenv('REQUEST_TIMEOUT', 10)),
+        'REQUEST_TIMEOUTS': _route_timeouts(os.getenv('REQUEST_TIMEOUTS', '')),
+    }
+
+
+def __getattr__(name: str):
+    settings = load()
+    if name in settings:
+        return settings[name]
+    raise AttributeError(f"module 'config' has no attribute '{name}'")
@@ -0,0 +1,132 @@
+import logging
+import threading
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+counters_pending = metrics.gauge('counters_pending_users', 'Пользователи с ещё не записанными изменениями счётчиков')
+counters_flushed = metrics.counter('counters_flushed_users_total', 'Записанные в базу изменения счётчиков')
+counters_flush_errors = metrics.counter('counters_flush_errors_total', 'Неудачные записи счётчиков в базу')
+counters_dropped = metrics.counter('counters_dropped_users_total', 'Изменения счётчиков, отброшенные из-за ошибки в данных')
+
+# Прибавка к одному счётчику, накопленная в буфере, не выходит за пределы столбца integer
+DELTA_LIMIT = 2 ** 31 - 1
+
+
+class CounterBuffer:
+    """
+    Накапливает прибавки к счётчикам пользователей (rating, profit, orders) в памяти процесса
+    и записывает их в базу одним запросом раз в interval секунд или при накоплении max_users пользователей.
+    Прибавки к одному пользователю складываются, сумма ограничена DELTA_LIMIT.
+    При временной ошибке записи (retryable) прибавки возвращаются в буфер. При другой ошибке пользователи
+    записываются по одному, а прибавки, запись которых не удалась, отбрасываются, чтобы одна некорректная
+    запись не повторялась бесконечно и не блокировала остальные.
+    В случае аварийной остановки процесса теряются изменения не более чем за interval секунд.
+
+    Attributes:
+        flush_func: функция, которая записывает словарь {id: {столбец: прибавка}} в базу
+        interval (float): Период записи в секундах.
+        max_users (int): Количество пользователей в буфере, при котором запись выполняется досрочно.
+        retryable: функция, которая по исключению определяет, что запись можно повторить позже.
+            По умолчанию повторяются все ошибки.
+    """
+
+    def __init__(self, flush_func, interval: float = 1.0, max_users: int = 1000, retryable=None):
+        self.flush_func = flush_func
+        self.retryable = retryable or (lambda error: True)
+        self.interval = interval
+        self.max_users = max_users
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def add(self, id: int, deltas: dict[str, int]):
+        with self._lock:
+            self._merge(id, deltas)
+            size = len(self._pending)
+        counters_pending.set(size)
+        if size >= self.max_users:
+            self._wakeup.set()
+
+    def flush(self) -> int:
+        """Записывает накопленные прибавки. Возвращает количество записанных пользователей."""
+
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+            try:
+                self.flush_func(pending)
+            except Exception as e:
+                counters_flush_errors.inc()
+                if self.retryable(e):
+                    self._requeue(pending)
+                    raise
+                return self._flush_each(pending)
+            counters_flushed.inc(len(pending))
+            with self._lock:
+                counters_pending.set(len(self._pending))
+            return len(pending)
+
+    def _flush_each(self, pending: dict[int, dict[str, int]]) -> int:
+        flushed = 0
+        ids = list(pending)
+        for i, id in enumerate(ids):
+            try:
+                self.flush_func({id: pending[id]})
+            except Exception as e:
+                if self.retryable(e):
+                    self._requeue({id: pending[id] for id in ids[i:]})
+                    counters_flushed.inc(flushed)
+                    raise
+                counters_dropped.inc()
+                logger.error('Изменения счётчиков пользователя %s отброшены: %s %s', id, pending[id], e)
+                continue
+            flushed += 1
+        counters_flushed.inc(flushed)
+        with self._lock:
+            counters_pending.set(len(self._pending))
+        return flushed
+
+    def _requeue(self, pending: dict[int, dict[str, int]]):
+        with self._lock:
+            for id, deltas in pending.items():
+                self._merge(id, deltas)
+            counters_pending.set(len(self._pending))
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='counter-flush', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Останавливает фоновую запись и записывает остаток буфера."""
+
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Не удалось записать счётчики пользователей')
+
+    def _merge(self, id: int, deltas: dict[str, int]):
+        deltas = {column: value for column, value in deltas.items() if value}
+        if not deltas:
+            return
+        current = self._pending.setdefault(id, {})
+        for column, value in deltas.items():
+            current[column] = max(-DELTA_LIMIT, min(DELTA_LIMIT, current.get(column, 0) + value))
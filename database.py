@@ -1,7 +1,286 @@
+import asyncio
+import random
+import sys
+import threading
+import time
 import psycopg2
+from contextvars import ContextVar
 from datetime import date
-from psycopg2.extras import DictCursor
-from psycopg2.errors import UniqueViolation, ConnectionException
+from psycopg2.extensions import connection as _connection, TRANSACTION_STATUS_INERROR
+from psycopg2.extras import DictCursor, execute_values
+from psycopg2.pool import ThreadedConnectionPool, PoolError
+from psycopg2.errors import (UniqueViolation, ConnectionException, FeatureNotSupported, QueryCanceled,
+                             ExclusionViolation, InFailedSqlTransaction)
+from breaker import CircuitBreaker
+from profiling import current_profile
+
+
+# Таблицы, для которых при прогреве соединения подготавливается выборка по id
+HOT_TABLES = ('users', 'customers', 'orders')
+
+
+class Connection(_connection):
+    """Соединение psycopg2, которое помнит подготовленные на нём запросы (PREPARE)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+# Позиции WAL для чтения своих записей в пределах HTTP запроса:
+# {'min_lsn': позиция, которую должна догнать реплика, 'write_lsn': позиция после последней записи}
+read_your_writes: ContextVar[dict | None] = ContextVar('read_your_writes', default=None)
+
+
+class Deadline:
+    """
+    Срок выполнения HTTP запроса.
+    Каждый запрос к базе выполняется с SET LOCAL statement_timeout, равным оставшемуся времени,
+    а cancel() прерывает выполняющиеся запросы, например когда клиент отключился.
+    """
+
+    def __init__(self, timeout: float):
+        self.expires = time.monotonic() + timeout
+        self.cancelled = False
+        self._connections = set()
+        self._lock = threading.Lock()
+
+    def remaining_ms(self) -> int:
+        return max(1, int((self.expires - time.monotonic()) * 1000))
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires
+
+    def track(self, connection) -> bool:
+        """Запоминает соединение с выполняющимся запросом. Возвращает False, если срок уже отменён."""
+
+        with self._lock:
+            if self.cancelled:
+                return False
+            self._connections.add(connection)
+            return True
+
+    def untrack(self, connection):
+        # Ждёт завершения cancel(), чтобы соединение не вернулось в пул и не получило отмену чужого запроса
+        with self._lock:
+            self._connections.discard(connection)
+
+    def detached(self) -> 'Deadline':
+        """Срок с тем же окончанием, который не отменяется вместе с этим, например для общего объединённого чтения."""
+
+        deadline = Deadline(0)
+        deadline.expires = self.expires
+        return deadline
+
+    def cancel(self):
+        """Отменяет выполняющиеся запросы. Отмена отправляется под блокировкой, пока соединения заняты запросом."""
+
+        with self._lock:
+            self.cancelled = True
+            for connection in self._connections:
+                connection.cancel()
+
+
+request_deadline: ContextVar[Deadline | None] = ContextVar('request_deadline', default=None)
+
+
+def is_transient(error: Exception) -> bool:
+    """
+    Проверяет, что ошибка вызвана потерей соединения с сервером (перезапуск, переключение на реплику),
+    а не самим запросом, и запрос можно повторить на новом соединении.
+    """
+
+    if isinstance(error, psycopg2.InterfaceError):
+        return True
+    if not isinstance(error, psycopg2.OperationalError) or isinstance(error, QueryCanceled):
+        return False
+    # Ошибки клиента libpq не имеют кода, 08 - ошибки соединения, 57P01-57P03 - остановка сервера
+    return error.pgcode is None or error.pgcode.startswith('08') or error.pgcode in ('57P01', '57P02', '57P03')
+
+
+def retry_delay(attempt: int, base: float, maximum: float) -> float:
+    """Пауза перед повтором с экспоненциальным ростом и случайным разбросом, чтобы клиенты не повторяли разом."""
+
+    return random.uniform(0, min(maximum, base * 2 ** attempt))
+
+
+def parse_lsn(value: str | None) -> int:
+    """Переводит позицию WAL вида '16/B374D848' в число для сравнения. Пустое значение даёт 0."""
+
+    if not value:
+        return 0
+    high, low = value.split('/')
+    return (int(high, 16) << 32) + int(low, 16)
+
+
+def format_lsn(value: int) -> str:
+    return f'{value >> 32:X}/{value & 0xFFFFFFFF:X}'
+
+
+class Replica:
+    """
+    Реплика для чтения: пул соединений, задержка репликации и последняя применённая позиция WAL.
+    Пул создаётся и закрывается, а состояние проверяется только под lock.
+    """
+
+    def __init__(self, dsn: str, minconn: int, maxconn: int):
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.lock = threading.Lock()
+        self.pool = None
+        self.healthy = False
+        self.in_use = 0
+        self.lag = None
+        self.replay_lsn = 0
+        self.checked_at = None
+
+
+class ReplicaSet:
+    """
+    Набор реплик для чтения.
+    Реплика выбирается по кругу (round_robin) или наименее загруженная (least_busy).
+    Задержка реплики проверяется не чаще check_interval секунд, реплика с задержкой больше max_lag
+    или с ошибкой соединения исключается до следующей успешной проверки.
+    Реплику проверяет один поток, остальные в это время выбирают реплику по результату прошлой проверки.
+    Если свободных соединений с репликой нет, она считается занятой, а не недоступной.
+
+    Attributes:
+        sticky_seconds (float): Сколько секунд после записи объект DataBase читает с основного сервера.
+        connect_timeout (int | None): Таймаут подключения к реплике в секундах.
+    """
+
+    lag_query = ('SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() '
+                 'THEN 0 ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END, '
+                 'CASE WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn() ELSE pg_current_wal_lsn() END')
+
+    def __init__(self, dsns: list[str], minconn: int = 1, maxconn: int = 10, policy: str = 'round_robin',
+                 max_lag: float = 5.0, sticky_seconds: float = 2.0, check_interval: float = 1.0,
+                 connect_timeout: int | None = None):
+        if policy not in ('round_robin', 'least_busy'):
+            raise ValueError(f'Неизвестная политика выбора реплики: {policy}')
+        self.replicas = [Replica(dsn, minconn, maxconn) for dsn in dsns]
+        self.policy = policy
+        self.max_lag = max_lag
+        self.sticky_seconds = sticky_seconds
+        self.check_interval = check_interval
+        self.connect_timeout = connect_timeout
+        self._lock = threading.Lock()
+        self._next = 0
+
+    def acquire(self, min_lsn: int = 0) -> tuple[Replica, Connection] | None:
+        """
+        Выбирает реплику, которая применила WAL не раньше min_lsn, и выдаёт соединение с ней.
+        Возвращает None, если подходящей реплики нет и читать нужно с основного сервера.
+        """
+
+        for replica in self.replicas:
+            # Если реплику уже проверяет другой поток, её проверка пропускается
+            if self._due(replica) and replica.lock.acquire(blocking=False):
+                try:
+                    if self._due(replica):
+                        self._check(replica)
+                finally:
+                    replica.lock.release()
+
+        with self._lock:
+            candidates = [replica for replica in self.replicas if replica.healthy and replica.replay_lsn >= min_lsn]
+            if not candidates:
+                return None
+            if self.policy == 'least_busy':
+                replica = min(candidates, key=lambda candidate: candidate.in_use)
+            else:
+                replica = candidates[self._next % len(candidates)]
+                self._next += 1
+            replica.in_use += 1
+
+        try:
+            connection = replica.pool.getconn()
+        except PoolError:
+            # Все соединения с репликой заняты, чтение выполняется на основном сервере
+            self.release(replica, None)
+            return None
+        except psycopg2.Error:
+            self.release(replica, None, failed=True)
+            return None
+        connection.autocommit = True
+        return replica, connection
+
+    def release(self, replica: Replica, connection: Connection | None, failed: bool = False):
+        with self._lock:
+            replica.in_use -= 1
+            if failed:
+                replica.healthy = False
+        if connection is not None:
+            replica.pool.putconn(connection, close=failed or bool(connection.closed))
+
+    def _due(self, replica: Replica) -> bool:
+        return replica.checked_at is None or time.monotonic() - replica.checked_at >= self.check_interval
+
+    def check(self, replica: Replica):
+        """Обновляет задержку и позицию WAL реплики, исключает отставшую или недоступную реплику."""
+
+        with replica.lock:
+            self._check(replica)
+
+    def _check(self, replica: Replica):
+        replica.checked_at = time.monotonic()
+        try:
+            if replica.pool is None:
+                replica.pool = ThreadedConnectionPool(replica.minconn, replica.maxconn, replica.dsn,
+                                                      cursor_factory=DictCursor, connection_factory=Connection,
+                                                      connect_timeout=self.connect_timeout)
+            try:
+                connection = replica.pool.getconn()
+            except PoolError:
+                # Соединения заняты запросами, реплика отвечает, состояние остаётся прежним
+                return
+            try:
+                connection.autocommit = True
+                with connection.cursor() as cursor:
+                    cursor.execute(self.lag_query)
+                    lag, lsn = cursor.fetchone()
+                replica.pool.putconn(connection)
+            except psycopg2.Error:
+                replica.pool.putconn(connection, close=True)
+                raise
+            replica.lag = float(lag)
+            replica.replay_lsn = parse_lsn(lsn)
+            replica.healthy = replica.lag <= self.max_lag
+        except psycopg2.Error:
+            replica.healthy = False
+
+    def prewarm(self, tables: tuple[str, ...]):
+        for replica in self.replicas:
+            self.check(replica)
+            if not replica.healthy:
+                continue
+            connections = [replica.pool.getconn() for _ in range(replica.minconn)]
+            try:
+                for connection in connections:
+                    connection.autocommit = True
+                    with connection.cursor() as cursor:
+                        _prepare(cursor, tables)
+            finally:
+                for connection in connections:
+                    replica.pool.putconn(connection)
+
+    def close(self):
+        for replica in self.replicas:
+            with replica.lock:
+                if replica.pool is not None:
+                    replica.pool.closeall()
+                    replica.pool = None
+                replica.healthy = False
+
+
+def _prepare(cursor, tables: tuple[str, ...]):
+    prepared = cursor.connection.prepared
+    for table_name in tables:
+        statement = f'get_by_id_{table_name}'
+        if statement not in prepared:
+            cursor.execute(f'PREPARE "{statement}" AS SELECT * FROM "{table_name}" WHERE "id" = $1')
+            prepared.add(statement)
 
 
 class RecordNotFound(Exception):
@@ -18,6 +297,125 @@ class RecordNotFound(Exception):
             return 'RecordNotFound'
 
 
+class Transaction:
+    """
+    Контекст транзакции DataBase. Используется через DataBase.transaction().
+    Все операции внутри контекста выполняются в одной транзакции на одном соединении и фиксируются
+    одним COMMIT при выходе. При исключении транзакция откатывается.
+    Вложенные контексты выполняются в точке сохранения внешней транзакции: исключение откатывает только
+    изменения вложенного контекста, и внешняя транзакция может продолжиться. Если ошибку запроса перехватили
+    внутри контекста, при выходе из него изменения откатываются и выбрасывается InFailedSqlTransaction.
+    Поддерживает как with, так и async with (COMMIT и ROLLBACK выполняются в отдельном потоке).
+    """
+
+    def __init__(self, db: 'DataBase', readonly: bool = False):
+        self.db = db
+        self.readonly = readonly
+
+    def __enter__(self):
+        self.db._begin(self.readonly)
+        return self.db
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.db._end(commit=exc_type is None)
+        return False
+
+    async def __aenter__(self):
+        await asyncio.to_thread(self.db._begin, self.readonly)
+        return self.db
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await asyncio.to_thread(self.db._end, exc_type is None)
+        return False
+
+
+class ConnectionPool:
+    """
+    Пул соединений с базой данных PostgreSQL.
+    Метод get() возвращает объект DataBase на соединении из пула, DataBase.disconnect() возвращает соединение в пул.
+
+    Если указаны реплики, методы чтения DataBase выполняются на них, а запись на основном сервере.
+
+    Attributes:
+        minconn (int): Количество соединений, которые пул держит открытыми.
+        maxconn (int): Максимальное количество соединений. При превышении get() выбрасывает PoolError.
+        replicas (ReplicaSet | None): Реплики для чтения.
+        breaker (CircuitBreaker | None): Автомат отключения, при открытом автомате get() выбрасывает CircuitOpen.
+        connect_timeout (int | None): Таймаут подключения в секундах, чтобы не ждать таймаута TCP.
+        read_retries (int): Сколько раз повторяется чтение при потере соединения с сервером.
+        retry_delay (float): Начальная пауза перед повтором чтения в секундах.
+        retry_max_delay (float): Максимальная пауза перед повтором чтения в секундах.
+    """
+
+    def __init__(self, db_name: str, user: str, password: str, host: str, port=5432, minconn: int = 1,
+                 maxconn: int = 10, replicas: 'ReplicaSet | list[str] | None' = None,
+                 breaker: CircuitBreaker | None = None, connect_timeout: int | None = None, read_retries: int = 0,
+                 retry_delay: float = 0.1, retry_max_delay: float = 2.0):
+        self.db_name = db_name
+        self.user = user
+        self.password = password
+        self.host = host
+        self.port = port
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.breaker = breaker
+        self.read_retries = read_retries
+        self.retry_delay = retry_delay
+        self.retry_max_delay = retry_max_delay
+        self._pool = ThreadedConnectionPool(minconn, maxconn, database=db_name, user=user, password=password,
+                                            host=host, port=port, cursor_factory=DictCursor,
+                                            connection_factory=Connection, connect_timeout=connect_timeout)
+        if isinstance(replicas, list):
+            replicas = ReplicaSet(replicas, minconn=minconn, maxconn=maxconn,
+                                  connect_timeout=connect_timeout) if replicas else None
+        self.replicas = replicas
+
+    def get(self) -> 'DataBase':
+        profile = current_profile.get()
+        if profile is None:
+            return DataBase.from_pool(self, self.connect())
+        with profile.span('connect'):
+            return DataBase.from_pool(self, self.connect())
+
+    def connect(self) -> Connection:
+        """Выдаёт соединение из пула. Если база недоступна, сразу выбрасывает CircuitOpen."""
+
+        if self.breaker is None:
+            return self._pool.getconn()
+        self.breaker.allow()
+        try:
+            return self._pool.getconn()
+        except psycopg2.Error as e:
+            if is_transient(e):
+                self.breaker.failure()
+            raise
+
+    def prewarm(self, count: int | None = None, tables: tuple[str, ...] = HOT_TABLES):
+        """
+        Открывает count соединений (по умолчанию minconn) и подготавливает на каждом частые запросы,
+        чтобы первые запросы к серверу не тратили время на подключение и разбор SQL.
+        """
+
+        databases = [self.get() for _ in range(count or self.minconn)]
+        try:
+            for db in databases:
+                db.prepare_hot_statements(tables)
+        finally:
+            for db in databases:
+                db.disconnect()
+        if self.replicas is not None:
+            self.replicas.prewarm(tables)
+
+    def put(self, connection, close: bool = False):
+        # Незавершённая транзакция откатывается пулом, разорванное соединение закрывается
+        self._pool.putconn(connection, close=close or bool(connection.closed))
+
+    def close(self):
+        self._pool.closeall()
+        if self.replicas is not None:
+            self.replicas.close()
+
+
 class DataBase:
     """
     Class DataBase:
@@ -31,6 +429,7 @@ class DataBase:
         host (str): Адрес сервера базы данных.
         port (int): Порт сервера базы данных (по умолчанию 5432).
         status (bool): Статус подключения к базе данных.
+        replicas (ReplicaSet | list[str] | None): Реплики для методов чтения get_*. Запись всегда идёт на основной сервер.
 
     Methods:
         connect_db() -> object:
@@ -52,23 +451,256 @@ class DataBase:
             Удаляет таблицу из базы данных. Если таблица не существует, операция игнорируется.
             В случае ошибки возвращает pg.Error.
 
+        transaction(readonly: bool = False) -> Transaction:
+            Объединяет несколько операций в одну транзакцию: with db.transaction(): ... или async with db.transaction(): ...
+            Вне транзакции соединение работает в режиме autocommit, поэтому чтение не тратит запросы на BEGIN/ROLLBACK.
+            Вложенный контекст выполняется в точке сохранения (SAVEPOINT) внешней транзакции.
+
         disconnect():
             Отключает текущее соединение с базой данных и освобождает ресурсы.
             После вызова этого метода дальнейшее взаимодействие с базой данных через текущий экземпляр класса DataBase становится невозможным.
 """
 
-    def __init__(self, db_name: str, user: str, password: str, host: str, port=5432):
+    def __init__(self, db_name: str, user: str, password: str, host: str, port=5432,
+                 replicas: ReplicaSet | list[str] | None = None):
         self.db_name = db_name
         self.user = user
         self.password = password
         self.host = host
         self.port = port
         self.connection = psycopg2.connect(database=db_name, user=user, password=password, host=host, port=port,
-                                           cursor_factory=DictCursor)
+                                           cursor_factory=DictCursor, connection_factory=Connection)
+        self._pool = None
+        if isinstance(replicas, list):
+            replicas = ReplicaSet(replicas) if replicas else None
+        self.replicas = replicas
+        self._setup()
+
+    @classmethod
+    def from_pool(cls, pool: 'ConnectionPool', connection) -> 'DataBase':
+        """
+        Создаёт объект DataBase поверх соединения, взятого из пула.
+        Метод disconnect() возвращает такое соединение обратно в пул.
+        """
+
+        db = cls.__new__(cls)
+        db.db_name = pool.db_name
+        db.user = pool.user
+        db.password = pool.password
+        db.host = pool.host
+        db.port = pool.port
+        db.connection = connection
+        db._pool = pool
+        db.replicas = pool.replicas
+        db._setup()
+        return db
+
+    def _setup(self):
+        # Одиночные запросы фиксируются сами, транзакция открывается только в transaction()
+        self.connection.autocommit = True
         self.cursor = self.connection.cursor()
+        self._transaction_depth = 0
+        self._readonly = False
+        self._last_write = None
 
     def disconnect(self):
-        self.connection.close()
+        if self.connection is None:
+            # Соединение уже закрыто при неудачном переподключении
+            return
+        if self._pool is None:
+            self.connection.close()
+        else:
+            self.cursor.close()
+            self._pool.put(self.connection)
+
+    def transaction(self, readonly: bool = False) -> Transaction:
+        """
+        Возвращает контекст транзакции. Все вызовы методов внутри контекста фиксируются одним COMMIT.
+
+        Args:
+            readonly: открыть транзакцию только для чтения
+
+        Returns:
+            Объект Transaction для использования в with или async with.
+        """
+
+        return Transaction(self, readonly)
+
+    @property
+    def in_transaction(self) -> bool:
+        """Выполняются ли запросы внутри transaction()."""
+
+        return self._transaction_depth > 0
+
+    def _begin(self, readonly: bool = False):
+        if self._transaction_depth == 0:
+            self.connection.autocommit = False
+            self._readonly = readonly
+            if readonly:
+                self.cursor.execute('SET TRANSACTION READ ONLY')
+        else:
+            # Вложенный контекст открывает точку сохранения, при ошибке откатываются только его изменения
+            self.cursor.execute(f'SAVEPOINT transaction_{self._transaction_depth}')
+        self._transaction_depth += 1
+
+    def _end(self, commit: bool = True):
+        self._transaction_depth -= 1
+        # Ошибку запроса перехватили внутри контекста: COMMIT прерванной транзакции молча откатил бы её
+        aborted = commit and self.connection.info.transaction_status == TRANSACTION_STATUS_INERROR
+        if self._transaction_depth:
+            savepoint = f'transaction_{self._transaction_depth}'
+            if not commit or aborted:
+                self.cursor.execute(f'ROLLBACK TO SAVEPOINT {savepoint}')
+            self.cursor.execute(f'RELEASE SAVEPOINT {savepoint}')
+        else:
+            try:
+                if commit and not aborted:
+                    self.connection.commit()
+                else:
+                    self.connection.rollback()
+            finally:
+                self.connection.autocommit = True
+        if aborted:
+            raise InFailedSqlTransaction('Транзакция прервана ошибкой запроса, изменения отменены')
+        if commit and not self._transaction_depth and not self._readonly:
+            self._written()
+
+    def _commit(self):
+        # Внутри transaction() фиксацию выполняет контекст транзакции
+        if not self._transaction_depth:
+            self.connection.commit()
+            self._written()
+
+    def _written(self):
+        # Запоминает запись, чтобы следующие чтения не ушли на отстающую реплику
+        if self.replicas is None:
+            return
+        self._last_write = time.monotonic()
+        session = read_your_writes.get()
+        if session is not None:
+            self.cursor.execute('SELECT pg_current_wal_lsn()')
+            session['write_lsn'] = max(session['write_lsn'], parse_lsn(self.cursor.fetchone()[0]))
+
+    def _acquire_replica(self) -> tuple[Replica, Connection] | None:
+        if self.replicas is None or self._transaction_depth:
+            return None
+        if self._last_write is not None and time.monotonic() - self._last_write < self.replicas.sticky_seconds:
+            return None
+        session = read_your_writes.get()
+        min_lsn = max(session['min_lsn'], session['write_lsn']) if session is not None else 0
+        return self.replicas.acquire(min_lsn)
+
+    def _read(self, query: str, params: tuple = (), statement: str | None = None) -> list[dict]:
+        """
+        Выполняет запрос на чтение и возвращает записи в виде словарей.
+        Вне транзакции запрос уходит на реплику, если она настроена и успела применить свежие записи.
+        При обрыве соединения с репликой она исключается, а запрос повторяется на основном сервере.
+        Отмена запроса по сроку или при отключении клиента (QueryCanceled) реплику не исключает и не повторяется.
+        """
+
+        acquired = self._acquire_replica()
+        if acquired is None:
+            return self._read_primary(query, params, statement)
+
+        replica, connection = acquired
+        try:
+            with connection.cursor() as cursor:
+                records = self._fetch(cursor, query, params, statement)
+        except Exception as e:
+            if not is_transient(e):
+                self.replicas.release(replica, connection)
+                raise
+            self.replicas.release(replica, connection, failed=True)
+            return self._read_primary(query, params, statement)
+        self.replicas.release(replica, connection)
+        return records
+
+    def _read_primary(self, query: str, params: tuple, statement: str | None) -> list[dict]:
+        # Чтение повторяется на новом соединении, если сервер перезапустился или соединение оборвалось
+        attempt = 0
+        while True:
+            try:
+                return self._fetch(self.cursor, query, params, statement)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                deadline = request_deadline.get()
+                if (self._pool is None or attempt >= self._pool.read_retries or self._transaction_depth
+                        or not is_transient(e) or (deadline is not None and deadline.expired())):
+                    raise
+            time.sleep(retry_delay(attempt, self._pool.retry_delay, self._pool.retry_max_delay))
+            attempt += 1
+            self._reconnect()
+
+    def _reconnect(self):
+        # Оборванное соединение закрывается, вместо него из пула берётся новое
+        self.cursor.close()
+        self._pool.put(self.connection, close=True)
+        self.connection = None
+        last_write = self._last_write
+        self.connection = self._pool.connect()
+        self._setup()
+        self._last_write = last_write
+
+    def _execute(self, cursor, query: str, params=None):
+        profile = current_profile.get()
+        if profile is None:
+            self._execute_query(cursor, query, params)
+            return
+        with profile.span(_caller_name(self), 'query'):
+            self._execute_query(cursor, query, params)
+
+    def _execute_query(self, cursor, query: str, params=None):
+        # В пределах срока HTTP запроса запрос к базе ограничивается оставшимся временем
+        deadline = request_deadline.get()
+        if deadline is not None:
+            if not deadline.track(cursor.connection):
+                raise QueryCanceled('Запрос отменён')
+            query = f'SET LOCAL statement_timeout = {deadline.remaining_ms()}; {query}'
+        # Автомат отключения учитывает только соединения с основным сервером
+        breaker = self._pool.breaker if self._pool is not None and cursor.connection is self.connection else None
+        try:
+            cursor.execute(query, params)
+        except psycopg2.Error as e:
+            if breaker is not None and is_transient(e):
+                breaker.failure()
+            raise
+        finally:
+            if deadline is not None:
+                deadline.untrack(cursor.connection)
+        if breaker is not None:
+            breaker.success()
+
+    def _fetch(self, cursor, query: str, params: tuple, statement: str | None) -> list[dict]:
+        prepared = cursor.connection.prepared
+        if statement in prepared:
+            placeholders = ', '.join(['%s'] * len(params))
+            try:
+                self._execute(cursor, f'EXECUTE "{statement}" ({placeholders})', params)
+            except FeatureNotSupported:
+                # Схема таблицы изменилась после PREPARE, подготовленный запрос больше не годится
+                if cursor.connection is self.connection and self._transaction_depth:
+                    raise
+                prepared.discard(statement)
+                cursor.execute(f'DEALLOCATE "{statement}"')
+                self._execute(cursor, query, params or None)
+        else:
+            self._execute(cursor, query, params or None)
+        profile = current_profile.get()
+        if profile is None:
+            return [dict(record) for record in cursor.fetchall()]
+        with profile.span(_caller_name(self), 'fetch'):
+            return [dict(record) for record in cursor.fetchall()]
+
+    def _rollback(self):
+        if not self._transaction_depth and not self.connection.closed:
+            self.connection.rollback()
+
+    def prepare_hot_statements(self, tables: tuple[str, ...] = HOT_TABLES):
+        """
+        Подготавливает на соединении выборку по id для указанных таблиц (PREPARE).
+        После этого get_by_id для этих таблиц выполняется через EXECUTE без повторного разбора и планирования.
+        """
+
+        _prepare(self.cursor, tables)
 
     def get_by_id(self, table_name: str, id: int) -> dict:
         """
@@ -84,21 +716,15 @@ class DataBase:
         """
 
         select_query = f'SELECT * FROM "{table_name}" WHERE "id" = %s;'
-        try:
-            self.cursor.execute(select_query, (id,))
-            records = self.cursor.fetchall()
-            self.connection.commit()
-            records_list = [dict(record) for record in records]
-            if records_list:
-                record = records_list[0]
-                return record
-            else:
-                raise RecordNotFound()
-        except Exception as e:
-            self.connection.rollback()
-            raise e
+        records_list = self._read(select_query, (id,), statement=f'get_by_id_{table_name}')
+        if records_list:
+            record = records_list[0]
+            return record
+        else:
+            raise RecordNotFound()
 
-    def get_by_param(self, table_name: str, param: str, value: str | int) -> list[dict]:
+    def get_by_param(self, table_name: str, param: str, value: str | int, date_from: date | None = None,
+                     date_to: date | None = None) -> list[dict]:
         """
         Выполняет выборку записей из таблицы на основе значения столбца.
         В качестве условия поиска использует название столбца (param) и его значение (числовое или строковое)
@@ -106,6 +732,8 @@ class DataBase:
             table_name: название таблицы
             param: наименование столбца
             value: значение столбца
+            date_from: начало диапазона order_date включительно, только для orders и order_workers
+            date_to: конец диапазона order_date включительно, только для orders и order_workers
 
         Returns:
         Возвращает список с найденными записями d виде словаря в их типе.
@@ -117,15 +745,37 @@ class DataBase:
         else:
             select_query = f'SELECT * FROM "{table_name}" WHERE "{param}" = CAST(%s AS INTEGER)'
 
-        try:
-            self.cursor.execute(select_query, (value,))
-            records = self.cursor.fetchall()
-            records_list = [dict(record) for record in records]
-            return records_list
-        except Exception as e:
-            raise e
-        finally:
-            self.connection.rollback()
+        window, params = _date_window(date_from, date_to)
+        if window:
+            select_query += f' AND {window}'
+        return self._read(select_query, (value, *params))
+
+    def get_by_phone(self, table_name: str, phone: str, prefix: bool = False, limit: int = 50) -> list[dict]:
+        """
+        Ищет записи users или customers по нормализованному телефону phone_digits
+        (migrations/005_phone_digits.sql): точно или по началу номера. Формат номера не важен:
+        '+7 (912) 000-00-00', '8 912 0000000' и '79120000000' находят одну и ту же запись.
+
+        Args:
+            table_name: название таблицы
+            phone: номер или начало номера
+            prefix: искать номера, начинающиеся с phone
+            limit: максимальное количество записей при поиске по началу номера
+
+        Returns:
+            Возвращает список найденных записей. Если в phone нет цифр, возвращает пустой список.
+        """
+
+        digits = normalize_phone(phone, prefix=prefix)
+        if not digits:
+            return []
+        if prefix:
+            # Индекс text_pattern_ops упорядочен оператором ~<~, с ним LIMIT читает первые записи индекса без сортировки
+            select_query = (f'SELECT * FROM "{table_name}" WHERE "phone_digits" LIKE %s '
+                            f'ORDER BY "phone_digits" USING ~<~ LIMIT %s')
+            return self._read(select_query, (f'{digits}%', limit))
+        select_query = f'SELECT * FROM "{table_name}" WHERE "phone_digits" = %s'
+        return self._read(select_query, (digits,))
 
     def get_by_pattern_str(self, table_name: str, param: str, pattern: str | int) -> list[dict]:
         """
@@ -142,15 +792,7 @@ class DataBase:
 
         select_query = f'SELECT * FROM "{table_name}" WHERE {param} ILIKE %s'
         value = f'%{pattern}%'
-        try:
-            self.cursor.execute(select_query, (value,))
-            records = self.cursor.fetchall()
-            records_list = [dict(record) for record in records]
-            return records_list
-        except Exception as e:
-            raise e
-        finally:
-            self.connection.rollback()
+        return self._read(select_query, (value,))
 
     def get_by_size(self, table_name: str, param: str, max_value: int | date, min_value: int | date) -> list:
         """
@@ -171,36 +813,27 @@ class DataBase:
         select_query = f'SELECT * FROM "{table_name}" WHERE {param} BETWEEN %s AND %s'
         max_value = f'%{max_value}%'
         min_value = f'%{min_value}%'
-        try:
-            self.cursor.execute(select_query, (min_value, max_value))
-            records = self.cursor.fetchall()
-            records_list = [dict(record) for record in records]
-            return records_list
-        except Exception as e:
-            raise e
-        finally:
-            self.connection.rollback()
+        return self._read(select_query, (min_value, max_value))
 
-    def get_all(self, table_name: str) -> list:
+    def get_all(self, table_name: str, date_from: date | None = None, date_to: date | None = None) -> list:
         """
         Возвращает все записи из таблицы.
+        Для orders и order_workers можно указать диапазон order_date: у секционированной orders
+        тогда читаются только секции этого диапазона.
         Args:
             table_name: название атблицы
+            date_from: начало диапазона order_date включительно
+            date_to: конец диапазона order_date включительно
 
         Returns:
             Возвращает список со значениями
         """
 
         select_query = f'SELECT * FROM "{table_name}"'
-        try:
-            self.cursor.execute(select_query)
-            records = self.cursor.fetchall()
-            records_list = [dict(record) for record in records]
-            return records_list
-        except Exception as e:
-            raise e
-        finally:
-            self.connection.rollback()
+        window, params = _date_window(date_from, date_to)
+        if window:
+            select_query += f' WHERE {window}'
+        return self._read(select_query, params)
 
     def insert(self, table_name: str, **kwargs):  # Добавление нового кортежа
         """
@@ -220,16 +853,16 @@ class DataBase:
 
         insert_query = f'INSERT INTO "{table_name}" ({keys}) VALUES ({placeholders}) RETURNING *'
         try:
-            self.cursor.execute(insert_query, values)
+            self._execute(self.cursor, insert_query, values)
             record = self.cursor.fetchone()
             result = dict(record)
-            self.connection.commit()
+            self._commit()
             return result
         except UniqueViolation as e:
-            self.connection.rollback()
+            self._rollback()
             raise e
         except Exception as e:
-            self.connection.rollback()
+            self._rollback()
             raise e
 
     def delete_by_id(self, table_name: str, id: int):  # Удаление кортежа
@@ -247,13 +880,13 @@ class DataBase:
         delete_query = f'DELETE FROM "{table_name}" WHERE id = %s RETURNING *'
 
         try:
-            self.cursor.execute(delete_query, (id,))
+            self._execute(self.cursor, delete_query, (id,))
             record = self.cursor.fetchone()
             result = dict(record)
-            self.connection.commit()
+            self._commit()
             return result
         except Exception as e:
-            self.connection.rollback()
+            self._rollback()
             raise e
 
     def delete_by_param(self, table_name: str, param: str, value: int | str):
@@ -277,13 +910,13 @@ class DataBase:
                             f'RETURNING *')
 
         try:
-            self.cursor.execute(delete_query, (value,))
+            self._execute(self.cursor, delete_query, (value,))
             records = self.cursor.fetchall()
             result = [dict(record) for record in records]
-            self.connection.commit()
+            self._commit()
             return result
         except Exception as e:
-            self.connection.rollback()
+            self._rollback()
             raise e
 
     def update_record(self, table_name: str, id: int, updates: dict) -> dict:
@@ -305,12 +938,294 @@ class DataBase:
         values.append(id)  # добавляем id в конец списка параметров
 
         query = f'UPDATE "{table_name}" SET {set_clause} WHERE id = %s RETURNING *'
-        self.cursor.execute(query, values)
+        self._execute(self.cursor, query, values)
         try:
             record = self.cursor.fetchone()
             result = dict(record)
-            self.connection.commit()
+            self._commit()
             return result
         except TypeError as e:
-            self.connection.rollback()
+            self._rollback()
             raise TypeError(f'Запись не обновлена, {e}')
+
+    def staff_order(self, order_id: int, skills: list[str] | None = None, tools: list[str] | None = None,
+                    count: int | None = None) -> list[dict]:
+        """
+        Подбирает и назначает исполнителей на заказ в одной транзакции.
+        Кандидаты отбираются по навыкам и инструментам, у них не должно быть назначений на другие заказы,
+        пересекающиеся по дате и времени с текущим. Кандидаты сортируются по рейтингу и назначаются одним запросом.
+        Строка заказа и строки выбранных исполнителей блокируются, поэтому параллельные вызовы
+        не выбирают одного исполнителя. Пересечение назначений окончательно проверяет триггер
+        из migrations/006_worker_overlap.sql: если кого-то из кандидатов за это время назначили на другой
+        пересекающийся заказ, кандидаты назначаются по одному, такой исполнитель пропускается,
+        и вместо него подбирается следующий.
+        Для быстрого поиска необходимы индексы из migrations/001_order_staffing.sql
+
+        Args:
+            order_id: id заказа
+            skills: необходимые навыки исполнителя (все должны присутствовать)
+            tools: необходимые инструменты исполнителя, по умолчанию инструменты заказа
+            count: сколько исполнителей добавить, но не больше недостающего до count_workers количества,
+                по умолчанию недостающее количество
+
+        Returns:
+            Возвращает список добавленных записей order_workers.
+            Если заказ не найден возвращает ошибку RecordNotFound.
+        """
+
+        order_query = ('SELECT "id", "order_date", "start_time", "finish_time", "count_workers", "tools" '
+                       'FROM "orders" WHERE "id" = %s FOR UPDATE')
+        assigned_query = 'SELECT count(*) FROM "order_workers" WHERE "order_id" = %s'
+        candidates_query = '''
+            SELECT u."id" FROM "users" AS u
+            WHERE tag_array(u."skills") @> %(skills)s::text[]
+              AND tag_array(u."tools") @> %(tools)s::text[]
+              AND NOT EXISTS (
+                  SELECT 1 FROM "order_workers" AS ow
+                  JOIN "orders" AS o ON o."id" = ow."order_id"
+                  WHERE ow."worker_id" = u."id"
+                    AND o."order_date" = %(order_date)s
+                    AND COALESCE(o."start_time", '00:00'::time) < COALESCE(%(finish_time)s::time, '24:00'::time)
+                    AND COALESCE(%(start_time)s::time, '00:00'::time) < COALESCE(o."finish_time", '24:00'::time))
+              AND u."id" <> ALL(%(skipped)s::bigint[])
+            ORDER BY u."rating" DESC NULLS LAST, u."id"
+            LIMIT %(limit)s
+            FOR UPDATE OF u SKIP LOCKED'''
+        insert_query = ('INSERT INTO "order_workers" ("order_id", "worker_id") '
+                        'SELECT %s, "worker_id" FROM unnest(%s::bigint[]) WITH ORDINALITY AS w("worker_id", "n") '
+                        'ORDER BY "n" RETURNING *')
+        with self.transaction():
+            self._execute(self.cursor, order_query, (order_id,))
+            order = self.cursor.fetchone()
+            if order is None:
+                raise RecordNotFound(f'Заказ {order_id} не найден')
+
+            self._execute(self.cursor, assigned_query, (order_id,))
+            remaining = (order['count_workers'] or 0) - self.cursor.fetchone()[0]
+            count = remaining if count is None else min(count, remaining)
+            if count <= 0:
+                return []
+
+            if tools is None:
+                tools = order['tools'] or []
+            params = {
+                'skills': _tags(skills),
+                'tools': _tags(tools),
+                'order_date': order['order_date'],
+                'start_time': order['start_time'],
+                'finish_time': order['finish_time'],
+                'skipped': [],
+            }
+            added = []
+            while len(added) < count:
+                params['limit'] = count - len(added)
+                self._execute(self.cursor, candidates_query, params)
+                worker_ids = [record['id'] for record in self.cursor.fetchall()]
+                if not worker_ids:
+                    break
+                # Кандидаты выбраны по снимку начала запроса, триггер проверяет пересечение после блокировки
+                try:
+                    with self.transaction():
+                        self._execute(self.cursor, insert_query, (order_id, worker_ids))
+                        added += [dict(record) for record in self.cursor.fetchall()]
+                    continue
+                except ExclusionViolation:
+                    pass
+                for worker_id in worker_ids:
+                    try:
+                        with self.transaction():
+                            self._execute(self.cursor, insert_query, (order_id, [worker_id]))
+                            added.append(dict(self.cursor.fetchone()))
+                    except ExclusionViolation:
+                        params['skipped'].append(worker_id)
+            return added
+
+    def increment_counters(self, table_name: str, deltas: dict[int, dict[str, int]]) -> list[int]:
+        """
+        Прибавляет значения к числовым столбцам нескольких записей одним запросом
+        UPDATE ... SET x = x + d FROM (VALUES ...). Значения не перезаписываются, поэтому
+        одновременные изменения не теряются.
+
+        Args:
+            table_name: название таблицы
+            deltas: словарь {id записи: {столбец: прибавка}}
+
+        Returns:
+            Возвращает список id обновлённых записей. Записи, которых нет в таблице, пропускаются.
+        """
+
+        if not deltas:
+            return []
+        columns = sorted({column for values in deltas.values() for column in values})
+        set_clause = ', '.join([f'"{column}" = COALESCE(t."{column}", 0) + v."{column}"' for column in columns])
+        names = ', '.join(['"id"'] + [f'"{column}"' for column in columns])
+        template = '(' + ', '.join(['%s::bigint'] * (len(columns) + 1)) + ')'
+        rows = [(id, *(values.get(column, 0) for column in columns)) for id, values in deltas.items()]
+
+        update_query = (f'UPDATE "{table_name}" AS t SET {set_clause} FROM (VALUES %s) AS v({names}) '
+                        f'WHERE t."id" = v."id" RETURNING t."id"')
+        try:
+            records = execute_values(self.cursor, update_query, rows, template=template, page_size=len(rows),
+                                     fetch=True)
+            self._commit()
+            return [record[0] for record in records]
+        except Exception as e:
+            self._rollback()
+            raise e
+
+
+    def get_changes(self, since: int, limit: int = 500, tables: list[str] | None = None) -> tuple[list[dict], int]:
+        """
+        Возвращает изменения из журнала change_log после позиции since (migrations/002_change_log.sql).
+        Изменения возвращаются только до первой записи транзакции, которая началась позже ещё не завершённой
+        транзакции: иначе незавершённая транзакция могла бы позже зафиксировать изменение с меньшим id,
+        и клиент пропустил бы его.
+
+        Args:
+            since: id последнего полученного изменения
+            limit: максимальное количество изменений
+            tables: вернуть изменения только указанных таблиц
+
+        Returns:
+            Возвращает список изменений и позицию, с которой нужно запросить следующую страницу.
+        """
+
+        select_query = ('SELECT "id", "table_name", "operation", "row_id", "row_data", '
+                        '"txid" < pg_snapshot_xmin(pg_current_snapshot()) AS "settled" '
+                        'FROM "change_log" WHERE "id" > %s')
+        params = [since]
+        if tables:
+            select_query += ' AND "table_name" = ANY(%s)'
+            params.append(list(tables))
+        select_query += ' ORDER BY "id" LIMIT %s'
+        params.append(limit)
+
+        changes = []
+        for record in self._read(select_query, tuple(params)):
+            if not record.pop('settled'):
+                break
+            changes.append(record)
+        return changes, changes[-1]['id'] if changes else since
+
+    def get_change_positions(self) -> tuple[int, int]:
+        """
+        Возвращает позиции журнала change_log (migrations/007_change_log_positions.sql):
+        наибольший id изменения, удалённого очисткой журнала, и начальную позицию для нового клиента.
+        Начальная позиция - id перед первым изменением транзакции, которая началась позже ещё не завершённой
+        (по тому же правилу, что и get_changes), а если таких нет - последнее изменение журнала
+        (функция change_log_settled_id).
+        """
+
+        select_query = ('SELECT (SELECT "pruned_id" FROM "change_log_state") AS "pruned", '
+                        'change_log_settled_id() AS "settled"')
+        record = self._read(select_query)[0]
+        return record['pruned'], record['settled']
+
+    def create_order_partitions(self, date_from: date, date_to: date) -> int:
+        """
+        Создаёт недостающие месячные секции orders, покрывающие даты с date_from по date_to
+        (migrations/004_partition_orders.sql).
+
+        Returns:
+            Возвращает количество созданных секций.
+        """
+
+        try:
+            self._execute(self.cursor, 'SELECT create_order_partitions(%s, %s)', (date_from, date_to))
+            count = self.cursor.fetchone()[0]
+            self._commit()
+            return count
+        except Exception as e:
+            self._rollback()
+            raise e
+
+    def archive_order_partitions(self, before: date, drop: bool = False) -> list[str]:
+        """
+        Отсоединяет секции orders, целиком относящиеся к датам раньше before, и переносит их
+        вместе с назначениями исполнителей в схему archive. Если месяц уже архивирован, строки секции
+        добавляются в существующую архивную таблицу (migrations/008_archive_existing_partitions.sql).
+        При drop=True данные удаляются.
+
+        Returns:
+            Возвращает имена отсоединённых секций.
+        """
+
+        try:
+            self._execute(self.cursor, 'SELECT archive_order_partitions(%s, %s)', (before, drop))
+            partitions = [record[0] for record in self.cursor.fetchall()]
+            self._commit()
+            return partitions
+        except Exception as e:
+            self._rollback()
+            raise e
+
+    def prune_changes(self, days: int) -> int:
+        """
+        Удаляет из журнала change_log изменения старше указанного количества дней
+        и запоминает наибольший id удалённого изменения (get_change_positions).
+
+        Returns:
+            Возвращает количество удалённых записей.
+        """
+
+        delete_query = ('WITH "deleted" AS (DELETE FROM "change_log" '
+                        'WHERE "changed_at" < now() - make_interval(days => %s) RETURNING "id") '
+                        'UPDATE "change_log_state" SET "pruned_id" = GREATEST("pruned_id", (SELECT max("id") FROM "deleted")) '
+                        'RETURNING (SELECT count(*) FROM "deleted")')
+        try:
+            self._execute(self.cursor, delete_query, (days,))
+            count = self.cursor.fetchone()[0]
+            self._commit()
+            return count
+        except Exception as e:
+            self._rollback()
+            raise e
+
+
+def normalize_phone(phone: str | None, prefix: bool = False) -> str | None:
+    """
+    Оставляет в номере только цифры, номер из 11 цифр с ведущей 8 приводит к 7, как функция phone_digits в базе.
+    Для начала номера (prefix=True) ведущая 8 заменяется на 7 и у неполного номера, так как полные номера хранятся с 7.
+    """
+
+    digits = ''.join(char for char in phone or '' if char.isdigit() and char.isascii())
+    if digits.startswith('8') and (len(digits) == 11 or prefix and len(digits) < 11):
+        digits = '7' + digits[1:]
+    return digits or None
+
+
+def _caller_name(db: DataBase) -> str:
+    """Имя публичного метода DataBase, из которого выполняется запрос. Используется только при профилировании."""
+
+    frame = sys._getframe(1)
+    while frame is not None:
+        if not frame.f_code.co_name.startswith('_') and frame.f_locals.get('self') is db:
+            return f'DataBase.{frame.f_code.co_name}'
+        frame = frame.f_back
+    return 'DataBase'
+
+
+def _date_window(date_from: date | None, date_to: date | None) -> tuple[str, tuple]:
+    """
+    Условие на order_date по диапазону дат и его параметры %s.
+    psycopg2 подставляет параметры на стороне клиента, поэтому планировщик видит даты как константы
+    и отсекает секции orders вне диапазона.
+    """
+
+    conditions = []
+    params = ()
+    if date_from is not None:
+        conditions.append('"order_date" >= %s')
+        params += (date_from,)
+    if date_to is not None:
+        conditions.append('"order_date" <= %s')
+        params += (date_to,)
+    return ' AND '.join(conditions), params
+
+
+def _tags(values: list[str] | None) -> list[str]:
+    """Приводит список навыков или инструментов к виду, в котором они хранятся в индексе tag_array."""
+
+    if not values:
+        return []
+    return sorted({str(value).strip().lower() for value in values if str(value).strip()})
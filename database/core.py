@@ -1,3 +1,4 @@
+from functools import cache
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.engine.url import URL
@@ -5,24 +6,28 @@ from dotenv import load_dotenv
 import os
 
 
-load_dotenv('/Control_DB/.env')
+@cache
+def get_engine():
+    """Создаёт engine при первом обращении, импорт модуля не открывает соединений."""
 
-database = {
-    'drivername': 'postgres',
-    'host': os.getenv('DB_HOST'),
-    'port': os.getenv('DB_PORT'),
-    'username': os.getenv('DB_USER'),
-    'password': os.getenv('DB_PASSWORD'),
-    'database': os.getenv('DB_NAME'),
+    load_dotenv('/Control_DB/.env')
+    database = {
+        'drivername': 'postgres',
+        'host': os.getenv('DB_HOST'),
+        'port': os.getenv('DB_PORT'),
+        'username': os.getenv('DB_USER'),
+        'password': os.getenv('DB_PASSWORD'),
+        'database': os.getenv('DB_NAME'),
 
-}
-engine = create_engine(
-    url=URL(**database),
-    echo=True,
-    pool_size=5,
-    max_overflow=10
-)
+    }
+    return create_engine(
+        url=URL(**database),
+        echo=False,
+        pool_size=5,
+        max_overflow=10
+    )
 
-with engine.connect() as conn:
-    res = conn.execute(text('SELECT VERSION()'))
-    print(f'{res=}')
+
+def get_version() -> str:
+    with get_engine().connect() as conn:
+        return conn.execute(text('SELECT VERSION()')).scalar()
@@ -0,0 +1,62 @@
+import threading
+
+
+class Metric:
+    """
+    Метрика в формате Prometheus. Значения хранятся по наборам меток.
+
+    Attributes:
+        name (str): Название метрики.
+        description (str): Описание для строки HELP.
+        kind (str): Тип метрики: counter или gauge.
+    """
+
+    def __init__(self, name: str, description: str, kind: str):
+        self.name = name
+        self.description = description
+        self.kind = kind
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = value
+
+    def get(self, **labels) -> float:
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            labels = ','.join(f'{name}="{label}"' for name, label in key)
+            lines.append(f'{self.name}{{{labels}}} {value}' if labels else f'{self.name} {value}')
+        return lines
+
+
+def counter(name: str, description: str) -> Metric:
+    return Metric(name, description, 'counter')
+
+
+def gauge(name: str, description: str) -> Metric:
+    return Metric(name, description, 'gauge')
+
+
+REGISTRY: list[Metric] = []
+
+
+def render() -> str:
+    """Возвращает все метрики в текстовом формате Prometheus."""
+
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    return '\n'.join(lines) + '\n'
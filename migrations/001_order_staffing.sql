@@ -0,0 +1,18 @@
+-- Индексы для подбора исполнителей на заказ (DataBase.staff_order).
+
+-- Навыки и инструменты хранятся строкой через запятую; функция приводит их к массиву
+-- тегов в нижнем регистре, чтобы по ним можно было построить GIN индекс.
+CREATE OR REPLACE FUNCTION tag_array(value text) RETURNS text[]
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE AS
+$$
+SELECT array_remove(regexp_split_to_array(lower(trim(coalesce(value, ''))), '\s*[,;]\s*'), '')
+$$;
+
+CREATE INDEX IF NOT EXISTS users_skills_tags_idx ON users USING gin (tag_array(skills));
+CREATE INDEX IF NOT EXISTS users_tools_tags_idx ON users USING gin (tag_array(tools));
+CREATE INDEX IF NOT EXISTS users_rating_idx ON users (rating DESC NULLS LAST, id);
+
+-- Поиск пересекающихся назначений исполнителя на дату заказа.
+CREATE INDEX IF NOT EXISTS order_workers_worker_id_idx ON order_workers (worker_id, order_id);
+CREATE INDEX IF NOT EXISTS order_workers_order_id_idx ON order_workers (order_id);
+CREATE INDEX IF NOT EXISTS orders_order_date_idx ON orders (order_date);
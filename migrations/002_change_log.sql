@@ -0,0 +1,40 @@
+-- Журнал изменений для GET /api/changes (DataBase.get_changes).
+-- Каждая вставка, изменение и удаление в основных таблицах записывается триггером.
+-- Для удалённых записей хранится только id (tombstone), row_data пустой.
+-- Требуется PostgreSQL 14+ (xid8, CREATE OR REPLACE TRIGGER).
+
+CREATE TABLE IF NOT EXISTS change_log (
+    id         bigserial PRIMARY KEY,
+    table_name text        NOT NULL,
+    operation  char(1)     NOT NULL,
+    row_id     bigint      NOT NULL,
+    row_data   jsonb,
+    txid       xid8        NOT NULL DEFAULT pg_current_xact_id(),
+    changed_at timestamptz NOT NULL DEFAULT now()
+);
+
+-- Очистка старых записей (DataBase.prune_changes)
+CREATE INDEX IF NOT EXISTS change_log_changed_at_idx ON change_log (changed_at);
+
+CREATE OR REPLACE FUNCTION log_change() RETURNS trigger
+    LANGUAGE plpgsql AS
+$$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO change_log (table_name, operation, row_id) VALUES (TG_TABLE_NAME, 'D', OLD.id);
+        RETURN OLD;
+    END IF;
+    INSERT INTO change_log (table_name, operation, row_id, row_data)
+    VALUES (TG_TABLE_NAME, left(TG_OP, 1), NEW.id, to_jsonb(NEW));
+    RETURN NEW;
+END
+$$;
+
+CREATE OR REPLACE TRIGGER users_change_log AFTER INSERT OR UPDATE OR DELETE ON users
+    FOR EACH ROW EXECUTE FUNCTION log_change();
+CREATE OR REPLACE TRIGGER customers_change_log AFTER INSERT OR UPDATE OR DELETE ON customers
+    FOR EACH ROW EXECUTE FUNCTION log_change();
+CREATE OR REPLACE TRIGGER orders_change_log AFTER INSERT OR UPDATE OR DELETE ON orders
+    FOR EACH ROW EXECUTE FUNCTION log_change();
+CREATE OR REPLACE TRIGGER order_workers_change_log AFTER INSERT OR UPDATE OR DELETE ON order_workers
+    FOR EACH ROW EXECUTE FUNCTION log_change();
@@ -0,0 +1,38 @@
+-- Уведомления об изменениях через LISTEN/NOTIFY для /api/events и /api/ws (notifications.py).
+-- Заменяет функцию журнала изменений из 002_change_log.sql: кроме записи в change_log она отправляет
+-- уведомление в канал table_changes. Уведомление доставляется после фиксации транзакции.
+-- В уведомлении только ключи записи, сами данные клиент получает через GET /api/changes.
+
+CREATE OR REPLACE FUNCTION log_change() RETURNS trigger
+    LANGUAGE plpgsql AS
+$$
+DECLARE
+    record    jsonb;
+    change_id bigint;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        record := to_jsonb(OLD);
+        INSERT INTO change_log (table_name, operation, row_id) VALUES (TG_TABLE_NAME, 'D', OLD.id)
+        RETURNING id INTO change_id;
+    ELSE
+        record := to_jsonb(NEW);
+        INSERT INTO change_log (table_name, operation, row_id, row_data)
+        VALUES (TG_TABLE_NAME, left(TG_OP, 1), NEW.id, record)
+        RETURNING id INTO change_id;
+    END IF;
+
+    PERFORM pg_notify('table_changes', json_build_object(
+        'change_id', change_id,
+        'table', TG_TABLE_NAME,
+        'operation', left(TG_OP, 1),
+        'id', record -> 'id',
+        'order_id', CASE TG_TABLE_NAME WHEN 'orders' THEN record -> 'id' ELSE record -> 'order_id' END,
+        'worker_id', CASE TG_TABLE_NAME WHEN 'users' THEN record -> 'id' ELSE record -> 'worker_id' END
+    )::text);
+
+    IF TG_OP = 'DELETE' THEN
+        RETURN OLD;
+    END IF;
+    RETURN NEW;
+END
+$$;
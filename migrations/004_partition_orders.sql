@@ -0,0 +1,205 @@
+-- Секционирование orders по order_date (по месяцам) и архивирование старых секций.
+-- Требуется PostgreSQL 15+: перенос заказа в другую секцию при смене order_date выполняется
+-- как UPDATE для внешнего ключа order_workers, а не как удаление с каскадом.
+--
+-- Перенос существующих данных: таблица orders переименовывается, создаётся секционированная orders
+-- с теми же столбцами и секциями на все месяцы с заказами и на 3 месяца вперёд, данные копируются,
+-- старая таблица удаляется. Дальше секции заранее создаёт сервер (ORDERS_PARTITIONS_AHEAD).
+-- Всё выполняется в одной транзакции под блокировкой orders, поэтому запись в orders на время миграции
+-- останавливается.
+--
+-- Первичный ключ секционированной таблицы обязан включать order_date, поэтому в order_workers добавляется
+-- order_date (заполняется триггером по order_id), а внешний ключ ссылается на (id, order_date).
+-- order_workers не секционируется: строки старых заказов при архивировании переносятся в archive.order_workers.
+
+BEGIN;
+
+LOCK TABLE orders, order_workers IN ACCESS EXCLUSIVE MODE;
+
+CREATE SCHEMA IF NOT EXISTS archive;
+
+-- Внешний ключ order_workers -> orders (id) пересоздаётся ниже по (order_id, order_date)
+DO
+$$
+DECLARE
+    fk text;
+BEGIN
+    FOR fk IN SELECT conname FROM pg_constraint
+              WHERE conrelid = 'order_workers'::regclass AND confrelid = 'orders'::regclass AND contype = 'f'
+    LOOP
+        EXECUTE format('ALTER TABLE order_workers DROP CONSTRAINT %I', fk);
+    END LOOP;
+END
+$$;
+
+ALTER TABLE orders RENAME TO orders_legacy;
+ALTER TABLE orders_legacy DROP CONSTRAINT IF EXISTS orders_pkey;
+DROP TRIGGER IF EXISTS orders_change_log ON orders_legacy;
+
+CREATE TABLE orders (
+    LIKE orders_legacy INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING GENERATED INCLUDING STORAGE,
+    PRIMARY KEY (id, order_date)
+) PARTITION BY RANGE (order_date);
+
+ALTER SEQUENCE IF EXISTS orders_id_seq OWNED BY orders.id;
+
+-- Внешние ключи самой orders (например, customer_id) переносятся без изменений
+DO
+$$
+DECLARE
+    fk record;
+BEGIN
+    FOR fk IN SELECT conname, pg_get_constraintdef(oid) AS definition
+              FROM pg_constraint WHERE conrelid = 'orders_legacy'::regclass AND contype = 'f'
+    LOOP
+        EXECUTE format('ALTER TABLE orders_legacy DROP CONSTRAINT %I', fk.conname);
+        EXECUTE format('ALTER TABLE orders ADD CONSTRAINT %I %s', fk.conname, fk.definition);
+    END LOOP;
+END
+$$;
+
+-- Создаёт недостающие месячные секции orders с date_from по date_to и возвращает число созданных
+CREATE OR REPLACE FUNCTION create_order_partitions(date_from date, date_to date) RETURNS integer
+    LANGUAGE plpgsql AS
+$$
+DECLARE
+    month   date := date_trunc('month', date_from)::date;
+    name    text;
+    created integer := 0;
+BEGIN
+    -- Несколько экземпляров сервера могут создавать секции одновременно
+    PERFORM pg_advisory_xact_lock(hashtext('create_order_partitions'));
+    WHILE month <= date_to LOOP
+        name := format('orders_%s', to_char(month, 'YYYY_MM'));
+        IF to_regclass(format('public.%I', name)) IS NULL THEN
+            EXECUTE format('CREATE TABLE public.%I PARTITION OF orders FOR VALUES FROM (%L) TO (%L)',
+                           name, month, (month + interval '1 month')::date);
+            created := created + 1;
+        END IF;
+        month := (month + interval '1 month')::date;
+    END LOOP;
+    RETURN created;
+END
+$$;
+
+-- Отсоединяет секции orders, которые целиком старше before, вместе с назначениями исполнителей.
+-- Секции переносятся в схему archive или удаляются (drop_data). Возвращает имена обработанных секций.
+-- Архивирование не записывается в change_log: для клиентов журнала это не удаление заказа.
+CREATE OR REPLACE FUNCTION archive_order_partitions(before date, drop_data boolean DEFAULT false) RETURNS SETOF text
+    LANGUAGE plpgsql AS
+$$
+DECLARE
+    partition text;
+    month     date;
+BEGIN
+    FOR partition IN SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+                     WHERE i.inhparent = 'orders'::regclass AND c.relname ~ '^orders_\d{4}_\d{2}$'
+                     ORDER BY c.relname
+    LOOP
+        month := to_date(substr(partition, 8), 'YYYY_MM');
+        CONTINUE WHEN (month + interval '1 month')::date > before;
+
+        ALTER TABLE order_workers DISABLE TRIGGER order_workers_change_log;
+        WITH moved AS (
+            DELETE FROM order_workers
+            WHERE order_date >= month AND order_date < (month + interval '1 month')::date
+            RETURNING *
+        )
+        INSERT INTO archive.order_workers SELECT * FROM moved WHERE NOT drop_data;
+        ALTER TABLE order_workers ENABLE TRIGGER order_workers_change_log;
+
+        EXECUTE format('ALTER TABLE orders DETACH PARTITION public.%I', partition);
+        IF drop_data THEN
+            EXECUTE format('DROP TABLE public.%I', partition);
+        ELSE
+            EXECUTE format('ALTER TABLE public.%I SET SCHEMA archive', partition);
+        END IF;
+        RETURN NEXT partition;
+    END LOOP;
+END
+$$;
+
+SELECT create_order_partitions(
+    coalesce((SELECT min(order_date) FROM orders_legacy), current_date),
+    (greatest((SELECT max(order_date) FROM orders_legacy), current_date) + interval '3 months')::date
+);
+
+INSERT INTO orders SELECT * FROM orders_legacy;
+DROP TABLE orders_legacy;
+
+-- Выборка по id без order_date проверяет индекс первичного ключа (id, order_date) каждой секции,
+-- выборка с диапазоном дат затрагивает только секции этого диапазона
+CREATE INDEX IF NOT EXISTS orders_order_date_idx ON orders (order_date);
+
+-- Дата заказа в назначениях исполнителей для внешнего ключа и выборок по диапазону дат
+-- Заполнение нового столбца не является изменением назначений и не записывается в журнал
+ALTER TABLE order_workers ADD COLUMN IF NOT EXISTS order_date date;
+ALTER TABLE order_workers DISABLE TRIGGER order_workers_change_log;
+UPDATE order_workers w SET order_date = o.order_date FROM orders o WHERE o.id = w.order_id;
+ALTER TABLE order_workers ENABLE TRIGGER order_workers_change_log;
+ALTER TABLE order_workers ALTER COLUMN order_date SET NOT NULL;
+
+CREATE OR REPLACE FUNCTION order_workers_order_date() RETURNS trigger
+    LANGUAGE plpgsql AS
+$$
+BEGIN
+    IF NEW.order_date IS NULL OR TG_OP = 'UPDATE' AND NEW.order_id IS DISTINCT FROM OLD.order_id THEN
+        SELECT order_date INTO NEW.order_date FROM orders WHERE id = NEW.order_id;
+    END IF;
+    RETURN NEW;
+END
+$$;
+
+CREATE OR REPLACE TRIGGER order_workers_order_date BEFORE INSERT OR UPDATE OF order_id ON order_workers
+    FOR EACH ROW EXECUTE FUNCTION order_workers_order_date();
+
+ALTER TABLE order_workers ADD CONSTRAINT order_workers_order_fkey FOREIGN KEY (order_id, order_date)
+    REFERENCES orders (id, order_date) ON DELETE CASCADE ON UPDATE CASCADE;
+CREATE INDEX IF NOT EXISTS order_workers_order_date_idx ON order_workers (order_date);
+
+CREATE TABLE IF NOT EXISTS archive.order_workers (LIKE order_workers);
+
+-- Триггеры строк секционированной таблицы срабатывают на секциях, поэтому журнал изменений
+-- получает имя таблицы аргументом, а не из TG_TABLE_NAME. Перенос заказа в другую секцию
+-- записывается в журнал как удаление и вставка.
+CREATE OR REPLACE FUNCTION log_change() RETURNS trigger
+    LANGUAGE plpgsql AS
+$$
+DECLARE
+    record     jsonb;
+    change_id  bigint;
+    source     text := coalesce(TG_ARGV[0], TG_TABLE_NAME);
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        record := to_jsonb(OLD);
+        INSERT INTO change_log (table_name, operation, row_id) VALUES (source, 'D', OLD.id)
+        RETURNING id INTO change_id;
+    ELSE
+        record := to_jsonb(NEW);
+        INSERT INTO change_log (table_name, operation, row_id, row_data)
+        VALUES (source, left(TG_OP, 1), NEW.id, record)
+        RETURNING id INTO change_id;
+    END IF;
+
+    PERFORM pg_notify('table_changes', json_build_object(
+        'change_id', change_id,
+        'table', source,
+        'operation', left(TG_OP, 1),
+        'id', record -> 'id',
+        'order_id', CASE source WHEN 'orders' THEN record -> 'id' ELSE record -> 'order_id' END,
+        'worker_id', CASE source WHEN 'users' THEN record -> 'id' ELSE record -> 'worker_id' END
+    )::text);
+
+    IF TG_OP = 'DELETE' THEN
+        RETURN OLD;
+    END IF;
+    RETURN NEW;
+END
+$$;
+
+CREATE OR REPLACE TRIGGER orders_change_log AFTER INSERT OR UPDATE OR DELETE ON orders
+    FOR EACH ROW EXECUTE FUNCTION log_change('orders');
+
+ANALYZE orders, order_workers;
+
+COMMIT;
@@ -0,0 +1,22 @@
+-- Нормализованный телефон для точного поиска и поиска по началу номера (DataBase.get_by_phone).
+-- Телефоны хранятся в разных форматах ('+7 (912) 000-00-00', '8-912-0000000'), поэтому поиск по phone
+-- через ILIKE не использует индекс и не находит номер, записанный в другом формате.
+-- phone_digits содержит только цифры номера, российский номер из 11 цифр с ведущей 8 приводится к 7.
+-- Функция повторяет database.normalize_phone, изменять их нужно вместе.
+-- Добавление вычисляемого столбца перезаписывает таблицы users и customers под блокировкой.
+
+CREATE OR REPLACE FUNCTION phone_digits(value text) RETURNS text
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE AS
+$$
+SELECT CASE WHEN digits ~ '^8[0-9]{10}$' THEN '7' || substr(digits, 2) ELSE nullif(digits, '') END
+FROM regexp_replace(coalesce(value, ''), '[^0-9]', '', 'g') AS digits
+$$;
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS phone_digits text GENERATED ALWAYS AS (phone_digits(phone)) STORED;
+ALTER TABLE customers ADD COLUMN IF NOT EXISTS phone_digits text GENERATED ALWAYS AS (phone_digits(phone)) STORED;
+
+-- text_pattern_ops позволяет использовать индекс и для равенства, и для LIKE 'префикс%'
+CREATE INDEX IF NOT EXISTS users_phone_digits_idx ON users (phone_digits text_pattern_ops);
+CREATE INDEX IF NOT EXISTS customers_phone_digits_idx ON customers (phone_digits text_pattern_ops);
+
+ANALYZE users, customers;
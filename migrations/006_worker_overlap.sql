@@ -0,0 +1,84 @@
+-- Исполнитель не может быть назначен на заказы, пересекающиеся по дате и времени.
+-- Проверка в DataBase.staff_order выполняется по снимку данных начала запроса, а назначение через
+-- POST /api/orders/{id}/workers/ и /api/batch не проверяется вовсе, поэтому одновременные назначения
+-- одного исполнителя могли пройти оба. Триггеры ниже проверяют пересечение при каждом назначении и при
+-- изменении даты или времени заказа. Перед проверкой берётся блокировка исполнителя до конца транзакции:
+-- вторая транзакция ждёт фиксации первой и видит её назначение, так как в READ COMMITTED каждый запрос
+-- функции получает новый снимок. Нарушение возвращается как exclusion_violation (23P01).
+-- Уже существующие пересечения не проверяются.
+-- Блокировка берётся на каждого исполнителя до конца транзакции, поэтому массовую загрузку назначений
+-- одной транзакцией нужно выполнять с отключённым триггером order_workers_no_overlap.
+
+-- Блокировка исполнителя на время транзакции. Ключ из двух чисел не пересекается с блокировками с одним ключом
+CREATE OR REPLACE FUNCTION lock_worker(worker_id bigint) RETURNS void
+    LANGUAGE sql AS
+$$
+SELECT pg_advisory_xact_lock(hashtext('order_workers'), hashtext(worker_id::text))
+$$;
+
+-- Заказ, на который исполнитель назначен и который пересекается с заказом order_id.
+-- Не учитывается назначение assignment_id, а при other_orders - и другие назначения на сам заказ order_id
+CREATE OR REPLACE FUNCTION worker_overlap(worker_id bigint, order_id integer, assignment_id integer,
+                                          other_orders boolean DEFAULT false) RETURNS integer
+    LANGUAGE sql STABLE AS
+$$
+SELECT ow.order_id
+FROM orders AS target
+JOIN orders AS o ON o.order_date = target.order_date
+JOIN order_workers AS ow ON ow.order_id = o.id AND ow.order_date = o.order_date
+WHERE target.id = worker_overlap.order_id
+  AND ow.worker_id = worker_overlap.worker_id
+  AND ow.id IS DISTINCT FROM worker_overlap.assignment_id
+  AND NOT (other_orders AND o.id = target.id)
+  AND COALESCE(o.start_time, '00:00'::time) < COALESCE(target.finish_time, '24:00'::time)
+  AND COALESCE(target.start_time, '00:00'::time) < COALESCE(o.finish_time, '24:00'::time)
+LIMIT 1
+$$;
+
+CREATE OR REPLACE FUNCTION order_workers_check_overlap() RETURNS trigger
+    LANGUAGE plpgsql AS
+$$
+DECLARE
+    conflict integer;
+BEGIN
+    IF NEW.worker_id IS NULL THEN
+        RETURN NULL;
+    END IF;
+    PERFORM lock_worker(NEW.worker_id);
+    conflict := worker_overlap(NEW.worker_id, NEW.order_id, NEW.id);
+    IF conflict IS NOT NULL THEN
+        RAISE EXCEPTION 'Исполнитель % уже назначен на пересекающийся заказ %', NEW.worker_id, conflict
+            USING ERRCODE = 'exclusion_violation', CONSTRAINT = 'order_workers_no_overlap';
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+CREATE OR REPLACE TRIGGER order_workers_no_overlap AFTER INSERT OR UPDATE OF order_id, worker_id ON order_workers
+    FOR EACH ROW EXECUTE FUNCTION order_workers_check_overlap();
+
+-- Изменение даты или времени заказа проверяется для всех его исполнителей в порядке worker_id,
+-- чтобы две такие транзакции не ждали друг друга
+CREATE OR REPLACE FUNCTION orders_check_overlap() RETURNS trigger
+    LANGUAGE plpgsql AS
+$$
+DECLARE
+    assignment record;
+    conflict   integer;
+BEGIN
+    FOR assignment IN SELECT id, worker_id FROM order_workers
+                      WHERE order_id = NEW.id AND worker_id IS NOT NULL ORDER BY worker_id
+    LOOP
+        PERFORM lock_worker(assignment.worker_id);
+        conflict := worker_overlap(assignment.worker_id, NEW.id, assignment.id, other_orders => true);
+        IF conflict IS NOT NULL THEN
+            RAISE EXCEPTION 'Исполнитель % уже назначен на пересекающийся заказ %', assignment.worker_id, conflict
+                USING ERRCODE = 'exclusion_violation', CONSTRAINT = 'order_workers_no_overlap';
+        END IF;
+    END LOOP;
+    RETURN NULL;
+END
+$$;
+
+CREATE OR REPLACE TRIGGER orders_no_overlap AFTER UPDATE OF order_date, start_time, finish_time ON orders
+    FOR EACH ROW EXECUTE FUNCTION orders_check_overlap();
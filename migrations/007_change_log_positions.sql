@@ -0,0 +1,37 @@
+-- Позиции журнала изменений для GET /api/changes (DataBase.get_change_positions).
+-- Начальная позиция клиента не должна быть больше id записей транзакций, незавершённых к началу снимка,
+-- иначе изменения, которые они зафиксируют позже, клиент пропустит. Индекс по txid находит первую такую
+-- запись без чтения всего журнала.
+-- change_log_state хранит наибольший id записи, удалённой очисткой журнала (DataBase.prune_changes):
+-- клиент с позицией меньше неё мог пропустить изменения и должен загрузить таблицы заново.
+-- Требуется PostgreSQL 14+ (xid8).
+
+CREATE INDEX IF NOT EXISTS change_log_txid_idx ON change_log (txid);
+
+CREATE TABLE IF NOT EXISTS change_log_state (
+    singleton boolean PRIMARY KEY DEFAULT true CHECK (singleton),
+    pruned_id bigint  NOT NULL
+);
+
+-- Записи до первой оставшейся в журнале считаются удалёнными, пустой журнал - удалённым целиком
+INSERT INTO change_log_state (pruned_id)
+SELECT COALESCE((SELECT min(id) - 1 FROM change_log),
+                (SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM change_log_id_seq))
+WHERE NOT EXISTS (SELECT FROM change_log_state);
+
+-- Начальная позиция для нового клиента: id перед первым изменением транзакции, которая могла не завершиться
+-- к началу снимка, иначе последнее изменение журнала, но не меньше позиции очистки.
+-- Граница xmin подставляется в запрос значением, чтобы планировщик оценил её по статистике
+-- и прочитал по индексу txid только новые записи, а не весь журнал
+CREATE OR REPLACE FUNCTION change_log_settled_id() RETURNS bigint
+    LANGUAGE plpgsql STABLE AS
+$$
+DECLARE
+    unsettled bigint;
+BEGIN
+    EXECUTE format('SELECT min(id) FROM change_log WHERE txid >= %L::xid8', pg_snapshot_xmin(pg_current_snapshot()))
+        INTO unsettled;
+    RETURN GREATEST((SELECT pruned_id FROM change_log_state),
+                    COALESCE(unsettled - 1, (SELECT max(id) FROM change_log), 0));
+END
+$$;
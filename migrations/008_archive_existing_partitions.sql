@@ -0,0 +1,46 @@
+-- Повторное архивирование месяца (migrations/004_partition_orders.sql).
+-- Секция orders за уже архивированный месяц создаётся снова, если заказ задним числом попал в этот месяц.
+-- ALTER TABLE ... SET SCHEMA archive для неё завершался ошибкой, так как archive.orders_YYYY_MM уже есть,
+-- и архивирование всех следующих секций останавливалось. Теперь строки такой секции добавляются
+-- в существующую архивную таблицу (по её столбцам), а сама секция удаляется.
+
+CREATE OR REPLACE FUNCTION archive_order_partitions(before date, drop_data boolean DEFAULT false) RETURNS SETOF text
+    LANGUAGE plpgsql AS
+$$
+DECLARE
+    partition text;
+    month     date;
+    columns   text;
+BEGIN
+    FOR partition IN SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+                     WHERE i.inhparent = 'orders'::regclass AND c.relname ~ '^orders_\d{4}_\d{2}$'
+                     ORDER BY c.relname
+    LOOP
+        month := to_date(substr(partition, 8), 'YYYY_MM');
+        CONTINUE WHEN (month + interval '1 month')::date > before;
+
+        ALTER TABLE order_workers DISABLE TRIGGER order_workers_change_log;
+        WITH moved AS (
+            DELETE FROM order_workers
+            WHERE order_date >= month AND order_date < (month + interval '1 month')::date
+            RETURNING *
+        )
+        INSERT INTO archive.order_workers SELECT * FROM moved WHERE NOT drop_data;
+        ALTER TABLE order_workers ENABLE TRIGGER order_workers_change_log;
+
+        EXECUTE format('ALTER TABLE orders DETACH PARTITION public.%I', partition);
+        IF drop_data THEN
+            EXECUTE format('DROP TABLE public.%I', partition);
+        ELSIF to_regclass(format('archive.%I', partition)) IS NULL THEN
+            EXECUTE format('ALTER TABLE public.%I SET SCHEMA archive', partition);
+        ELSE
+            SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum) INTO columns
+            FROM pg_attribute
+            WHERE attrelid = to_regclass(format('archive.%I', partition)) AND attnum > 0 AND NOT attisdropped;
+            EXECUTE format('INSERT INTO archive.%1$I (%2$s) SELECT %2$s FROM public.%1$I', partition, columns);
+            EXECUTE format('DROP TABLE public.%I', partition);
+        END IF;
+        RETURN NEXT partition;
+    END LOOP;
+END
+$$;
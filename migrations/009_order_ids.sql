@@ -0,0 +1,97 @@
+-- Уникальность id заказов (migrations/004_partition_orders.sql).
+-- Первичный ключ секционированной orders - (id, order_date), поэтому заказ с id существующего заказа,
+-- но с датой в другом месяце, добавлялся без ошибки, а get_by_id, update_record и delete_by_id
+-- находили несколько заказов. Таблица order_ids хранит id всех заказов, триггер orders добавляет, меняет
+-- и удаляет в ней id, и повторный id снова нарушает первичный ключ (unique_violation, 23505).
+-- Перенос заказа в другую секцию выполняется как удаление и вставка, id при этом удаляется и добавляется снова.
+-- id архивированных заказов остаются занятыми: повторное архивирование месяца добавляет строки в ту же
+-- архивную таблицу (migrations/008_archive_existing_partitions.sql). При архивировании с удалением данных
+-- id освобождаются.
+-- Если в orders уже есть повторяющиеся id, миграция завершается ошибкой и повторы нужно устранить вручную.
+
+BEGIN;
+
+-- Запись в orders останавливается, пока заполняется order_ids
+LOCK TABLE orders IN SHARE ROW EXCLUSIVE MODE;
+
+CREATE TABLE IF NOT EXISTS order_ids (
+    id integer PRIMARY KEY
+);
+
+INSERT INTO order_ids (id) SELECT id FROM orders;
+
+DO
+$$
+DECLARE
+    partition text;
+BEGIN
+    FOR partition IN SELECT c.relname FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+                     WHERE n.nspname = 'archive' AND c.relkind = 'r' AND c.relname ~ '^orders_\d{4}_\d{2}$'
+    LOOP
+        EXECUTE format('INSERT INTO order_ids (id) SELECT id FROM archive.%I ON CONFLICT (id) DO NOTHING', partition);
+    END LOOP;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION orders_unique_id() RETURNS trigger
+    LANGUAGE plpgsql AS
+$$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO order_ids (id) VALUES (NEW.id);
+    ELSIF TG_OP = 'DELETE' THEN
+        DELETE FROM order_ids WHERE id = OLD.id;
+    ELSIF NEW.id IS DISTINCT FROM OLD.id THEN
+        UPDATE order_ids SET id = NEW.id WHERE id = OLD.id;
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+CREATE OR REPLACE TRIGGER orders_unique_id AFTER INSERT OR UPDATE OF id OR DELETE ON orders
+    FOR EACH ROW EXECUTE FUNCTION orders_unique_id();
+
+-- Архивирование с удалением данных освобождает id удалённых заказов
+CREATE OR REPLACE FUNCTION archive_order_partitions(before date, drop_data boolean DEFAULT false) RETURNS SETOF text
+    LANGUAGE plpgsql AS
+$$
+DECLARE
+    partition text;
+    month     date;
+    columns   text;
+BEGIN
+    FOR partition IN SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+                     WHERE i.inhparent = 'orders'::regclass AND c.relname ~ '^orders_\d{4}_\d{2}$'
+                     ORDER BY c.relname
+    LOOP
+        month := to_date(substr(partition, 8), 'YYYY_MM');
+        CONTINUE WHEN (month + interval '1 month')::date > before;
+
+        ALTER TABLE order_workers DISABLE TRIGGER order_workers_change_log;
+        WITH moved AS (
+            DELETE FROM order_workers
+            WHERE order_date >= month AND order_date < (month + interval '1 month')::date
+            RETURNING *
+        )
+        INSERT INTO archive.order_workers SELECT * FROM moved WHERE NOT drop_data;
+        ALTER TABLE order_workers ENABLE TRIGGER order_workers_change_log;
+
+        EXECUTE format('ALTER TABLE orders DETACH PARTITION public.%I', partition);
+        IF drop_data THEN
+            EXECUTE format('DELETE FROM order_ids WHERE id IN (SELECT id FROM public.%I)', partition);
+            EXECUTE format('DROP TABLE public.%I', partition);
+        ELSIF to_regclass(format('archive.%I', partition)) IS NULL THEN
+            EXECUTE format('ALTER TABLE public.%I SET SCHEMA archive', partition);
+        ELSE
+            SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum) INTO columns
+            FROM pg_attribute
+            WHERE attrelid = to_regclass(format('archive.%I', partition)) AND attnum > 0 AND NOT attisdropped;
+            EXECUTE format('INSERT INTO archive.%1$I (%2$s) SELECT %2$s FROM public.%1$I', partition, columns);
+            EXECUTE format('DROP TABLE public.%I', partition);
+        END IF;
+        RETURN NEXT partition;
+    END LOOP;
+END
+$$;
+
+COMMIT;
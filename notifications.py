@@ -0,0 +1,177 @@
+import asyncio
+import json
+import logging
+import psycopg2
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+subscribers_gauge = metrics.gauge('notifications_subscribers', 'Подписчики на уведомления об изменениях')
+notifications_received = metrics.counter('notifications_received_total', 'Полученные уведомления NOTIFY')
+notifications_dropped = metrics.counter('notifications_dropped_total', 'Уведомления, не доставленные медленным подписчикам')
+
+
+class Subscription:
+    """
+    Подписка на уведомления по темам: 'table:orders', 'order:15', 'worker:7'.
+    Если подписчик не успевает забирать уведомления и очередь переполнена, уведомления отбрасываются,
+    а следующим событием подписчик получает {'event': 'resync'} и должен догнать изменения через /api/changes.
+    """
+
+    def __init__(self, topics: set[str], queue_size: int):
+        self.topics = topics
+        self.queue = asyncio.Queue(queue_size)
+        self.overflowed = False
+
+    def put(self, event: dict):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            notifications_dropped.inc()
+
+    async def get(self, timeout: float | None = None) -> dict | None:
+        """Возвращает следующее уведомление или None, если за timeout секунд уведомлений не было."""
+
+        if self.overflowed:
+            self.overflowed = False
+            return {'event': 'resync'}
+        if not self.queue.empty():
+            return self.queue.get_nowait()
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+def event_topics(event: dict) -> set[str]:
+    topics = {f'table:{event.get("table")}'}
+    if event.get('order_id') is not None:
+        topics.add(f'order:{event["order_id"]}')
+    if event.get('worker_id') is not None:
+        topics.add(f'worker:{event["worker_id"]}')
+    return topics
+
+
+class ChangeListener:
+    """
+    Слушает канал PostgreSQL (LISTEN) на одном соединении и раздаёт уведомления подписчикам процесса.
+    Соединение читается в цикле событий asyncio без отдельного потока. При обрыве соединения
+    слушатель переподключается, а подписчики получают {'event': 'resync'}.
+
+    Attributes:
+        channel (str): Канал NOTIFY, см. migrations/003_notify_changes.sql.
+        queue_size (int): Размер очереди одного подписчика.
+    """
+
+    def __init__(self, connect_kwargs: dict, channel: str = 'table_changes', queue_size: int = 100,
+                 reconnect_delay: float = 1.0):
+        self.connect_kwargs = connect_kwargs
+        self.channel = channel
+        self.queue_size = queue_size
+        self.reconnect_delay = reconnect_delay
+        self.connection = None
+        self._topics = {}
+        self._loop = None
+        self._task = None
+        self._lost = None
+        self._fd = None
+
+    def subscribe(self, topics: set[str]) -> Subscription:
+        subscription = Subscription(set(), self.queue_size)
+        self.add_topics(subscription, topics)
+        subscribers_gauge.inc()
+        return subscription
+
+    def add_topics(self, subscription: Subscription, topics: set[str]):
+        for topic in topics:
+            self._topics.setdefault(topic, set()).add(subscription)
+        subscription.topics |= topics
+
+    def remove_topics(self, subscription: Subscription, topics: set[str]):
+        for topic in topics & subscription.topics:
+            subscribers = self._topics.get(topic)
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._topics[topic]
+        subscription.topics -= topics
+
+    def unsubscribe(self, subscription: Subscription):
+        self.remove_topics(subscription, set(subscription.topics))
+        subscribers_gauge.inc(-1)
+
+    def dispatch(self, event: dict):
+        notifications_received.inc()
+        delivered = set()
+        for topic in event_topics(event):
+            for subscription in self._topics.get(topic, ()):
+                if subscription not in delivered:
+                    delivered.add(subscription)
+                    subscription.put(event)
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._disconnect()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.to_thread(self._connect)
+            except psycopg2.Error:
+                logger.exception('Не удалось подключиться для LISTEN %s', self.channel)
+                await asyncio.sleep(self.reconnect_delay)
+                continue
+            self._lost = asyncio.Event()
+            # Номер дескриптора запоминается: после обрыва fileno() недоступен, а номер может достаться новому сокету
+            self._fd = self.connection.fileno()
+            self._loop.add_reader(self._fd, self._read)
+            await self._lost.wait()
+            self._disconnect()
+            # Пока соединения не было, уведомления могли потеряться
+            for subscribers in list(self._topics.values()):
+                for subscription in subscribers:
+                    subscription.overflowed = True
+            await asyncio.sleep(self.reconnect_delay)
+
+    def _connect(self):
+        self.connection = psycopg2.connect(**self.connect_kwargs)
+        self.connection.autocommit = True
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'LISTEN "{self.channel}"')
+
+    def _disconnect(self):
+        if self.connection is None:
+            return
+        if self._fd is not None:
+            self._loop.remove_reader(self._fd)
+            self._fd = None
+        self.connection.close()
+        self.connection = None
+
+    def _read(self):
+        try:
+            self.connection.poll()
+        except psycopg2.Error:
+            logger.warning('Соединение LISTEN %s потеряно', self.channel)
+            self._loop.remove_reader(self._fd)
+            self._fd = None
+            self._lost.set()
+            return
+        while self.connection.notifies:
+            notify = self.connection.notifies.pop(0)
+            try:
+                event = json.loads(notify.payload)
+            except ValueError:
+                continue
+            self.dispatch(event)
@@ -0,0 +1,192 @@
+import asyncio
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+# Профиль текущего HTTP запроса, None - профилирование выключено
+current_profile: ContextVar['Profile | None'] = ContextVar('current_profile', default=None)
+
+
+class Profile:
+    """
+    Профиль одного запроса: выборка стеков потоков запроса и время по участкам (span).
+    Стеки снимаются отдельным потоком через sys._current_frames() каждые interval секунд.
+    Снимаются поток цикла событий на всё время запроса и потоки пула на время участков DataBase.
+    В потоке цикла событий в выборку попадают и другие одновременные запросы.
+
+    Attributes:
+        name (str): Название запроса, например 'GET /api/users/'.
+        interval (float): Период снятия стеков в секундах.
+    """
+
+    def __init__(self, name: str, interval: float = 0.005):
+        self.name = name
+        self.interval = interval
+        self.id = uuid.uuid4().hex[:12]
+        self.samples = Counter()
+        self.spans = Counter()
+        self.threads = Counter()
+        self.started = None
+        self._lock = threading.Lock()
+        self.duration = None
+        self._stopped = threading.Event()
+        self._sampler = None
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.threads[threading.get_ident()] += 1
+        self._sampler = threading.Thread(target=self._sample, name=f'profile-{self.id}', daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        self.duration = time.perf_counter() - self.started
+        self._stopped.set()
+        self._sampler.join()
+
+    @contextmanager
+    def span(self, *path: str):
+        """Добавляет время выполнения блока к участку path, например ('DataBase.get_all', 'query')."""
+
+        thread = threading.get_ident()
+        with self._lock:
+            self.threads[thread] += 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.spans[path] += elapsed
+                self.threads[thread] -= 1
+
+    def _sample(self):
+        while not self._stopped.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                threads = [ident for ident, count in self.threads.items() if count > 0]
+            for ident in threads:
+                frame = frames.get(ident)
+                if frame is not None:
+                    self.samples[_fold(frame)] += 1
+
+    def write(self, directory: str) -> list[str]:
+        """
+        Записывает профиль в формате свёрнутых стеков (collapsed/folded), который читают flamegraph.pl,
+        speedscope и inferno: '<id>.folded' - выборка стеков (вес - число снимков),
+        '<id>.spans.folded' - участки запроса (вес - микросекунды). Время запроса вне участков DataBase
+        (маршрут, сериализация ответа) записывается как собственное время корня.
+
+        Returns:
+            Возвращает пути записанных файлов.
+        """
+
+        os.makedirs(directory, exist_ok=True)
+        root = self.name.replace(';', ':')
+        prefix = os.path.join(directory, f'{time.strftime("%Y%m%d-%H%M%S")}-{_slug(self.name)}-{self.id}')
+
+        samples_path = f'{prefix}.folded'
+        with open(samples_path, 'w', encoding='utf-8') as file:
+            for stack, count in self.samples.most_common():
+                file.write(f'{root};{stack} {count}\n')
+
+        # Участки не вложены друг в друга, поэтому собственное время корня - остаток от их суммы
+        spans_path = f'{prefix}.spans.folded'
+        with open(spans_path, 'w', encoding='utf-8') as file:
+            file.write(f'{root} {_microseconds(max(self.duration - sum(self.spans.values()), 0))}\n')
+            for path, seconds in sorted(self.spans.items()):
+                file.write(f'{root};{";".join(path)} {_microseconds(seconds)}\n')
+        return [samples_path, spans_path]
+
+
+def prune_profiles(directory: str, keep: int) -> int:
+    """
+    Удаляет из каталога самые старые профили (по времени изменения файлов), оставляя keep последних.
+
+    Returns:
+        Возвращает количество удалённых профилей.
+    """
+
+    profiles = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.endswith('.folded'):
+                # Файлы одного профиля отличаются только расширением: '<prefix>.folded' и '<prefix>.spans.folded'
+                prefix = entry.name.split('.', 1)[0]
+                paths, modified = profiles.get(prefix, ([], 0))
+                paths.append(entry.path)
+                profiles[prefix] = paths, max(modified, entry.stat().st_mtime)
+
+    oldest = sorted(profiles.values(), key=lambda profile: profile[1])[:max(len(profiles) - keep, 0)]
+    for paths, _ in oldest:
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Профиль уже удалил другой запрос
+                pass
+    return len(oldest)
+
+
+def _save(profile: Profile, directory: str, keep: int):
+    profile.write(directory)
+    prune_profiles(directory, keep)
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware, которое профилирует запрос, если settings(scope) вернул
+    (каталог, период снятия стеков, сколько профилей хранить в каталоге).
+    В ответ добавляется заголовок X-Profile-Id, файлы профиля записываются в каталог, самые старые профили удаляются.
+    Для остальных запросов settings возвращает None, и middleware сразу передаёт запрос дальше.
+    """
+
+    def __init__(self, app, settings):
+        self.app = app
+        self.settings = settings
+
+    async def __call__(self, scope, receive, send):
+        settings = self.settings(scope) if scope['type'] == 'http' else None
+        if settings is None:
+            await self.app(scope, receive, send)
+            return
+
+        directory, interval, keep = settings
+        profile = Profile(f'{scope["method"]} {scope["path"]}', interval)
+
+        async def send_with_profile_id(message):
+            if message['type'] == 'http.response.start':
+                message['headers'] = list(message.get('headers', [])) + [(b'x-profile-id', profile.id.encode())]
+            await send(message)
+
+        token = current_profile.set(profile)
+        profile.start()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            current_profile.reset(token)
+            profile.stop()
+            await asyncio.to_thread(_save, profile, directory, keep)
+
+
+def _fold(frame) -> str:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f'{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
+
+
+def _slug(name: str) -> str:
+    return re.sub(r'[^A-Za-z0-9]+', '_', name).strip('_')
+
+
+def _microseconds(seconds: float) -> int:
+    return int(seconds * 1_000_000)
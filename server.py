@@ -1,21 +1,359 @@
-from fastapi import FastAPI, HTTPException, Request, Depends, Query
-from pydantic import BaseModel
-from typing import Optional
-from database import DataBase
+from time import perf_counter
+
+_import_started = perf_counter()
+
+import asyncio
+import json
+import logging
+import random
+import re
+import secrets
+import threading
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request, Depends, Query, WebSocket, WebSocketDisconnect
+from fastapi.requests import HTTPConnection
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+from typing import Annotated, Optional, Literal
+from database import DataBase, ConnectionPool, ReplicaSet, read_your_writes, parse_lsn, format_lsn, Deadline, request_deadline
+from database import is_transient
 from datetime import date, time
-from config import DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, ACCESS_TOKEN
-from psycopg2.errors import UniqueViolation
+from psycopg2 import OperationalError, InterfaceError
+from psycopg2.errors import UniqueViolation, QueryCanceled, CheckViolation, ExclusionViolation
+from psycopg2.pool import PoolError
 from database import RecordNotFound
+from admission import AdmissionGate, Overloaded
+from breaker import CircuitBreaker, CircuitOpen
+from coalesce import SingleFlight
+from counters import CounterBuffer, DELTA_LIMIT
+from notifications import ChangeListener
+from profiling import ProfilingMiddleware
+import config
+import metrics
 
-app = FastAPI(
-    title='MBT DataBase'
-)
 
+logger = logging.getLogger(__name__)
 
 user_table = 'users'
 customer_table = 'customers'
 order_table = 'orders'
 order_workers_table = 'order_workers'
+change_tables = (user_table, customer_table, order_table, order_workers_table)
+
+# Максимальное число одновременных чтений одного batch запроса, каждое занимает место в AdmissionGate
+BATCH_READ_CONCURRENCY = 4
+
+# Приоритеты допуска к базе данных, меньшее значение обслуживается раньше
+PRIORITY_ORDER_WRITE = 0
+PRIORITY_WRITE = 1
+PRIORITY_READ = 2
+PRIORITY_LIST_READ = 3
+
+# Срок выполнения запросов (секунды) по шаблону пути, None - без срока. Остальным маршрутам /api/ даётся
+# REQUEST_TIMEOUT, значения переопределяются переменной окружения REQUEST_TIMEOUTS
+ROUTE_TIMEOUTS = {
+    '/api/users/': 30,
+    '/api/customers/': 30,
+    '/api/orders/': 30,
+    '/api/changes': 30,
+    '/api/batch': 30,
+    '/api/events': None,
+    '/api/ws': None,
+}
+
+_record_path = re.compile(r'^/api/(users|customers|orders)/\d+$')
+
+_pool: ConnectionPool | None = None
+_pool_lock = threading.Lock()
+_gate: AdmissionGate | None = None
+_reads: SingleFlight | None = None
+_counters: CounterBuffer | None = None
+_listener: ChangeListener | None = None
+
+# Период отправки пустых сообщений в открытые потоки событий, чтобы прокси не закрывали соединение
+EVENTS_KEEPALIVE = 15
+_startup = {'ready': False, 'import_seconds': None, 'startup_seconds': None}
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                replicas = None
+                if config.DB_REPLICAS:
+                    replicas = ReplicaSet(config.DB_REPLICAS, minconn=config.DB_POOL_MIN,
+                                          maxconn=config.DB_POOL_MAX, policy=config.DB_REPLICA_POLICY,
+                                          max_lag=config.DB_REPLICA_MAX_LAG,
+                                          sticky_seconds=config.DB_REPLICA_STICKY_SECONDS,
+                                          connect_timeout=config.DB_CONNECT_TIMEOUT)
+                breaker = CircuitBreaker(failure_threshold=config.BREAKER_FAILURES,
+                                         reset_timeout=config.BREAKER_RESET_TIMEOUT,
+                                         retry_after=config.ADMISSION_RETRY_AFTER)
+                _pool = ConnectionPool(config.DB_NAME, config.DB_USER, config.DB_PASSWORD, config.DB_HOST,
+                                       config.DB_PORT, minconn=config.DB_POOL_MIN, maxconn=config.DB_POOL_MAX,
+                                       replicas=replicas, breaker=breaker, connect_timeout=config.DB_CONNECT_TIMEOUT,
+                                       read_retries=config.DB_READ_RETRIES, retry_delay=config.DB_RETRY_DELAY,
+                                       retry_max_delay=config.DB_RETRY_MAX_DELAY)
+    return _pool
+
+
+def get_gate() -> AdmissionGate:
+    global _gate
+    if _gate is None:
+        _gate = AdmissionGate(config.ADMISSION_LIMIT, queue_size=config.ADMISSION_QUEUE,
+                              timeout=config.ADMISSION_TIMEOUT, retry_after=config.ADMISSION_RETRY_AFTER)
+    return _gate
+
+
+def get_reads() -> SingleFlight:
+    global _reads
+    if _reads is None:
+        _reads = SingleFlight(ttl=config.COALESCE_TTL)
+    return _reads
+
+
+def coalesced_read(method: str, **params):
+    """
+    Выполняет метод чтения DataBase так, что одинаковые одновременные вызовы выполняют один запрос к базе.
+    Запросы с X-DB-LSN читают сами, чтобы не получить результат, прочитанный до их записи.
+    """
+
+    def read():
+        db = get_pool().get()
+        try:
+            return getattr(db, method)(**params)
+        finally:
+            db.disconnect()
+
+    session = read_your_writes.get()
+    if session is not None and (session['min_lsn'] or session['write_lsn']):
+        return read()
+
+    def shared_read():
+        # Результат нужен и другим ожидающим запросам, поэтому отключение первого клиента не отменяет чтение
+        deadline = request_deadline.get()
+        if deadline is None:
+            return read()
+        token = request_deadline.set(deadline.detached())
+        try:
+            return read()
+        finally:
+            request_deadline.reset(token)
+
+    # Ожидающий чужого чтения запрос ждёт не дольше своего срока
+    deadline = request_deadline.get()
+    timeout = None if deadline is None else deadline.remaining_ms() / 1000
+    try:
+        return get_reads().do((method, tuple(sorted(params.items()))), shared_read, timeout=timeout)
+    except TimeoutError:
+        raise QueryCanceled('Превышено время ожидания объединённого чтения')
+
+
+def get_counters() -> CounterBuffer:
+    global _counters
+    if _counters is None:
+        _counters = CounterBuffer(flush_counters, interval=config.COUNTERS_FLUSH_INTERVAL,
+                                  max_users=config.COUNTERS_MAX_USERS, retryable=is_unavailable)
+    return _counters
+
+
+def get_listener() -> ChangeListener:
+    global _listener
+    if _listener is None:
+        _listener = ChangeListener({'database': config.DB_NAME, 'user': config.DB_USER,
+                                    'password': config.DB_PASSWORD, 'host': config.DB_HOST,
+                                    'port': config.DB_PORT})
+    return _listener
+
+
+def is_unavailable(e: Exception) -> bool:
+    """Ошибка вызвана недоступностью базы или нехваткой соединений, и запрос можно повторить позже."""
+
+    return isinstance(e, (CircuitOpen, PoolError)) or is_transient(e)
+
+
+def flush_counters(deltas: dict[int, dict[str, int]]):
+    db = get_pool().get()
+    try:
+        db.increment_counters(user_table, deltas)
+    finally:
+        db.disconnect()
+
+
+def request_priority(method: str, path: str) -> int | None:
+    """Возвращает приоритет допуска запроса к базе данных или None, если запрос не обращается к базе."""
+
+    if not path.startswith('/api/') or path == '/api/events':
+        return None
+    if method != 'GET':
+        return PRIORITY_ORDER_WRITE if path.startswith('/api/orders') else PRIORITY_WRITE
+    if _record_path.match(path):
+        return PRIORITY_READ
+    return PRIORITY_LIST_READ
+
+
+def route_timeout(path: str) -> float | None:
+    """Срок выполнения запроса к маршруту (секунды) или None, если срок не ограничен."""
+
+    overrides = config.REQUEST_TIMEOUTS
+    if path in overrides:
+        return overrides[path]
+    if path in ROUTE_TIMEOUTS:
+        return ROUTE_TIMEOUTS[path]
+    return config.REQUEST_TIMEOUT
+
+
+async def watch_disconnect(request: Request, deadline: Deadline):
+    # Тело запроса к этому моменту уже прочитано, дальше от сервера может прийти только отключение клиента
+    while (await request.receive())['type'] != 'http.disconnect':
+        pass
+    # Отмена запроса на сервере базы - сетевой вызов, поэтому выполняется не в цикле событий
+    await asyncio.to_thread(deadline.cancel)
+
+
+async def request_deadline_scope(connection: HTTPConnection):
+    """
+    Задаёт срок выполнения запроса к /api/. Запросы к базе в пределах срока выполняются с statement_timeout,
+    а при отключении клиента выполняющийся запрос отменяется на сервере.
+    """
+
+    route = connection.scope.get('route')
+    timeout = route_timeout(route.path) if route is not None else None
+    if connection.scope['type'] != 'http' or not connection.url.path.startswith('/api/') or not timeout:
+        yield
+        return
+    deadline = Deadline(timeout)
+    token = request_deadline.set(deadline)
+    watcher = asyncio.create_task(watch_disconnect(connection, deadline))
+    try:
+        yield
+    finally:
+        watcher.cancel()
+        request_deadline.reset(token)
+
+
+def internal_error(e: Exception) -> HTTPException:
+    if isinstance(e, ExclusionViolation):
+        # Назначение исполнителя или изменение времени заказа пересекается с другим его заказом
+        return HTTPException(status_code=409, detail='Исполнитель уже назначен на заказ в это время')
+    if isinstance(e, QueryCanceled):
+        return HTTPException(status_code=504, detail='Превышено время выполнения запроса')
+    if isinstance(e, CircuitOpen) or is_transient(e):
+        return HTTPException(status_code=503, detail='База данных недоступна, повторите запрос позже',
+                             headers={'Retry-After': str(config.ADMISSION_RETRY_AFTER)})
+    return HTTPException(status_code=500, detail=f'{e}')
+
+
+def prune_changes():
+    db = get_pool().get()
+    try:
+        return db.prune_changes(days=config.CHANGE_LOG_RETENTION_DAYS)
+    finally:
+        db.disconnect()
+
+
+def months_before(day: date, months: int) -> date:
+    """Первое число месяца, отстоящего от месяца day на months назад (отрицательное значение - вперёд)."""
+
+    index = day.year * 12 + day.month - 1 - months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def maintain_order_partitions():
+    # Секции orders создаются заранее, старые секции при ORDERS_HOT_MONTHS > 0 уходят в архив
+    db = get_pool().get()
+    try:
+        today = date.today()
+        db.create_order_partitions(today, months_before(today, -config.ORDERS_PARTITIONS_AHEAD))
+        if config.ORDERS_HOT_MONTHS:
+            archived = db.archive_order_partitions(months_before(today, config.ORDERS_HOT_MONTHS),
+                                                   drop=config.ORDERS_ARCHIVE_DROP)
+            if archived:
+                logger.info('Секции заказов перенесены в архив: %s', ', '.join(archived))
+    finally:
+        db.disconnect()
+
+
+def find_by_phone(db: DataBase, table_name: str, pattern: str, match: str) -> list[dict]:
+    """
+    Поиск по телефону для /api/users/phone/ и /api/customers/phone/.
+    По умолчанию (substring) ищется часть номера в том виде, как он записан, как и раньше.
+    prefix и exact ищут по нормализованному номеру по индексу (DataBase.get_by_phone).
+    """
+
+    if match == 'substring':
+        return db.get_by_pattern_str(table_name=table_name, param='phone', pattern=pattern)
+    return db.get_by_phone(table_name=table_name, phone=pattern, prefix=match == 'prefix')
+
+
+def with_order_partition(db: DataBase, order_date: date, write):
+    """
+    Выполняет запись заказа. Если для order_date ещё нет секции orders, создаёт её и повторяет запись.
+    Внутри транзакции запись выполняется во вложенном контексте, чтобы после ошибки выбора секции
+    транзакцию можно было продолжить.
+    """
+
+    def attempt():
+        if not db.in_transaction:
+            return write()
+        with db.transaction():
+            return write()
+
+    try:
+        return attempt()
+    except CheckViolation as e:
+        # У ошибки выбора секции, в отличие от нарушения CHECK, нет имени ограничения
+        if e.diag.constraint_name is not None or not db.create_order_partitions(order_date, order_date):
+            raise
+    return attempt()
+
+
+async def run_maintenance_periodically(interval: float = 3600):
+    jobs = ((prune_changes, 'Не удалось очистить журнал изменений'),
+            (maintain_order_partitions, 'Не удалось обслужить секции заказов'))
+    while True:
+        for job, error in jobs:
+            try:
+                await asyncio.to_thread(job)
+            except Exception:
+                logger.exception(error)
+        await asyncio.sleep(interval)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = perf_counter()
+    get_gate()
+    pool = await asyncio.to_thread(get_pool)
+    await asyncio.to_thread(pool.prewarm)
+    get_counters().start()
+    await get_listener().start()
+    maintenance = asyncio.create_task(run_maintenance_periodically())
+    _startup['startup_seconds'] = round(perf_counter() - started, 4)
+    _startup['ready'] = True
+    try:
+        yield
+    finally:
+        _startup['ready'] = False
+        maintenance.cancel()
+        await get_listener().stop()
+        try:
+            await asyncio.to_thread(get_counters().stop)
+        except Exception:
+            # Пул закрывается и при неудачной записи остатка счётчиков
+            logger.exception('Не удалось записать счётчики пользователей при остановке')
+        global _pool
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+app = FastAPI(
+    title='MBT DataBase',
+    lifespan=lifespan,
+    dependencies=[Depends(request_deadline_scope)]
+)
 
 
 class UserInfo(BaseModel):
@@ -73,21 +411,166 @@ class CustomerInfo(BaseModel):
     comment: Optional[str] = None
 
 
-async def verify_token(request: Request):
+class BatchOperation(BaseModel):
+    op: Literal['get', 'insert', 'update', 'delete']
+    table: Literal['users', 'customers', 'orders', 'order_workers']
+    id: int | None = None
+    param: str | None = None
+    value: str | int | None = None
+    data: dict | None = None
+
+
+class BatchRequest(BaseModel):
+    operations: list[BatchOperation] = Field(max_length=100)
+    transactional: bool = False
+
+
+class CounterDeltas(BaseModel):
+    rating: int = Field(0, ge=-DELTA_LIMIT, le=DELTA_LIMIT)
+    profit: int = Field(0, ge=-DELTA_LIMIT, le=DELTA_LIMIT)
+    orders: int = Field(0, ge=-DELTA_LIMIT, le=DELTA_LIMIT)
+
+
+# Тема подписки на изменения: 'order:15', 'worker:7' или 'table:orders'
+Topic = Annotated[str, Field(pattern=r'^(order:\d+|worker:\d+|table:(users|customers|orders|order_workers))$')]
+
+
+class SubscriptionMessage(BaseModel, extra='forbid'):
+    subscribe: list[Topic] = Field([], max_length=100)
+    unsubscribe: list[Topic] = Field([], max_length=100)
+
+
+PhoneMatch = Literal['substring', 'prefix', 'exact']
+
+
+class StaffRequest(BaseModel):
+    skills: list[str] = []
+    tools: list[str] | None = None
+    # Больше недостающего до count_workers количества не назначается (DataBase.staff_order)
+    count: int | None = Field(None, ge=1)
+
+
+@app.middleware('http')
+async def admission_control(request: Request, call_next):
+    priority = request_priority(request.method, request.url.path)
+    if priority is None:
+        return await call_next(request)
+    gate = get_gate()
+    try:
+        await gate.acquire(priority)
+    except Overloaded as e:
+        return overloaded_response(e.retry_after)
+    try:
+        return await call_next(request)
+    finally:
+        gate.release()
+
+
+def overloaded_response(retry_after: int) -> JSONResponse:
+    return JSONResponse(status_code=503, content={'detail': 'Сервер перегружен, повторите запрос позже'},
+                        headers={'Retry-After': str(retry_after)})
+
+
+@app.exception_handler(PoolError)
+async def pool_exhausted(request: Request, exc: PoolError):
+    return overloaded_response(config.ADMISSION_RETRY_AFTER)
+
+
+def unavailable_response(retry_after: int) -> JSONResponse:
+    return JSONResponse(status_code=503, content={'detail': 'База данных недоступна, повторите запрос позже'},
+                        headers={'Retry-After': str(retry_after)})
+
+
+@app.exception_handler(CircuitOpen)
+async def circuit_open(request: Request, exc: CircuitOpen):
+    return unavailable_response(exc.retry_after)
+
+
+@app.exception_handler(OperationalError)
+@app.exception_handler(InterfaceError)
+async def connection_lost(request: Request, exc: OperationalError | InterfaceError):
+    if not is_transient(exc):
+        return JSONResponse(status_code=500, content={'detail': f'{exc}'})
+    return unavailable_response(config.ADMISSION_RETRY_AFTER)
+
+
+@app.exception_handler(QueryCanceled)
+async def query_canceled(request: Request, exc: QueryCanceled):
+    return JSONResponse(status_code=504, content={'detail': 'Превышено время выполнения запроса'})
+
+
+@app.middleware('http')
+async def read_your_writes_session(request: Request, call_next):
+    # Клиент передаёт X-DB-LSN из ответа на запись, чтобы следующее чтение не ушло на отстающую реплику
+    try:
+        min_lsn = parse_lsn(request.headers.get('X-DB-LSN'))
+    except ValueError:
+        min_lsn = 0
+    session = {'min_lsn': min_lsn, 'write_lsn': 0}
+    token = read_your_writes.set(session)
+    try:
+        response = await call_next(request)
+    finally:
+        read_your_writes.reset(token)
+    if session['write_lsn']:
+        response.headers['X-DB-LSN'] = format_lsn(session['write_lsn'])
+    return response
+
+
+def profile_settings(scope: dict) -> tuple[str, float, int] | None:
+    """
+    Профилируются запросы с заголовком X-Profile, равным PROFILE_TOKEN, и доля PROFILE_SAMPLE_RATE запросов к /api/.
+    Поток событий /api/events не профилируется: профиль держал бы поток снятия стеков всё время подключения.
+    Возвращает каталог для профиля, период снятия стеков и сколько профилей хранить в каталоге
+    или None, если запрос не профилируется.
+    """
+
+    if scope['path'] == '/api/events':
+        return None
+    requested = False
+    if config.PROFILE_TOKEN:
+        token = config.PROFILE_TOKEN.encode()
+        requested = any(name == b'x-profile' and secrets.compare_digest(value, token) for name, value in scope['headers'])
+    if not requested and config.PROFILE_SAMPLE_RATE:
+        requested = scope['path'].startswith('/api/') and random.random() < config.PROFILE_SAMPLE_RATE
+    return (config.PROFILE_DIR, config.PROFILE_INTERVAL, config.PROFILE_KEEP) if requested else None
+
+
+# Добавляется последним, чтобы быть внешним middleware и учитывать время всего запроса
+app.add_middleware(ProfilingMiddleware, settings=profile_settings)
+
+
+async def verify_token(request: HTTPConnection):
+    # HTTPConnection, а не Request: токен проверяется и при подключении WebSocket
     headers = request.headers
     return
     access_token = headers.get('Authorization')
     if access_token is None:
         raise HTTPException(status_code=401, detail='Отсутствует токен доступа Authorization')
-    if access_token != ACCESS_TOKEN:
+    if access_token != config.ACCESS_TOKEN:
         raise HTTPException(status_code=403, detail='Доступ запрещен')
 
 
+@app.get('/health/live', description='Процесс запущен')
+async def health_live():
+    return {'status': 'ok'}
+
+
+@app.get('/health/ready', description='Пул соединений открыт и прогрет, сервер готов принимать запросы')
+async def health_ready():
+    status_code = 200 if _startup['ready'] else 503
+    return JSONResponse(status_code=status_code, content=_startup)
+
+
+@app.get('/metrics', description='Метрики в формате Prometheus')
+async def get_metrics():
+    return PlainTextResponse(metrics.render())
+
+
 @app.get('/api/users/')
-async def get_users_all(token: str = Depends(verify_token)):
-    db = DataBase(DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT)
+def get_users_all(token: str = Depends(verify_token)):
+    db = get_pool().get()
     try:
-        db = DataBase(DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT)
         users = db.get_all(user_table)
         return users
     except RecordNotFound as e:
@@ -97,8 +580,8 @@ async def get_users_all(token: str = Depends(verify_token)):
 
 
 @app.get('/api/users/{user_id}', response_model=UserInfo)
-async def get_user(user_id: int, token: str = Depends(verify_token)):
-    db = DataBase(DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT)
+def get_user(user_id: int, token: str = Depends(verify_token)):
+    db = get_pool().get()
     try:
         result = db.get_by_id(table_name=user_table, id=user_id)
         return result
@@ -109,37 +592,36 @@ async def get_user(user_id: int, token: str = Depends(verify_token)):
 
 
 @app.get('/api/users/name/')
-async def get_users_by_name(pattern: str, token: str = Depends(verify_token)):
-    db = DataBase(DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT)
+def get_users_by_name(pattern: str, token: str = Depends(verify_token)):
+    db = get_pool().get()
     try:
-        db = DataBase(DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT)
         result = db.get_by_pattern_str(table_name=user_table, param='name', pattern=pattern)
         return result
     except RecordNotFound:
         raise HTTPException(status_code=404, detail=f"Пользователи не найдены")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"{e}")
+        raise internal_error(e)
     finally:
         db.disconnect()
 
 
 @app.get('/api/users/sex/')
-async def get_users_by_name(sex: str, token: str = Depends(verify_token)):
-    db = DataBase(DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT)
+def get_users_by_name(sex: str, token: str = Depends(verify_token)):
+    db = get_pool().get()
     try:
         result = db.get_by_pattern_str(table_name=user_table, param='sex', pattern=sex)
         return result
     except RecordNotFound:
         raise HTTPException(status_code=404, detail=f"Пользователи не найдены")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"{e}")
+        raise internal_error(e)
     finally:
         db.disconnect()
 
 
 @app.get('/api/users/born_date/', description='Получить пользователей по дате рождения')
-async def get_users_by_age(date_from: date, date_to: date, token: str = Depends(verify_token)):
-    db = DataBase(DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT)
+def get_users_by_age(date_from: date, date_to: date, token: str = Depends(verify_token)):
+    db = get_pool().get()
     try:
 
         result = db.get_by_size(table_name=user_table, param='born_date', min_value=date_from, max_value=date_to)
@@ -147,72 +629,83 @@ async def get_users_by_age(date_from: date, date_to: date, token: str = Depends(
     except RecordNotFound:
         raise HTTPException(status_code=404, detail=f"Пользователи не найдены")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"{e}")
+        raise internal_error(e)
     finally:
         db.disconnect()
 
 
-@app.get('/api/users/phone/')
-async def get_users_by_phone(pattern: str, token: str = Depends(verify_token)):
-    db = DataBase(DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT)
+@app.get('/api/users/phone/', description='Найти пользователей по телефону: по части номера как он записан '
+                                         '(по умолчанию), по началу номера (match=prefix) или точно (match=exact) '
+                                         'в любом формате')
+def get_users_by_phone(pattern: str, match: PhoneMatch = 'substring', token: str = Depends(verify_token)):
+    db = get_pool().get()
     try:
-        result = db.get_by_pattern_str(table_name=user_table, param='phone', pattern=pattern)
+        result = find_by_phone(db, user_table, pattern, match)
         return result
     except RecordNotFound:
         raise HTTPException(status_code=404, detail=f"Пользователи не найдены")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"{e}")
+        raise internal_error(e)
     finally:
         db.disconnect()
 
 
 @app.get('/api/users/{user_id}/orders/')
-async def get_users_orders(user_id: int, token: str = Depends(verify_token)):
-    db = DataBase(DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT)
+def get_users_orders(user_id: int, date_from: date | None = None, date_to: date | None = None,
+                     token: str = Depends(verify_token)):
+    db = get_pool().get()
     try:
-        orders = db.get_by_param(table_name=order_workers_table, param='worker_id', value=user_id)
+        orders = db.get_by_param(table_name=order_workers_table, param='worker_id', value=user_id,
+                                 date_from=date_from, date_to=date_to)
         return orders
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"{e}")
+        raise internal_error(e)
     finally:
         db.disconnect()
 
 
+@app.post('/api/users/{user_id}/counters', status_code=202,
+          description='Прибавить значения к счётчикам пользователя, запись в базу выполняется пакетами')
+def add_user_counters(user_id: int, deltas: CounterDeltas, token: str = Depends(verify_token)):
+    get_counters().add(user_id, deltas.dict())
+    return {'status': 'accepted'}
+
+
 @app.post('/api/users/')
-async def add_user(user: UserInfo, token: str = Depends(verify_token)) -> dict:
+def add_user(user: UserInfo, token: str = Depends(verify_token)) -> dict:
     user_dict = user.dict()
     if not user_dict['id']:
         user_dict.pop('id')
-    db = DataBase(DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT)
+    db = get_pool().get()
     try:
         result = db.insert(table_name=user_table, **user_dict)
         return result
     except UniqueViolation:
         raise HTTPException(status_code=422, detail=f'Уже существует пользователь с таким id')
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"{e}")
+        raise internal_error(e)
     finally:
         db.disconnect()
 
 
 @app.put('/api/users/')
-async def update_user(user: UserInfo, token: str = Depends(verify_token)) -> dict:
+def update_user(user: UserInfo, token: str = Depends(verify_token)) -> dict:
     user_dict = user.dict()
-    db = DataBase(DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT)
+    db = get_pool().get()
     try:
         result = db.update_record(table_name=user_table, id=user_dict['id'], updates=user_dict)
         return result
     except TypeError:
         raise HTTPException(status_code=422, detail='Пользователь не существует')
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"{e}")
+        raise internal_error(e)
     finally:
         db.disconnect()
 
 
 @app.delete('/api/users/{user_id}')
-async def delete_user(user_id: int, token: str = Depends(verify_token)) -> dict:
-    db = DataBase(DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT)
+def delete_user(user_id: int, token: str = Depends(verify_token)) -> dict:
+    db = get_pool().get()
     try:
         result = db.delete_by_id(table_name=user_table, id=user_id)
         if result:
@@ -224,180 +717,460 @@ async def delete_user(user_id: int, token: str = Depends(verify_token)) -> dict:
 
 
 @app.get('/api/customers/')
-async def get_customers_all(token: str = Depends(verify_token)):
-    db = DataBase(DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT)
+def get_customers_all(token: str = Depends(verify_token)):
+    db = get_pool().get()
     try:
         result = db.get_all(table_name=customer_table)
         return result
     except RecordNotFound:
         raise HTTPException(status_code=404, detail=f"Пользователи не найдены")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"{e}")
+        raise internal_error(e)
     finally:
         db.disconnect()
 
 
 @app.get('/api/customers/{customer_id}')
-async def get_customer(customer_id: int, token: str = Depends(verify_token)):
-    db = DataBase(DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT)
+def get_customer(customer_id: int, token: str = Depends(verify_token)):
+    db = get_pool().get()
     try:
         result = db.get_by_id(table_name=customer_table, id=customer_id)
         return result
     except RecordNotFound:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"{e}")
+        raise internal_error(e)
     finally:
         db.disconnect()
 
 
 @app.get('/api/customers/name/')
-async def get_customers_by_name(pattern: str, token: str = Depends(verify_token)):
-    db = DataBase(DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT)
+def get_customers_by_name(pattern: str, token: str = Depends(verify_token)):
+    db = get_pool().get()
     try:
         result = db.get_by_pattern_str(table_name=customer_table, param='name', pattern=pattern)
         return result
     except RecordNotFound:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"{e}")
+        raise internal_error(e)
+    finally:
+        db.disconnect()
+
+
+@app.get('/api/customers/phone/', description='Найти заказчиков по телефону: по части номера как он записан '
+                                             '(по умолчанию), по началу номера (match=prefix) или точно '
+                                             '(match=exact) в любом формате')
+def get_customers_by_phone(pattern: str, match: PhoneMatch = 'substring', token: str = Depends(verify_token)):
+    db = get_pool().get()
+    try:
+        result = find_by_phone(db, customer_table, pattern, match)
+        return result
+    except Exception as e:
+        raise internal_error(e)
     finally:
         db.disconnect()
 
 
 @app.post('/api/customers/')
-async def add_customer(customer: CustomerInfo, token: str = Depends(verify_token)):
+def add_customer(customer: CustomerInfo, token: str = Depends(verify_token)):
     customer_dict = customer.dict()
     if not customer_dict['id']:
         customer_dict.pop('id')
-    db = DataBase(DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT)
+    db = get_pool().get()
     try:
         result = db.insert(table_name=customer_table, **customer_dict)
         return result
     except UniqueViolation:
         raise HTTPException(status_code=422, detail='Пользователь с таким id уже существует')
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f'{e}')
+        raise internal_error(e)
     finally:
         db.disconnect()
 
 
 @app.put('/api/customers/')
-async def update_customer(customer_id: int, customer: CustomerInfo, token: str = Depends(verify_token)) -> dict:
-    db = DataBase(DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT)
+def update_customer(customer_id: int, customer: CustomerInfo, token: str = Depends(verify_token)) -> dict:
+    db = get_pool().get()
     try:
         customer_dict = customer.dict()
         result = db.update_record(table_name=customer_table, id=customer_id, updates=customer_dict)
         return result
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f'{e}')
+        raise internal_error(e)
     finally:
         db.disconnect()
 
 
 @app.delete('/api/customers/{customer_id}')
-async def delete_customer(customer_id: int, token: str = Depends(verify_token)) -> dict:
-    db = DataBase(DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT)
+def delete_customer(customer_id: int, token: str = Depends(verify_token)) -> dict:
+    db = get_pool().get()
     try:
         result = db.delete_by_id(table_name=customer_table, id=customer_id)
         return result
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f'{e}')
+        raise internal_error(e)
     finally:
         db.disconnect()
 
 
-@app.get('/api/orders/')
-async def get_orders_all(token: str = Depends(verify_token)):
-    db = DataBase(DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT)
+@app.get('/api/orders/', description='Получить заказы, при указании дат - только с order_date в этом диапазоне')
+def get_orders_all(date_from: date | None = None, date_to: date | None = None, token: str = Depends(verify_token)):
     try:
-        orders = db.get_all(table_name=order_table)
+        orders = coalesced_read('get_all', table_name=order_table, date_from=date_from, date_to=date_to)
         return orders
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f'{e}')
-    finally:
-        db.disconnect()
+        raise internal_error(e)
 
 
 @app.get('/api/orders/{order_id}')
-async def get_order(order_id: int, token: str = Depends(verify_token)):
-    db = DataBase(DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT)
+def get_order(order_id: int, token: str = Depends(verify_token)):
     try:
-        order = db.get_by_id(table_name=order_table, id=order_id)
+        order = coalesced_read('get_by_id', table_name=order_table, id=order_id)
         return order
     except RecordNotFound:
         raise HTTPException(status_code=404, detail='Заказ не найден')
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f'{e}')
-    finally:
-        db.disconnect()
+        raise internal_error(e)
 
 
 @app.get('/api/orders/{order_id}/workers/')
-async def get_workers_id(order_id: int, token: str = Depends(verify_token)):
-    db = DataBase(DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT)
+def get_workers_id(order_id: int, token: str = Depends(verify_token)):
     try:
-        result = db.get_by_param(table_name=order_workers_table, param='order_id', value=order_id)
+        result = coalesced_read('get_by_param', table_name=order_workers_table, param='order_id', value=order_id)
         return [worker['worker_id'] for worker in result]
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f'{e}')
-    finally:
-        db.disconnect()
+        raise internal_error(e)
 
 
 @app.post('/api/orders/{order_id}/workers/')
-async def add_worker(order_id: int, worker_id: int, token: str = Depends(verify_token)):
+def add_worker(order_id: int, worker_id: int, token: str = Depends(verify_token)):
     data = {
         'order_id': order_id,
         'worker_id': worker_id
     }
-    db = DataBase(DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT)
+    db = get_pool().get()
     try:
         result = db.insert(table_name=order_workers_table, **data)
         return result
     except Exception as e:
-        return HTTPException(status_code=500, detail=e)
+        raise internal_error(e)
+    finally:
+        db.disconnect()
+
+
+@app.post('/api/orders/{order_id}/staff', description='Подобрать и назначить исполнителей на заказ')
+def staff_order(order_id: int, staff: StaffRequest | None = None, token: str = Depends(verify_token)):
+    staff = staff or StaffRequest()
+    db = get_pool().get()
+    try:
+        result = db.staff_order(order_id=order_id, skills=staff.skills, tools=staff.tools, count=staff.count)
+        return result
+    except RecordNotFound:
+        raise HTTPException(status_code=404, detail='Заказ не найден')
+    except Exception as e:
+        raise internal_error(e)
     finally:
         db.disconnect()
 
 
 @app.post('/api/orders/')
-async def add_order(order: OrderInfo, token: str = Depends(verify_token)):
-    db = DataBase(DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT)
+def add_order(order: OrderInfo, token: str = Depends(verify_token)):
+    db = get_pool().get()
     try:
         order_dict = dict(order)
         if not order_dict['id']:
             order_dict.pop('id')
-        result = db.insert(table_name=order_table, **order_dict)
+        result = with_order_partition(db, order.order_date,
+                                      lambda: db.insert(table_name=order_table, **order_dict))
         return result
+    except UniqueViolation:
+        raise HTTPException(status_code=422, detail='Заказ с таким id уже существует')
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"{e}")
+        raise internal_error(e)
     finally:
         db.disconnect()
 
 
 @app.put('/api/orders/{order_id}', response_model=OrderInfo)
-async def update_order(order_id: int, order: OrderInfo, token: str = Depends(verify_token)):
-    db = DataBase(DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT)
+def update_order(order_id: int, order: OrderInfo, token: str = Depends(verify_token)):
+    db = get_pool().get()
     try:
         order_dict = dict(order)
         if not order_dict['id']:
             order_dict.pop('id')
-        result = db.update_record(table_name=order_table, id=order_id, updates=order_dict)
+        result = with_order_partition(db, order.order_date,
+                                      lambda: db.update_record(table_name=order_table, id=order_id,
+                                                               updates=order_dict))
         return result
+    except UniqueViolation:
+        raise HTTPException(status_code=422, detail='Заказ с таким id уже существует')
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"{e}")
+        raise internal_error(e)
     finally:
         db.disconnect()
 
 
 @app.delete('/api/orders/{order_id}')
-async def delete_order(order_id: int, token: str = Depends(verify_token)) -> dict:
-    db = DataBase(DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT)
+def delete_order(order_id: int, token: str = Depends(verify_token)) -> dict:
+    db = get_pool().get()
     try:
         result = db.delete_by_id(table_name=order_table, id=order_id)
         return result
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f'{e}')
+        raise internal_error(e)
+    finally:
+        db.disconnect()
+
+
+
+@app.get('/api/changes', description='Получить изменения таблиц после позиции since')
+def get_changes(since: int | None = None, limit: int = Query(500, ge=1, le=5000),
+                tables: list[Literal['users', 'customers', 'orders', 'order_workers']] | None = Query(None),
+                token: str = Depends(verify_token)):
+    db = get_pool().get()
+    try:
+        pruned, settled = db.get_change_positions()
+        if since is None:
+            # Начальная позиция: клиент загружает таблицы целиком и дальше запрашивает изменения с неё
+            return {'next': settled, 'has_more': False, 'changes': []}
+        if since < pruned:
+            raise HTTPException(status_code=410, detail='Изменения удалены из журнала, загрузите таблицы заново')
+        changes, next_since = db.get_changes(since=since, limit=limit, tables=tables)
+        return {'next': next_since, 'has_more': len(changes) == limit, 'changes': changes}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise internal_error(e)
     finally:
         db.disconnect()
+
+
+def subscription_topics(order_id: list[int] | None, worker_id: list[int] | None, table: list[str] | None) -> set[str]:
+    topics = {f'order:{id}' for id in order_id or ()}
+    topics |= {f'worker:{id}' for id in worker_id or ()}
+    topics |= {f'table:{name}' for name in table or ()}
+    return topics or {f'table:{name}' for name in change_tables}
+
+
+@app.get('/api/events', description='Поток изменений заказов, исполнителей и таблиц (Server-Sent Events)')
+async def get_events(request: Request, order_id: list[int] | None = Query(None),
+                     worker_id: list[int] | None = Query(None),
+                     table: list[Literal['users', 'customers', 'orders', 'order_workers']] | None = Query(None),
+                     token: str = Depends(verify_token)):
+    listener = get_listener()
+    subscription = listener.subscribe(subscription_topics(order_id, worker_id, table))
+
+    async def stream():
+        try:
+            while not await request.is_disconnected():
+                event = await subscription.get(timeout=EVENTS_KEEPALIVE)
+                if event is None:
+                    yield ': keepalive\n\n'
+                elif 'change_id' in event:
+                    yield f'id: {event["change_id"]}\nevent: change\ndata: {json.dumps(event)}\n\n'
+                else:
+                    yield f'event: {event["event"]}\ndata: {{}}\n\n'
+        finally:
+            listener.unsubscribe(subscription)
+
+    return StreamingResponse(stream(), media_type='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+
+@app.websocket('/api/ws')
+async def events_websocket(websocket: WebSocket, order_id: list[int] | None = Query(None),
+                           worker_id: list[int] | None = Query(None),
+                           table: list[Literal['users', 'customers', 'orders', 'order_workers']] | None = Query(None),
+                           token: str = Depends(verify_token)):
+    """
+    Поток изменений через WebSocket. Темы задаются параметрами запроса так же, как в /api/events,
+    и меняются сообщениями {"subscribe": ["order:15"]} и {"unsubscribe": ["table:orders"]}.
+    Токен доступа проверяется при подключении, без него сервер отклоняет подключение ответом 401 или 403.
+    На неверное сообщение сервер закрывает соединение с кодом 1003.
+    """
+
+    await websocket.accept()
+    listener = get_listener()
+    subscription = listener.subscribe(subscription_topics(order_id, worker_id, table))
+
+    async def receive():
+        while True:
+            try:
+                message = SubscriptionMessage.model_validate(await websocket.receive_json())
+            except (ValidationError, ValueError, KeyError):
+                # Сообщение не JSON, двоичное или не соответствует SubscriptionMessage
+                await websocket.close(code=1003, reason='Неверное сообщение подписки')
+                return
+            listener.add_topics(subscription, set(message.subscribe))
+            listener.remove_topics(subscription, set(message.unsubscribe))
+
+    receiving = asyncio.create_task(receive())
+    try:
+        while True:
+            getting = asyncio.create_task(subscription.get(timeout=EVENTS_KEEPALIVE))
+            await asyncio.wait({getting, receiving}, return_when=asyncio.FIRST_COMPLETED)
+            if receiving.done():
+                getting.cancel()
+                # Отключение клиента или ошибка при чтении сообщения не теряются вместе с задачей
+                receiving.result()
+                break
+            event = getting.result()
+            if event is not None:
+                await websocket.send_json(event)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiving.cancel()
+        listener.unsubscribe(subscription)
+
+_column_name = re.compile(r'^[a-z_][a-z0-9_]*$')
+
+
+def _check_columns(*names: str):
+    for name in names:
+        if not _column_name.match(name):
+            raise ValueError(f'Недопустимое имя столбца: {name}')
+
+
+def _run_operation(db: DataBase, operation: BatchOperation):
+    if operation.op == 'get':
+        if operation.id is not None:
+            return db.get_by_id(table_name=operation.table, id=operation.id)
+        if operation.param is not None:
+            _check_columns(operation.param)
+            return db.get_by_param(table_name=operation.table, param=operation.param, value=operation.value)
+        return db.get_all(table_name=operation.table)
+    if operation.op == 'insert':
+        data = operation.data or {}
+        _check_columns(*data)
+        return _write(db, operation.table, data, lambda: db.insert(operation.table, **data))
+    if operation.id is None:
+        raise ValueError('Не указан id записи')
+    if operation.op == 'update':
+        data = operation.data or {}
+        _check_columns(*data)
+        return _write(db, operation.table, data,
+                      lambda: db.update_record(table_name=operation.table, id=operation.id, updates=data))
+    return db.delete_by_id(table_name=operation.table, id=operation.id)
+
+
+def _write(db: DataBase, table_name: str, data: dict, write):
+    # Заказ с датой, для которой ещё нет секции orders, записывается так же, как через /api/orders/
+    if table_name != order_table or data.get('order_date') is None:
+        return write()
+    return with_order_partition(db, date.fromisoformat(str(data['order_date'])), write)
+
+
+def _operation_error(e: Exception) -> dict:
+    if isinstance(e, RecordNotFound):
+        return {'status': 404, 'detail': f'{e}'}
+    if isinstance(e, UniqueViolation):
+        return {'status': 422, 'detail': 'Запись с таким id уже существует'}
+    if isinstance(e, ExclusionViolation):
+        return {'status': 409, 'detail': 'Исполнитель уже назначен на заказ в это время'}
+    if isinstance(e, (TypeError, ValueError)):
+        return {'status': 422, 'detail': f'{e}'}
+    if isinstance(e, QueryCanceled):
+        return {'status': 504, 'detail': 'Превышено время выполнения запроса'}
+    if isinstance(e, CircuitOpen) or is_transient(e):
+        return {'status': 503, 'detail': 'База данных недоступна, повторите запрос позже'}
+    return {'status': 500, 'detail': f'{e}'}
+
+
+def _run_single(db: DataBase, operation: BatchOperation) -> dict:
+    try:
+        return {'status': 200, 'result': _run_operation(db, operation)}
+    except Exception as e:
+        return _operation_error(e)
+
+
+def _run_reads(db: DataBase, operations: list[BatchOperation]) -> list[dict]:
+    return [_run_single(db, operation) for operation in operations]
+
+
+async def _extra_connections(count: int) -> list[DataBase]:
+    """
+    Дополнительные соединения для параллельных чтений batch запроса.
+
+    Каждое соединение занимает место в AdmissionGate без ожидания в очереди: если свободных мест или
+    соединений в пуле нет, чтения выполняются на меньшем числе соединений.
+    """
+
+    gate = get_gate()
+    connections = []
+    while len(connections) < count and gate.try_acquire():
+        try:
+            connections.append(await asyncio.to_thread(get_pool().get))
+        except Exception:
+            gate.release()
+            break
+    return connections
+
+
+async def _release_connections(connections: list[DataBase]):
+    gate = get_gate()
+    for db in connections:
+        await asyncio.to_thread(db.disconnect)
+        gate.release()
+
+
+async def _run_concurrent_reads(db: DataBase, operations: list[BatchOperation]) -> list[dict]:
+    if not operations:
+        return []
+    if len(operations) == 1:
+        return await asyncio.to_thread(_run_reads, db, operations)
+    extra = await _extra_connections(min(BATCH_READ_CONCURRENCY, len(operations)) - 1)
+    try:
+        connections = [db] + extra
+        # Чтения распределяются по соединениям по кругу, каждое соединение выполняет свои чтения по порядку
+        groups = await asyncio.gather(*(asyncio.to_thread(_run_reads, connection, operations[i::len(connections)])
+                                        for i, connection in enumerate(connections)))
+    finally:
+        await _release_connections(extra)
+    results = [None] * len(operations)
+    for i, group in enumerate(groups):
+        results[i::len(connections)] = group
+    return results
+
+
+def _run_transaction(operations: list[BatchOperation]) -> list[dict]:
+    db = get_pool().get()
+    results = []
+    try:
+        with db.transaction():
+            for operation in operations:
+                results.append({'status': 200, 'result': _run_operation(db, operation)})
+    except Exception as e:
+        # Все операции транзакции отменяются, ошибка возвращается для операции, на которой она произошла
+        cancelled = {'status': 424, 'detail': 'Транзакция отменена'}
+        return [cancelled] * len(results) + [_operation_error(e)] + [cancelled] * (len(operations) - len(results) - 1)
+    finally:
+        db.disconnect()
+    return results
+
+
+@app.post('/api/batch', description='Выполнить несколько операций за один запрос')
+async def run_batch(batch: BatchRequest, token: str = Depends(verify_token)) -> list[dict]:
+    if batch.transactional:
+        return await asyncio.to_thread(_run_transaction, batch.operations)
+
+    # Операции выполняются на одном соединении запроса. Подряд идущие чтения независимы и могут выполняться
+    # параллельно на дополнительных соединениях, изменения выполняются по порядку
+    db = await asyncio.to_thread(get_pool().get)
+    try:
+        results = []
+        reads = []
+        for operation in batch.operations:
+            if operation.op == 'get':
+                reads.append(operation)
+                continue
+            results += await _run_concurrent_reads(db, reads)
+            reads = []
+            results.append(await asyncio.to_thread(_run_single, db, operation))
+        results += await _run_concurrent_reads(db, reads)
+        return results
+    finally:
+        await asyncio.to_thread(db.disconnect)
+
+
+_startup['import_seconds'] = round(perf_counter() - _import_started, 4)
@@ -0,0 +1,52 @@
+import os
+import unittest
+from fastapi.testclient import TestClient
+from database import DataBase, ConnectionPool
+from config import DB_USER, DB_PASSWORD, DB_HOST, DB_PORT
+import server
+
+# Для тестов с базой нужна отдельная база на DB_HOST/DB_PORT с применёнными миграциями, например TEST_DB=mbt_test.
+# Без TEST_DB такие тесты пропускаются.
+TEST_DB = os.getenv('TEST_DB')
+
+
+def connect() -> DataBase:
+    return DataBase(TEST_DB, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT)
+
+
+def connection_pool(**kwargs) -> ConnectionPool:
+    return ConnectionPool(TEST_DB, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, **kwargs)
+
+
+@unittest.skipUnless(TEST_DB, 'TEST_DB не задан')
+class DataBaseCase(unittest.TestCase):
+    """Тест с соединением self.db с базой TEST_DB. Наследники удаляют свои данные до super().tearDown()."""
+
+    def setUp(self):
+        self.db = connect()
+
+    def tearDown(self):
+        self.db.disconnect()
+
+
+class ServerCase(DataBaseCase):
+    """Тест сервера: self.client выполняет запросы через пул соединений с TEST_DB, AdmissionGate отключён."""
+
+    def setUp(self):
+        super().setUp()
+        self.serve()
+
+    def tearDown(self):
+        server._pool.close()
+        server._pool = None
+        server._gate = None
+        super().tearDown()
+
+    def serve(self, gate=None, **kwargs):
+        """Заменяет пул и AdmissionGate сервера, kwargs передаются в ConnectionPool."""
+
+        if server._pool is not None:
+            server._pool.close()
+        server._pool = connection_pool(**kwargs)
+        server._gate = gate
+        self.client = TestClient(server.app)
@@ -0,0 +1,91 @@
+import asyncio
+import unittest
+from admission import AdmissionGate, Overloaded
+
+
+class AdmissionGateTest(unittest.TestCase):
+    def test_limit(self):
+        async def run():
+            gate = AdmissionGate(limit=2, queue_size=10, timeout=1)
+            running = []
+            peak = []
+
+            async def request():
+                await gate.acquire()
+                running.append(1)
+                peak.append(len(running))
+                await asyncio.sleep(0.01)
+                running.pop()
+                gate.release()
+
+            await asyncio.gather(*(request() for _ in range(10)))
+            self.assertEqual(max(peak), 2)
+            self.assertEqual(gate.active, 0)
+
+        asyncio.run(run())
+
+    def test_priority_order(self):
+        async def run():
+            gate = AdmissionGate(limit=1, queue_size=10, timeout=1)
+            await gate.acquire()
+            order = []
+
+            async def request(priority):
+                await gate.acquire(priority)
+                order.append(priority)
+                gate.release()
+
+            tasks = [asyncio.create_task(request(priority)) for priority in (3, 0, 2, 1)]
+            await asyncio.sleep(0)
+            gate.release()
+            await asyncio.gather(*tasks)
+            self.assertEqual(order, [0, 1, 2, 3])
+
+        asyncio.run(run())
+
+    def test_queue_full(self):
+        async def run():
+            gate = AdmissionGate(limit=1, queue_size=1, timeout=1, retry_after=3)
+            await gate.acquire()
+            waiting = asyncio.create_task(gate.acquire())
+            await asyncio.sleep(0)
+            with self.assertRaises(Overloaded) as error:
+                await gate.acquire()
+            self.assertEqual(error.exception.retry_after, 3)
+            gate.release()
+            await waiting
+            gate.release()
+            self.assertEqual(gate.active, 0)
+
+        asyncio.run(run())
+
+    def test_timeout(self):
+        async def run():
+            gate = AdmissionGate(limit=1, queue_size=10, timeout=0.01)
+            await gate.acquire()
+            with self.assertRaises(Overloaded):
+                await gate.acquire()
+            self.assertEqual(gate.waiting, 0)
+            gate.release()
+            self.assertEqual(gate.active, 0)
+
+        asyncio.run(run())
+
+    def test_try_acquire(self):
+        async def run():
+            gate = AdmissionGate(limit=2, queue_size=10, timeout=1)
+            self.assertTrue(gate.try_acquire())
+            self.assertTrue(gate.try_acquire())
+            self.assertFalse(gate.try_acquire())
+            gate.release()
+            # Место, освобождённое при пустой очереди, можно занять снова
+            self.assertTrue(gate.try_acquire())
+            gate.release()
+            gate.release()
+            self.assertEqual(gate.active, 0)
+
+        asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()
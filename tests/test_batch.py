@@ -0,0 +1,98 @@
+import unittest
+from unittest import mock
+from admission import AdmissionGate
+import server
+from db_case import ServerCase
+
+# Тесты добавляют заказчиков с комментарием COMMENT и удаляют их после себя.
+COMMENT = 'test_batch'
+
+
+class BatchTest(ServerCase):
+    def setUp(self):
+        super().setUp()
+        self.customer = self.db.insert('customers', name='Заказчик', comment=COMMENT)
+        self.connect(maxconn=10, gate_limit=10)
+
+    def tearDown(self):
+        self.db.cursor.execute('DELETE FROM customers WHERE comment = %s', (COMMENT,))
+        super().tearDown()
+
+    def connect(self, maxconn: int, gate_limit: int):
+        self.serve(AdmissionGate(gate_limit, queue_size=10, timeout=1), maxconn=maxconn)
+
+    def batch(self, operations: list[dict], transactional: bool = False) -> list[dict]:
+        response = self.client.post('/api/batch', json={'operations': operations, 'transactional': transactional})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def names(self) -> list[str]:
+        return sorted(record['name'] for record in self.db.get_by_param('customers', 'comment', COMMENT))
+
+    def test_partial_failure(self):
+        results = self.batch([
+            {'op': 'insert', 'table': 'customers', 'data': {'name': 'Новый', 'comment': COMMENT}},
+            {'op': 'get', 'table': 'customers', 'id': 0},
+            {'op': 'update', 'table': 'customers', 'id': self.customer['id'], 'data': {'name; --': 'x'}},
+            {'op': 'get', 'table': 'customers', 'id': self.customer['id']},
+        ])
+        self.assertEqual([result['status'] for result in results], [200, 404, 422, 200])
+        self.assertEqual(results[3]['result']['name'], 'Заказчик')
+        # Ошибки отдельных операций не отменяют остальные
+        self.assertEqual(self.names(), ['Заказчик', 'Новый'])
+
+    def test_column_names_are_validated(self):
+        results = self.batch([
+            {'op': 'get', 'table': 'customers', 'param': 'comment"; --', 'value': COMMENT},
+            {'op': 'insert', 'table': 'customers', 'data': {'Name': 'x'}},
+            {'op': 'get', 'table': 'customers', 'param': 'comment', 'value': COMMENT},
+        ])
+        self.assertEqual([result['status'] for result in results], [422, 422, 200])
+        self.assertIn('comment"; --', results[0]['detail'])
+        self.assertEqual([record['name'] for record in results[2]['result']], ['Заказчик'])
+
+    def test_transaction_is_cancelled_on_error(self):
+        results = self.batch([
+            {'op': 'insert', 'table': 'customers', 'data': {'name': 'Новый', 'comment': COMMENT}},
+            {'op': 'update', 'table': 'customers', 'id': self.customer['id'], 'data': {'name': 'Изменён'}},
+            {'op': 'insert', 'table': 'customers', 'data': {'id': self.customer['id'], 'comment': COMMENT}},
+            {'op': 'get', 'table': 'customers', 'id': self.customer['id']},
+        ], transactional=True)
+        self.assertEqual([result['status'] for result in results], [424, 424, 422, 424])
+        self.assertEqual(self.names(), ['Заказчик'])
+
+    def test_transaction_commits(self):
+        results = self.batch([
+            {'op': 'insert', 'table': 'customers', 'data': {'name': 'Новый', 'comment': COMMENT}},
+            {'op': 'delete', 'table': 'customers', 'id': self.customer['id']},
+        ], transactional=True)
+        self.assertEqual([result['status'] for result in results], [200, 200])
+        self.assertEqual(self.names(), ['Новый'])
+
+    def test_reads_use_request_connection_when_pool_is_busy(self):
+        # Запрос занимает единственное соединение пула, параллельные чтения не должны получать PoolError
+        self.connect(maxconn=1, gate_limit=10)
+        operations = [{'op': 'get', 'table': 'customers', 'id': self.customer['id']}] * 6
+        results = self.batch(operations)
+        self.assertEqual([result['status'] for result in results], [200] * 6)
+
+    def test_extra_connections_are_counted_by_gate(self):
+        operations = [{'op': 'get', 'table': 'customers', 'id': self.customer['id']},
+                      {'op': 'get', 'table': 'customers', 'id': 0}] * 3
+        with mock.patch.object(server._pool, 'get', wraps=server._pool.get) as get:
+            results = self.batch(operations)
+        self.assertEqual([result['status'] for result in results], [200, 404] * 3)
+        self.assertEqual(get.call_count, server.BATCH_READ_CONCURRENCY)
+        self.assertEqual(server._gate.active, 0)
+
+        # Единственное место AdmissionGate занято самим запросом, дополнительные соединения не открываются
+        self.connect(maxconn=10, gate_limit=1)
+        with mock.patch.object(server._pool, 'get', wraps=server._pool.get) as get:
+            results = self.batch(operations)
+        self.assertEqual([result['status'] for result in results], [200, 404] * 3)
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual(server._gate.active, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
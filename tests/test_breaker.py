@@ -0,0 +1,223 @@
+import time
+import unittest
+import psycopg2
+from psycopg2.errors import QueryCanceled, UniqueViolation
+from breaker import CircuitBreaker, CircuitOpen, CLOSED, OPEN, HALF_OPEN
+from database import ConnectionPool, DataBase, Deadline, is_transient, request_deadline, retry_delay
+
+
+def lost_connection() -> psycopg2.OperationalError:
+    return psycopg2.OperationalError('server closed the connection unexpectedly')
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def open_breaker(self, breaker: CircuitBreaker):
+        for _ in range(breaker.failure_threshold):
+            breaker.failure()
+
+    def test_opens_after_consecutive_failures(self):
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10)
+        breaker.failure()
+        breaker.failure()
+        breaker.success()
+        breaker.failure()
+        self.assertEqual(breaker.state, CLOSED)
+        self.open_breaker(breaker)
+        self.assertEqual(breaker.state, OPEN)
+        with self.assertRaises(CircuitOpen):
+            breaker.allow()
+
+    def test_half_open_probe_closes_on_success(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+        self.open_breaker(breaker)
+        time.sleep(0.06)
+        breaker.allow()
+        self.assertEqual(breaker.state, HALF_OPEN)
+        # Пока пробный запрос выполняется, остальные отклоняются
+        with self.assertRaises(CircuitOpen):
+            breaker.allow()
+        breaker.success()
+        self.assertEqual(breaker.state, CLOSED)
+        breaker.allow()
+
+    def test_half_open_probe_reopens_on_failure(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+        self.open_breaker(breaker)
+        time.sleep(0.06)
+        breaker.allow()
+        breaker.failure()
+        self.assertEqual(breaker.state, OPEN)
+        with self.assertRaises(CircuitOpen):
+            breaker.allow()
+
+
+class TransientErrorTest(unittest.TestCase):
+    def test_connection_errors_are_transient(self):
+        self.assertTrue(is_transient(psycopg2.OperationalError('server closed the connection unexpectedly')))
+        self.assertTrue(is_transient(psycopg2.InterfaceError('connection already closed')))
+
+    def test_query_errors_are_not_transient(self):
+        self.assertFalse(is_transient(QueryCanceled()))
+        self.assertFalse(is_transient(UniqueViolation()))
+        self.assertFalse(is_transient(ValueError()))
+
+    def test_retry_delay_is_bounded(self):
+        for attempt in range(10):
+            delay = retry_delay(attempt, 0.1, 2)
+            self.assertTrue(0 <= delay <= min(2, 0.1 * 2 ** attempt))
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, query, params=None):
+        server = self.connection.server
+        server.queries += 1
+        if server.errors:
+            raise server.errors.pop(0)
+
+    def fetchall(self):
+        return [{'value': 1}]
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    autocommit = False
+
+    def __init__(self, server):
+        self.server = server
+        self.prepared = set()
+        self.closed = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+class FakeServer:
+    """Пул psycopg2 без сервера: запросы выбрасывают ошибки из errors, подключения - из connect_errors."""
+
+    def __init__(self, errors=(), connect_errors=()):
+        self.errors = list(errors)
+        self.connect_errors = list(connect_errors)
+        self.queries = 0
+        self.connections = []
+        self.discarded = []
+
+    def getconn(self):
+        if self.connect_errors:
+            raise self.connect_errors.pop(0)
+        connection = FakeConnection(self)
+        self.connections.append(connection)
+        return connection
+
+    def putconn(self, connection, close=False):
+        if close:
+            self.discarded.append(connection)
+
+
+class ReadRetryTest(unittest.TestCase):
+    def connect(self, server: FakeServer, read_retries: int = 2, failure_threshold: int = 10) -> DataBase:
+        pool = ConnectionPool.__new__(ConnectionPool)
+        pool.db_name, pool.user, pool.password, pool.host, pool.port = 'test', 'test', '', 'localhost', 5432
+        pool.replicas = None
+        pool.breaker = CircuitBreaker(failure_threshold=failure_threshold, reset_timeout=60)
+        pool.read_retries = read_retries
+        pool.retry_delay = 0
+        pool.retry_max_delay = 0
+        pool._pool = server
+        return pool.get()
+
+    def test_read_is_retried_on_new_connection(self):
+        server = FakeServer(errors=[lost_connection(), lost_connection()])
+        db = self.connect(server)
+        self.assertEqual(db._read('SELECT 1'), [{'value': 1}])
+        self.assertEqual(server.queries, 3)
+        # Оборванные соединения закрываются, чтение продолжается на новом
+        self.assertEqual(server.discarded, server.connections[:2])
+        self.assertIs(db.connection, server.connections[2])
+        self.assertEqual(db._pool.breaker.failures, 0)
+
+    def test_retries_are_limited(self):
+        server = FakeServer(errors=[lost_connection()] * 3)
+        db = self.connect(server)
+        with self.assertRaises(psycopg2.OperationalError):
+            db._read('SELECT 1')
+        self.assertEqual(server.queries, 3)
+        self.assertEqual(db._pool.breaker.failures, 3)
+
+    def test_query_errors_are_not_retried(self):
+        server = FakeServer(errors=[QueryCanceled()])
+        db = self.connect(server)
+        with self.assertRaises(QueryCanceled):
+            db._read('SELECT 1')
+        self.assertEqual(server.queries, 1)
+        self.assertEqual(db._pool.breaker.failures, 0)
+
+    def test_expired_deadline_stops_retries(self):
+        server = FakeServer(errors=[lost_connection()])
+        db = self.connect(server)
+        deadline = Deadline(0)
+        token = request_deadline.set(deadline)
+        try:
+            with self.assertRaises(psycopg2.OperationalError):
+                db._read('SELECT 1')
+        finally:
+            request_deadline.reset(token)
+        self.assertEqual(server.queries, 1)
+        self.assertEqual(len(server.connections), 1)
+
+    def test_no_retry_in_transaction(self):
+        server = FakeServer(errors=[lost_connection()])
+        db = self.connect(server)
+        db._transaction_depth = 1
+        with self.assertRaises(psycopg2.OperationalError):
+            db._read('SELECT 1')
+        # Повтор на новом соединении потерял бы предыдущие запросы транзакции
+        self.assertEqual(server.queries, 1)
+        self.assertEqual(len(server.connections), 1)
+
+    def test_reconnect_failure(self):
+        server = FakeServer(errors=[lost_connection()])
+        db = self.connect(server)
+        server.connect_errors = [psycopg2.OperationalError('could not connect to server')]
+        with self.assertRaises(psycopg2.OperationalError) as error:
+            db._read('SELECT 1')
+        self.assertEqual(str(error.exception), 'could not connect to server')
+        self.assertIsNone(db.connection)
+        self.assertEqual(server.discarded, server.connections)
+        # Ошибка подключения тоже учитывается автоматом, а disconnect() не возвращает соединение повторно
+        self.assertEqual(db._pool.breaker.failures, 2)
+        db.disconnect()
+        self.assertEqual(len(server.discarded), 1)
+
+    def test_breaker_opens_after_repeated_failures(self):
+        server = FakeServer(errors=[lost_connection()] * 3)
+        db = self.connect(server, read_retries=0, failure_threshold=3)
+        breaker = db._pool.breaker
+        for _ in range(2):
+            with self.assertRaises(psycopg2.OperationalError):
+                db._read('SELECT 1')
+            self.assertEqual(breaker.state, CLOSED)
+        with self.assertRaises(psycopg2.OperationalError):
+            db._read('SELECT 1')
+        self.assertEqual(breaker.state, OPEN)
+        # При открытом автомате новые соединения не выдаются, а повтор чтения сразу получает CircuitOpen
+        with self.assertRaises(CircuitOpen):
+            db._pool.get()
+        server.errors = [lost_connection()]
+        retrying = self.connect(server, read_retries=1)
+        retrying._pool.breaker = breaker
+        with self.assertRaises(CircuitOpen):
+            retrying._read('SELECT 1')
+
+        # Успешный пробный запрос после reset_timeout закрывает автомат
+        breaker.reset_timeout = 0
+        self.assertEqual(db._pool.get()._read('SELECT 1'), [{'value': 1}])
+        self.assertEqual(breaker.state, CLOSED)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+from database import DataBase
+from db_case import ServerCase, connect
+
+# Тесты очищают журнал change_log базы TEST_DB.
+COMMENT = 'test_changes'
+
+
+class ChangeFeedTest(ServerCase):
+    def setUp(self):
+        super().setUp()
+        self.other = connect()
+
+    def tearDown(self):
+        self.db.cursor.execute('DELETE FROM customers WHERE comment = %s', (COMMENT,))
+        self.other.disconnect()
+        super().tearDown()
+
+    def add_customer(self, db: DataBase) -> int:
+        db.insert('customers', name='Заказчик', comment=COMMENT)
+        return self.last_change()
+
+    def last_change(self) -> int:
+        return self.db._read('SELECT max(id) AS id FROM change_log')[0]['id']
+
+    def changes(self, since: int | None = None):
+        params = {'tables': 'customers'}
+        if since is not None:
+            params['since'] = since
+        return self.client.get('/api/changes', params=params)
+
+    def test_bootstrap_position(self):
+        last = self.add_customer(self.db)
+        response = self.changes()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'next': last, 'has_more': False, 'changes': []})
+
+    def test_bootstrap_waits_for_unfinished_transaction(self):
+        start = self.add_customer(self.db)
+        with self.other.transaction():
+            # Изменение незавершённой транзакции получает меньший id, чем зафиксированное после него
+            self.other.insert('customers', name='Заказчик', comment=COMMENT)
+            committed = self.add_customer(self.db)
+            self.assertEqual(self.changes().json()['next'], committed - 1)
+            # Зафиксированное изменение не выдаётся, пока не завершена транзакция, начатая раньше него
+            self.assertEqual(self.changes(since=start).json()['changes'], [])
+        self.assertEqual(self.changes().json()['next'], committed)
+        changes = self.changes(since=start).json()['changes']
+        self.assertEqual([change['id'] for change in changes], [committed - 1, committed])
+
+    def test_pruned_changes(self):
+        self.add_customer(self.db)
+        pruned = self.add_customer(self.db)
+        self.db.cursor.execute("UPDATE change_log SET changed_at = now() - interval '2 days' WHERE id <= %s",
+                               (pruned,))
+        self.assertGreaterEqual(self.db.prune_changes(days=1), 2)
+        self.assertEqual(self.db.get_change_positions()[0], pruned)
+        self.assertEqual(self.changes(since=pruned - 1).status_code, 410)
+        self.assertEqual(self.changes(since=pruned).status_code, 200)
+        # Журнал очищен целиком: новый клиент получает позицию после удалённых изменений, а не 410
+        response = self.changes()
+        self.assertEqual(response.json()['next'], pruned)
+        self.assertEqual(self.changes(since=response.json()['next']).status_code, 200)
+        last = self.add_customer(self.db)
+        changes = self.changes(since=pruned).json()['changes']
+        self.assertEqual([change['id'] for change in changes], [last])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from psycopg2.errors import QueryCanceled
+from coalesce import SingleFlight
+from database import Deadline, request_deadline
+import server
+
+
+class SingleFlightTest(unittest.TestCase):
+    def setUp(self):
+        self.calls = 0
+        self.release = threading.Event()
+
+    def slow_read(self):
+        self.calls += 1
+        self.release.wait(1)
+        return [{'id': 1}]
+
+    def test_concurrent_calls_share_one_read(self):
+        flight = SingleFlight()
+        with ThreadPoolExecutor(10) as executor:
+            futures = [executor.submit(flight.do, ('get_by_id', 1), self.slow_read) for _ in range(10)]
+            time.sleep(0.05)
+            self.release.set()
+            results = [future.result() for future in futures]
+        self.assertEqual(self.calls, 1)
+        self.assertTrue(all(result is results[0] for result in results))
+
+    def test_different_keys_are_not_shared(self):
+        flight = SingleFlight()
+        self.release.set()
+        flight.do(('get_by_id', 1), self.slow_read)
+        flight.do(('get_by_id', 2), self.slow_read)
+        self.assertEqual(self.calls, 2)
+
+    def test_without_ttl_result_is_not_reused(self):
+        flight = SingleFlight()
+        self.release.set()
+        flight.do('key', self.slow_read)
+        flight.do('key', self.slow_read)
+        self.assertEqual(self.calls, 2)
+
+    def test_ttl_reuses_result(self):
+        flight = SingleFlight(ttl=60)
+        self.release.set()
+        flight.do('key', self.slow_read)
+        flight.do('key', self.slow_read)
+        self.assertEqual(self.calls, 1)
+
+    def test_error_is_shared_and_not_cached(self):
+        flight = SingleFlight(ttl=60)
+
+        def failing_read():
+            self.calls += 1
+            raise LookupError
+
+        for _ in range(2):
+            with self.assertRaises(LookupError):
+                flight.do('key', failing_read)
+        self.assertEqual(self.calls, 2)
+
+    def test_follower_wait_is_limited_by_timeout(self):
+        flight = SingleFlight()
+        with ThreadPoolExecutor(2) as executor:
+            leader = executor.submit(flight.do, 'key', self.slow_read)
+            time.sleep(0.05)
+            started = time.monotonic()
+            with self.assertRaises(TimeoutError):
+                flight.do('key', self.slow_read, timeout=0.05)
+            self.assertLess(time.monotonic() - started, 0.5)
+            # Чтение первого вызова не прерывается
+            self.release.set()
+            self.assertEqual(leader.result(), [{'id': 1}])
+        self.assertEqual(self.calls, 1)
+
+
+class FakeDataBase:
+    def __init__(self, release: threading.Event):
+        self.release = release
+
+    def get_by_id(self, table_name, id):
+        self.release.wait(1)
+        return {'id': id}
+
+    def disconnect(self):
+        pass
+
+
+class CoalescedReadTest(unittest.TestCase):
+    def test_follower_gets_query_canceled_after_deadline(self):
+        release = threading.Event()
+        pool = mock.Mock(get=lambda: FakeDataBase(release))
+
+        def read(timeout):
+            token = request_deadline.set(Deadline(timeout))
+            try:
+                return server.coalesced_read('get_by_id', table_name='orders', id=1)
+            finally:
+                request_deadline.reset(token)
+
+        with mock.patch.object(server, 'get_pool', return_value=pool), \
+                mock.patch.object(server, '_reads', SingleFlight()), ThreadPoolExecutor(1) as executor:
+            leader = executor.submit(read, 10)
+            time.sleep(0.05)
+            with self.assertRaises(QueryCanceled):
+                read(0.05)
+            release.set()
+            self.assertEqual(leader.result(), {'id': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
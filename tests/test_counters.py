@@ -0,0 +1,135 @@
+import asyncio
+import time
+import unittest
+from unittest import mock
+from fastapi.testclient import TestClient
+import server
+from counters import CounterBuffer, DELTA_LIMIT
+
+
+class CounterBufferTest(unittest.TestCase):
+    def setUp(self):
+        self.flushed = []
+        self.fail = False
+
+    def write(self, deltas):
+        if self.fail:
+            raise ConnectionError
+        if 13 in deltas:
+            raise ValueError('integer out of range')
+        self.flushed.append(deltas)
+
+    def test_deltas_are_merged_per_user(self):
+        buffer = CounterBuffer(self.write)
+        buffer.add(1, {'rating': 1, 'profit': 100})
+        buffer.add(1, {'rating': 2, 'orders': 1})
+        buffer.add(2, {'rating': -1, 'profit': 0})
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(self.flushed, [{1: {'rating': 3, 'profit': 100, 'orders': 1}, 2: {'rating': -1}}])
+
+    def test_zero_deltas_are_ignored(self):
+        buffer = CounterBuffer(self.write)
+        buffer.add(1, {'rating': 0, 'profit': 0, 'orders': 0})
+        self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(self.flushed, [])
+
+    def test_failed_flush_keeps_deltas(self):
+        buffer = CounterBuffer(self.write)
+        buffer.add(1, {'rating': 1})
+        self.fail = True
+        with self.assertRaises(ConnectionError):
+            buffer.flush()
+        buffer.add(1, {'rating': 1})
+        self.fail = False
+        buffer.flush()
+        self.assertEqual(self.flushed, [{1: {'rating': 2}}])
+
+    def test_full_buffer_is_flushed_early(self):
+        buffer = CounterBuffer(self.write, interval=60, max_users=2)
+        buffer.start()
+        try:
+            buffer.add(1, {'rating': 1})
+            buffer.add(2, {'rating': 1})
+            for _ in range(100):
+                if self.flushed:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(self.flushed, [{1: {'rating': 1}, 2: {'rating': 1}}])
+        finally:
+            buffer.stop()
+
+    def test_stop_flushes_remaining_deltas(self):
+        buffer = CounterBuffer(self.write, interval=60)
+        buffer.start()
+        buffer.add(1, {'profit': 500})
+        buffer.stop()
+        self.assertEqual(self.flushed, [{1: {'profit': 500}}])
+
+    def test_merged_delta_is_capped(self):
+        buffer = CounterBuffer(self.write)
+        buffer.add(1, {'profit': DELTA_LIMIT, 'rating': -DELTA_LIMIT})
+        buffer.add(1, {'profit': DELTA_LIMIT, 'rating': -DELTA_LIMIT})
+        buffer.flush()
+        self.assertEqual(self.flushed, [{1: {'profit': DELTA_LIMIT, 'rating': -DELTA_LIMIT}}])
+
+    def test_invalid_user_is_dropped(self):
+        buffer = CounterBuffer(self.write, retryable=lambda error: isinstance(error, ConnectionError))
+        buffer.add(1, {'rating': 1})
+        buffer.add(13, {'rating': 1})
+        buffer.add(2, {'rating': 1})
+        # Пакет не записан, пользователи записываются по одному, некорректный отбрасывается
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(self.flushed, [{1: {'rating': 1}}, {2: {'rating': 1}}])
+        self.assertEqual(buffer.flush(), 0)
+
+    def test_retryable_error_keeps_remaining_users(self):
+        def write(deltas):
+            if len(deltas) > 1:
+                raise ValueError
+            if 2 in deltas:
+                raise ConnectionError
+            self.flushed.append(deltas)
+
+        buffer = CounterBuffer(write, retryable=lambda error: isinstance(error, ConnectionError))
+        buffer.add(1, {'rating': 1})
+        buffer.add(2, {'rating': 1})
+        buffer.add(3, {'rating': 1})
+        with self.assertRaises(ConnectionError):
+            buffer.flush()
+        self.assertEqual(self.flushed, [{1: {'rating': 1}}])
+        self.assertEqual(buffer._pending, {2: {'rating': 1}, 3: {'rating': 1}})
+
+
+class CounterEndpointTest(unittest.TestCase):
+    def test_deltas_are_bounded(self):
+        with mock.patch.object(server, 'get_counters') as get_counters, \
+                mock.patch.object(server, '_gate', None):
+            client = TestClient(server.app)
+            response = client.post('/api/users/1/counters', json={'profit': 2 ** 40})
+            self.assertEqual(response.status_code, 422)
+            response = client.post('/api/users/1/counters', json={'profit': 100, 'rating': -1})
+            self.assertEqual(response.status_code, 202)
+        get_counters().add.assert_called_once_with(1, {'rating': -1, 'profit': 100, 'orders': 0})
+
+    def test_pool_is_closed_when_counters_flush_fails(self):
+        counters = mock.Mock(stop=mock.Mock(side_effect=ConnectionError))
+        listener = mock.Mock(start=mock.AsyncMock(), stop=mock.AsyncMock())
+        pool = mock.Mock()
+
+        async def maintenance():
+            await asyncio.Event().wait()
+
+        with mock.patch.object(server, 'get_pool', return_value=pool), \
+                mock.patch.object(server, 'get_counters', return_value=counters), \
+                mock.patch.object(server, 'get_listener', return_value=listener), \
+                mock.patch.object(server, 'run_maintenance_periodically', maintenance), \
+                mock.patch.object(server, '_pool', pool):
+            with TestClient(server.app):
+                pass
+            self.assertIsNone(server._pool)
+        counters.stop.assert_called_once()
+        pool.close.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import threading
+import time
+import unittest
+from psycopg2.errors import QueryCanceled
+from database import DataBase, Deadline, request_deadline
+from config import _route_timeouts
+
+
+class FakeConnection:
+    def __init__(self):
+        self.cancelled = 0
+
+    def cancel(self):
+        self.cancelled += 1
+
+
+class FakeCursor:
+    def __init__(self, deadline=None):
+        self.connection = FakeConnection()
+        self.deadline = deadline
+        self.queries = []
+
+    def execute(self, query, params=None):
+        if self.deadline is not None:
+            self.deadline.cancel()
+        self.queries.append((query, params))
+
+
+class DeadlineTest(unittest.TestCase):
+    def test_remaining_time(self):
+        deadline = Deadline(2)
+        self.assertTrue(1900 < deadline.remaining_ms() <= 2000)
+        self.assertFalse(deadline.expired())
+
+    def test_expired_deadline_leaves_minimal_timeout(self):
+        deadline = Deadline(0)
+        time.sleep(0.01)
+        self.assertTrue(deadline.expired())
+        self.assertEqual(deadline.remaining_ms(), 1)
+
+    def test_cancel_interrupts_tracked_connections(self):
+        deadline = Deadline(1)
+        active, finished = FakeConnection(), FakeConnection()
+        deadline.track(active)
+        deadline.track(finished)
+        deadline.untrack(finished)
+        deadline.cancel()
+        self.assertTrue(deadline.cancelled)
+        self.assertEqual(active.cancelled, 1)
+        self.assertEqual(finished.cancelled, 0)
+
+    def test_untrack_waits_for_cancel(self):
+        deadline = Deadline(1)
+        connection = FakeConnection()
+        sending = threading.Event()
+        sent = threading.Event()
+
+        def cancel():
+            sending.set()
+            time.sleep(0.05)
+            sent.set()
+
+        connection.cancel = cancel
+        deadline.track(connection)
+        canceller = threading.Thread(target=deadline.cancel)
+        canceller.start()
+        sending.wait(1)
+        # Соединение возвращается в пул только после того, как отмена отправлена
+        deadline.untrack(connection)
+        self.assertTrue(sent.is_set())
+        canceller.join()
+
+    def test_cancelled_deadline_does_not_track(self):
+        deadline = Deadline(1)
+        deadline.cancel()
+        connection = FakeConnection()
+        self.assertFalse(deadline.track(connection))
+        self.assertEqual(deadline._connections, set())
+
+    def test_detached_deadline_is_not_cancelled_with_original(self):
+        deadline = Deadline(1)
+        detached = deadline.detached()
+        deadline.cancel()
+        self.assertEqual(detached.expires, deadline.expires)
+        self.assertFalse(detached.cancelled)
+
+
+class ExecuteTest(unittest.TestCase):
+    def setUp(self):
+        self.db = DataBase.__new__(DataBase)
+        self.db._pool = None
+
+    def run_with(self, deadline, cursor):
+        token = request_deadline.set(deadline)
+        try:
+            self.db._execute(cursor, 'SELECT * FROM users WHERE id = %s', (1,))
+        finally:
+            request_deadline.reset(token)
+
+    def test_without_deadline_query_is_unchanged(self):
+        cursor = FakeCursor()
+        self.db._execute(cursor, 'SELECT 1')
+        self.assertEqual(cursor.queries, [('SELECT 1', None)])
+
+    def test_deadline_sets_statement_timeout(self):
+        cursor = FakeCursor()
+        self.run_with(Deadline(5), cursor)
+        query, params = cursor.queries[0]
+        self.assertRegex(query, r'^SET LOCAL statement_timeout = \d+; SELECT \* FROM users WHERE id = %s$')
+        self.assertEqual(params, (1,))
+
+    def test_connection_is_cancelled_during_query(self):
+        deadline = Deadline(5)
+        cursor = FakeCursor(deadline)
+        self.run_with(deadline, cursor)
+        self.assertEqual(cursor.connection.cancelled, 1)
+
+    def test_cancelled_deadline_skips_query(self):
+        deadline = Deadline(5)
+        deadline.cancel()
+        cursor = FakeCursor()
+        with self.assertRaises(QueryCanceled):
+            self.run_with(deadline, cursor)
+        self.assertEqual(cursor.queries, [])
+
+
+class RouteTimeoutsTest(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(_route_timeouts('/api/users/=30, /api/changes=2.5,,broken'),
+                         {'/api/users/': 30.0, '/api/changes': 2.5})
+        self.assertEqual(_route_timeouts(''), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import asyncio
+import time
+import unittest
+from unittest import mock
+from fastapi import HTTPException, WebSocketDisconnect
+from fastapi.requests import HTTPConnection
+from fastapi.testclient import TestClient
+from starlette.testclient import WebSocketDenialResponse
+from notifications import ChangeListener, event_topics
+import server
+
+
+class ChangeListenerTest(unittest.TestCase):
+    def setUp(self):
+        self.listener = ChangeListener({}, queue_size=2)
+
+    def test_event_topics(self):
+        event = {'table': 'order_workers', 'order_id': 15, 'worker_id': 7}
+        self.assertEqual(event_topics(event), {'table:order_workers', 'order:15', 'worker:7'})
+
+    def test_dispatch_by_topic(self):
+        async def run():
+            order = self.listener.subscribe({'order:15'})
+            worker = self.listener.subscribe({'worker:8'})
+            both = self.listener.subscribe({'order:15', 'table:order_workers'})
+            self.listener.dispatch({'change_id': 1, 'table': 'order_workers', 'order_id': 15, 'worker_id': 7})
+            self.assertEqual((await order.get(0))['change_id'], 1)
+            self.assertIsNone(await worker.get(0))
+            self.assertEqual((await both.get(0))['change_id'], 1)
+            self.assertIsNone(await both.get(0))
+
+        asyncio.run(run())
+
+    def test_overflow_requests_resync(self):
+        async def run():
+            subscription = self.listener.subscribe({'table:orders'})
+            for change_id in range(3):
+                self.listener.dispatch({'change_id': change_id, 'table': 'orders', 'order_id': change_id})
+            self.assertEqual(await subscription.get(0), {'event': 'resync'})
+            self.assertEqual((await subscription.get(0))['change_id'], 0)
+
+        asyncio.run(run())
+
+    def test_unsubscribe(self):
+        async def run():
+            subscription = self.listener.subscribe({'order:1', 'worker:2'})
+            self.listener.unsubscribe(subscription)
+            self.assertEqual(self.listener._topics, {})
+
+        asyncio.run(run())
+
+
+class WebSocketTest(unittest.TestCase):
+    def setUp(self):
+        self.listener = ChangeListener({})
+        patcher = mock.patch.object(server, 'get_listener', return_value=self.listener)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = TestClient(server.app)
+
+    def wait_topics(self, topics: set[str]):
+        # Сообщения обрабатываются в цикле событий сервера, тест ждёт результата
+        for _ in range(100):
+            if set(self.listener._topics) == topics:
+                return
+            time.sleep(0.01)
+        self.assertEqual(set(self.listener._topics), topics)
+
+    def test_subscription_messages(self):
+        with self.client.websocket_connect('/api/ws?order_id=1') as websocket:
+            self.wait_topics({'order:1'})
+            websocket.send_json({'subscribe': ['worker:7', 'table:orders'], 'unsubscribe': ['order:1']})
+            self.wait_topics({'worker:7', 'table:orders'})
+        self.wait_topics(set())
+
+    def test_invalid_message_closes_connection(self):
+        messages = ['[1]', '{"subscribe": "order:1"}', '{"subscribe": ["order:abc"]}', '{"topics": []}', '{']
+        for message in messages:
+            with self.subTest(message=message):
+                with self.client.websocket_connect('/api/ws') as websocket:
+                    websocket.send_text(message)
+                    with self.assertRaises(WebSocketDisconnect) as context:
+                        websocket.receive_json()
+                    self.assertEqual(context.exception.code, 1003)
+                self.wait_topics(set())
+
+    def test_token_is_checked_on_handshake(self):
+        async def verify_token(request: HTTPConnection):
+            if request.headers.get('Authorization') != 'token':
+                raise HTTPException(status_code=403, detail='Доступ запрещен')
+
+        # Включённая проверка токена, как для /api/events
+        server.app.dependency_overrides[server.verify_token] = verify_token
+        self.addCleanup(server.app.dependency_overrides.clear)
+        with self.assertRaises(WebSocketDenialResponse) as context:
+            with self.client.websocket_connect('/api/ws'):
+                pass
+        self.assertEqual(context.exception.status_code, 403)
+        self.assertEqual(self.listener._topics, {})
+        with self.client.websocket_connect('/api/ws?order_id=1', headers={'Authorization': 'token'}):
+            self.wait_topics({'order:1'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+import unittest
+from datetime import date
+from psycopg2.errors import UniqueViolation
+from database import RecordNotFound, _date_window
+from server import months_before
+from db_case import DataBaseCase, ServerCase
+
+# Тесты создают и архивируют секции orders за MONTH и NEXT_MONTH и удаляют их после себя.
+MONTH = date(2001, 3, 1)
+NEXT_MONTH = date(2001, 4, 1)
+PARTITION = 'orders_2001_03'
+WORKER_ID = 9_200_000_001
+
+
+class DateWindowTest(unittest.TestCase):
+    def test_no_window(self):
+        self.assertEqual(_date_window(None, None), ('', ()))
+
+    def test_open_ended_window(self):
+        self.assertEqual(_date_window(date(2024, 1, 1), None), ('"order_date" >= %s', (date(2024, 1, 1),)))
+        self.assertEqual(_date_window(None, date(2024, 1, 31)), ('"order_date" <= %s', (date(2024, 1, 31),)))
+
+    def test_closed_window(self):
+        condition, params = _date_window(date(2024, 1, 1), date(2024, 1, 31))
+        self.assertEqual(condition, '"order_date" >= %s AND "order_date" <= %s')
+        self.assertEqual(params, (date(2024, 1, 1), date(2024, 1, 31)))
+
+
+class MonthsBeforeTest(unittest.TestCase):
+    def test_months_back_across_year(self):
+        self.assertEqual(months_before(date(2026, 1, 15), 1), date(2025, 12, 1))
+        self.assertEqual(months_before(date(2026, 3, 31), 14), date(2025, 1, 1))
+
+    def test_months_ahead(self):
+        self.assertEqual(months_before(date(2026, 11, 3), -3), date(2027, 2, 1))
+        self.assertEqual(months_before(date(2026, 5, 20), 0), date(2026, 5, 1))
+
+
+def _relations(plan: dict) -> set[str]:
+    relations = {plan['Relation Name']} if 'Relation Name' in plan else set()
+    for child in plan.get('Plans', []):
+        relations |= _relations(child)
+    return relations
+
+
+class OrderPartitionsCase(DataBaseCase):
+    def setUp(self):
+        super().setUp()
+        self.db.insert('users', id=WORKER_ID, name='Исполнитель')
+
+    def tearDown(self):
+        self.db.archive_order_partitions(NEXT_MONTH.replace(month=5), drop=True)
+        self.db.cursor.execute('SELECT to_regclass(%s)', (f'archive.{PARTITION}',))
+        if self.db.cursor.fetchone()[0] is not None:
+            # id архивированных заказов остаются занятыми (migrations/009_order_ids.sql)
+            self.db.cursor.execute(f'DELETE FROM order_ids WHERE id IN (SELECT id FROM archive.{PARTITION})')
+            self.db.cursor.execute(f'DROP TABLE archive.{PARTITION}')
+        self.db.cursor.execute('DELETE FROM archive.order_workers WHERE worker_id = %s', (WORKER_ID,))
+        self.db.cursor.execute('DELETE FROM users WHERE id = %s', (WORKER_ID,))
+        super().tearDown()
+
+    def add_order(self, day: int) -> int:
+        self.db.create_order_partitions(MONTH, MONTH)
+        order = self.db.insert('orders', order_date=MONTH.replace(day=day), count_workers=1)
+        self.db.insert('order_workers', order_id=order['id'], worker_id=WORKER_ID)
+        return order['id']
+
+    def archived_orders(self) -> list[int]:
+        self.db.cursor.execute(f'SELECT id FROM archive.{PARTITION} ORDER BY id')
+        return [record[0] for record in self.db.cursor.fetchall()]
+
+    def archived_assignments(self) -> list[int]:
+        self.db.cursor.execute('SELECT order_id FROM archive.order_workers WHERE worker_id = %s ORDER BY order_id',
+                               (WORKER_ID,))
+        return [record[0] for record in self.db.cursor.fetchall()]
+
+
+class OrderPartitionsTest(OrderPartitionsCase):
+    def test_date_window_reads_only_its_partitions(self):
+        self.add_order(10)
+        self.db.get_all('orders', date_from=MONTH, date_to=MONTH.replace(day=31))
+        self.db.cursor.execute(b'EXPLAIN (FORMAT JSON) ' + self.db.cursor.query)
+        self.assertEqual(_relations(self.db.cursor.fetchone()[0][0]['Plan']), {PARTITION})
+
+    def test_archive_month_twice(self):
+        first = self.add_order(10)
+        self.assertIn(PARTITION, self.db.archive_order_partitions(MONTH.replace(month=4)))
+        with self.assertRaises(RecordNotFound):
+            self.db.get_by_id('orders', first)
+        self.assertEqual(self.archived_orders(), [first])
+
+        # Секция за архивированный месяц появилась снова: строки добавляются в существующую архивную таблицу
+        second = self.add_order(20)
+        self.assertIn(PARTITION, self.db.archive_order_partitions(MONTH.replace(month=4)))
+        self.assertEqual(self.archived_orders(), [first, second])
+        self.assertEqual(self.archived_assignments(), [first, second])
+        self.db.cursor.execute('SELECT to_regclass(%s)', (f'public.{PARTITION}',))
+        self.assertIsNone(self.db.cursor.fetchone()[0])
+
+        # При drop=True архив не меняется
+        third = self.add_order(25)
+        self.assertIn(PARTITION, self.db.archive_order_partitions(MONTH.replace(month=4), drop=True))
+        self.assertEqual(self.archived_orders(), [first, second])
+        self.assertEqual(self.archived_assignments(), [first, second])
+        with self.assertRaises(RecordNotFound):
+            self.db.get_by_id('orders', third)
+
+    def test_order_id_is_unique_across_partitions(self):
+        order_id = self.add_order(10)
+        self.db.create_order_partitions(NEXT_MONTH, NEXT_MONTH)
+        with self.assertRaises(UniqueViolation):
+            self.db.insert('orders', id=order_id, order_date=NEXT_MONTH)
+        # Перенос заказа в другую секцию сохраняет его id
+        self.db.update_record('orders', order_id, {'order_date': NEXT_MONTH})
+        with self.assertRaises(UniqueViolation):
+            self.db.insert('orders', id=order_id, order_date=MONTH)
+        self.db.delete_by_id('orders', order_id)
+        self.db.insert('orders', id=order_id, order_date=MONTH)
+
+        # id архивированного заказа остаётся занятым
+        self.db.archive_order_partitions(NEXT_MONTH)
+        with self.assertRaises(UniqueViolation):
+            self.db.insert('orders', id=order_id, order_date=NEXT_MONTH)
+
+
+class OrderEndpointTest(ServerCase, OrderPartitionsCase):
+    def batch(self, operations: list[dict], transactional: bool = False) -> list[int]:
+        response = self.client.post('/api/batch', json={'operations': operations, 'transactional': transactional})
+        self.assertEqual(response.status_code, 200)
+        return [result['status'] for result in response.json()]
+
+    def test_duplicate_order_id(self):
+        order_id = self.add_order(10)
+        self.db.create_order_partitions(NEXT_MONTH, NEXT_MONTH)
+        order = {'id': order_id, 'status': 'new', 'reg_date': str(MONTH), 'manager_id': 1,
+                 'order_date': str(NEXT_MONTH), 'transfer_type': 'нет', 'need_foreman': False,
+                 'order_place': 'склад', 'tasks': []}
+        self.assertEqual(self.client.post('/api/orders/', json=order).status_code, 422)
+        insert = {'op': 'insert', 'table': 'orders', 'data': {'id': order_id, 'order_date': str(NEXT_MONTH)}}
+        self.assertEqual(self.batch([insert]), [422])
+
+    def test_batch_creates_missing_partition(self):
+        order_id = self.add_order(10)
+        self.assertEqual(self.batch([
+            {'op': 'update', 'table': 'orders', 'id': order_id, 'data': {'order_date': str(NEXT_MONTH)}},
+            {'op': 'insert', 'table': 'orders', 'data': {'order_date': '2001-04-20', 'count_workers': 1}},
+            {'op': 'insert', 'table': 'orders', 'data': {'order_date': 'не дата'}},
+        ]), [200, 200, 422])
+        self.db.archive_order_partitions(NEXT_MONTH.replace(month=5), drop=True)
+
+        # В транзакции секция создаётся после отката к точке сохранения, остальные операции сохраняются
+        order_id = self.add_order(10)
+        self.assertEqual(self.batch([
+            {'op': 'update', 'table': 'orders', 'id': order_id, 'data': {'count_workers': 2}},
+            {'op': 'update', 'table': 'orders', 'id': order_id, 'data': {'order_date': str(NEXT_MONTH)}},
+        ], transactional=True), [200, 200])
+        order = self.db.get_by_id('orders', order_id)
+        self.assertEqual((order['order_date'], order['count_workers']), (NEXT_MONTH, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+from database import normalize_phone
+from db_case import ServerCase
+
+# Тесты добавляют пользователей с id от USER_BASE и заказчиков с комментарием COMMENT и удаляют их после себя.
+USER_BASE = 9_300_000_000
+COMMENT = 'test_phone'
+PHONES = ['+7 (912) 555-01-02', '8-912-555-0103', '79125550104', '+7 913 555 01 02']
+
+
+class NormalizePhoneTest(unittest.TestCase):
+    def test_formats_are_reduced_to_digits(self):
+        self.assertEqual(normalize_phone('+7 (912) 000-00-00'), '79120000000')
+        self.assertEqual(normalize_phone('8-912-0000000'), '79120000000')
+        self.assertEqual(normalize_phone('79120000000'), '79120000000')
+
+    def test_leading_eight_of_partial_number(self):
+        self.assertEqual(normalize_phone('8912'), '8912')
+        self.assertEqual(normalize_phone('8 912', prefix=True), '7912')
+        # Номер длиннее 11 цифр не считается российским
+        self.assertEqual(normalize_phone('891200000001', prefix=True), '891200000001')
+
+    def test_number_without_digits(self):
+        self.assertIsNone(normalize_phone('abc'))
+        self.assertIsNone(normalize_phone(''))
+        self.assertIsNone(normalize_phone(None))
+        self.assertIsNone(normalize_phone('١٢٣'))
+
+
+class PhoneSearchTest(ServerCase):
+    def setUp(self):
+        super().setUp()
+        for n, phone in enumerate(PHONES, 1):
+            self.db.insert('users', id=USER_BASE + n, name=f'Пользователь {n}', phone=phone)
+            self.db.insert('customers', name=f'Заказчик {n}', phone=phone, comment=COMMENT)
+
+    def tearDown(self):
+        self.db.cursor.execute('DELETE FROM users WHERE id > %s AND id <= %s', (USER_BASE, USER_BASE + len(PHONES)))
+        self.db.cursor.execute('DELETE FROM customers WHERE comment = %s', (COMMENT,))
+        super().tearDown()
+
+    def users(self, records: list[dict]) -> list[int]:
+        return sorted(record['id'] - USER_BASE for record in records
+                      if USER_BASE < record['id'] <= USER_BASE + len(PHONES))
+
+    def find(self, path: str, **params) -> list[dict]:
+        response = self.client.get(path, params=params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_exact_lookup(self):
+        self.assertEqual(self.users(self.db.get_by_phone('users', '8 (912) 555-01-02')), [1])
+        self.assertEqual(self.users(self.db.get_by_phone('users', '7912555')), [])
+        self.assertEqual(self.db.get_by_phone('users', 'нет номера'), [])
+
+    def test_prefix_lookup(self):
+        self.assertEqual(self.users(self.db.get_by_phone('users', '8 912 555', prefix=True)), [1, 2, 3])
+        # Записи выдаются по возрастанию номера
+        records = self.db.get_by_phone('users', '+7912555', prefix=True, limit=2)
+        self.assertEqual([record['phone_digits'] for record in records], ['79125550102', '79125550103'])
+
+    def test_route_defaults_to_substring(self):
+        # Часть номера в том виде, как он записан, как до появления phone_digits
+        self.assertEqual(self.users(self.find('/api/users/phone/', pattern='555-01')), [1, 2])
+        self.assertEqual(self.users(self.find('/api/users/phone/', pattern='8912555', match='prefix')), [1, 2, 3])
+        self.assertEqual(self.users(self.find('/api/users/phone/', pattern='79125550104', match='exact')), [3])
+        response = self.client.get('/api/users/phone/', params={'pattern': '912', 'match': 'regex'})
+        self.assertEqual(response.status_code, 422)
+
+    def test_customers_route(self):
+        def names(records):
+            return sorted(record['name'] for record in records if record['comment'] == COMMENT)
+
+        self.assertEqual(names(self.find('/api/customers/phone/', pattern='555 01')), ['Заказчик 4'])
+        self.assertEqual(names(self.find('/api/customers/phone/', pattern='+7 913', match='prefix')), ['Заказчик 4'])
+        self.assertEqual(names(self.find('/api/customers/phone/', pattern='89125550103', match='exact')),
+                         ['Заказчик 2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
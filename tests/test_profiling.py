@@ -0,0 +1,118 @@
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+import config
+import server
+from profiling import Profile, ProfilingMiddleware, current_profile, prune_profiles
+
+
+def read_folded(path: str) -> dict[str, int]:
+    lines = {}
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            stack, _, weight = line.rstrip('\n').rpartition(' ')
+            lines[stack] = int(weight)
+    return lines
+
+
+class ProfileTest(unittest.TestCase):
+    def test_spans_and_samples_are_written_as_folded_stacks(self):
+        profile = Profile('GET /api/users/', interval=0.001)
+        profile.start()
+        with profile.span('DataBase.get_all', 'query'):
+            time.sleep(0.03)
+        with profile.span('DataBase.get_all', 'fetch'):
+            time.sleep(0.01)
+        profile.stop()
+
+        with tempfile.TemporaryDirectory() as directory:
+            samples_path, spans_path = profile.write(directory)
+            spans = read_folded(spans_path)
+            samples = read_folded(samples_path)
+
+        self.assertTrue(spans_path.endswith(f'{profile.id}.spans.folded'))
+        self.assertGreaterEqual(spans['GET /api/users/;DataBase.get_all;query'], 30000)
+        self.assertGreaterEqual(spans['GET /api/users/;DataBase.get_all;fetch'], 10000)
+        self.assertIn('GET /api/users/', spans)
+        self.assertTrue(samples)
+        self.assertTrue(all(stack.startswith('GET /api/users/;') for stack in samples))
+
+
+class ProfilingMiddlewareTest(unittest.TestCase):
+    def run_request(self, settings):
+        seen = {}
+
+        async def app(scope, receive, send):
+            seen['profile'] = current_profile.get()
+            await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+            await send({'type': 'http.response.body', 'body': b'{}'})
+
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {'type': 'http', 'method': 'GET', 'path': '/api/orders/', 'headers': []}
+        asyncio.run(ProfilingMiddleware(app, settings)(scope, None, send))
+        return seen['profile'], dict(messages[0]['headers'])
+
+    def test_request_is_passed_through_when_not_profiled(self):
+        profile, headers = self.run_request(lambda scope: None)
+        self.assertIsNone(profile)
+        self.assertNotIn(b'x-profile-id', headers)
+
+    def test_profiled_request_gets_profile_id_and_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            profile, headers = self.run_request(lambda scope: (directory, 0.001, 10))
+            files = sorted(os.listdir(directory))
+        self.assertEqual(headers[b'x-profile-id'], profile.id.encode())
+        self.assertEqual(len(files), 2)
+        self.assertTrue(all(profile.id in name for name in files))
+
+    def test_old_profiles_are_removed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for n in range(4):
+                for suffix in ('.folded', '.spans.folded'):
+                    path = os.path.join(directory, f'20260101-00000{n}-GET_api_users-{n}{suffix}')
+                    with open(path, 'w'):
+                        pass
+                    os.utime(path, (n, n))
+            profile, _ = self.run_request(lambda scope: (directory, 0.001, 3))
+            files = sorted(os.listdir(directory))
+        self.assertEqual(len(files), 6)
+        self.assertTrue(any(profile.id in name for name in files))
+        self.assertFalse(any(name.endswith(('-0.folded', '-0.spans.folded', '-1.folded', '-1.spans.folded'))
+                             for name in files))
+
+    def test_prune_keeps_recent_profiles(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for n in range(3):
+                path = os.path.join(directory, f'profile-{n}.folded')
+                with open(path, 'w'):
+                    pass
+                os.utime(path, (n, n))
+            self.assertEqual(prune_profiles(directory, keep=5), 0)
+            self.assertEqual(prune_profiles(directory, keep=1), 2)
+            self.assertEqual(os.listdir(directory), ['profile-2.folded'])
+
+
+class ProfileSettingsTest(unittest.TestCase):
+    def settings(self, path: str):
+        with mock.patch.object(config, 'PROFILE_SAMPLE_RATE', 1, create=True), \
+                mock.patch.object(config, 'PROFILE_TOKEN', None, create=True):
+            return server.profile_settings({'type': 'http', 'path': path, 'headers': []})
+
+    def test_sampled_api_request(self):
+        self.assertEqual(self.settings('/api/users/'),
+                         (config.PROFILE_DIR, config.PROFILE_INTERVAL, config.PROFILE_KEEP))
+        self.assertIsNone(self.settings('/health/ready'))
+
+    def test_event_stream_is_not_profiled(self):
+        self.assertIsNone(self.settings('/api/events'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,268 @@
+import difflib
+import os
+import re
+import unittest
+from datetime import date, timedelta
+from psycopg2.extras import DictCursor
+from database import DataBase
+from config import DB_USER, DB_PASSWORD, DB_HOST, DB_PORT
+
+# Для запуска нужна отдельная база на DB_HOST/DB_PORT с применёнными миграциями, например PLAN_TEST_DB=mbt_plans.
+# Данные добавляются в одной транзакции, которая в конце откатывается, но на время теста триггеры журнала
+# изменений отключаются под блокировкой таблиц, поэтому рабочую базу указывать нельзя.
+# Сохранённые планы лежат в tests/query_plans, UPDATE_QUERY_PLANS=1 перезаписывает их текущими.
+PLAN_TEST_DB = os.getenv('PLAN_TEST_DB')
+UPDATE_QUERY_PLANS = os.getenv('UPDATE_QUERY_PLANS', '').lower() in ('1', 'true', 'yes')
+PLANS_DIR = os.path.join(os.path.dirname(__file__), 'query_plans')
+
+USERS = 20000
+CUSTOMERS = 5000
+ORDERS = 60000
+WORKERS_PER_ORDER = 3
+CHANGES = 50000
+# Последовательное чтение таблицы или секции с таким числом строк считается ошибкой плана
+LARGE_TABLE_ROWS = 10000
+# Оценка стоимости запроса по умолчанию, выше которой план считается ошибкой
+MAX_COST = 100
+
+SEED_QUERIES = [
+    'ALTER TABLE users DISABLE TRIGGER users_change_log',
+    'ALTER TABLE customers DISABLE TRIGGER customers_change_log',
+    'ALTER TABLE orders DISABLE TRIGGER orders_change_log',
+    'ALTER TABLE order_workers DISABLE TRIGGER order_workers_change_log',
+    # Случайные назначения пересекаются, и проверка берёт блокировку на каждого исполнителя
+    'ALTER TABLE order_workers DISABLE TRIGGER order_workers_no_overlap',
+    '''
+    INSERT INTO users (id, name, sex, born_date, phone, skills, tools, rating)
+    SELECT %(users_from)s + n, 'Исполнитель ' || n, CASE WHEN mod(n, 2) = 0 THEN 'м' ELSE 'ж' END,
+           date '1970-01-01' + mod(n * 7919, 14000),
+           format('+7 (9%%s) %%s', lpad(mod(n, 100)::text, 2, '0'), lpad(n::text, 7, '0')),
+           format('skill_%%s, skill_%%s, skill_%%s', mod(n, 30), mod(n / 30, 30), mod(n / 900, 30)),
+           format('tool_%%s', mod(n, 10)), mod(n, 100)
+    FROM generate_series(1, %(users)s) AS n
+    ''',
+    '''
+    INSERT INTO customers (id, name, phone)
+    SELECT %(customers_from)s + n, 'Заказчик ' || n, '8-912-' || lpad(n::text, 7, '0')
+    FROM generate_series(1, %(customers)s) AS n
+    ''',
+    'SELECT create_order_partitions(current_date - 730, current_date + 30)',
+    '''
+    INSERT INTO orders (id, customer_id, order_date, start_time, finish_time, count_workers, status)
+    SELECT %(orders_from)s + n, %(customers_from)s + 1 + mod(n, %(customers)s), current_date - 730 + mod(n, 760),
+           time '08:00' + mod(n, 8) * interval '1 hour', time '18:00', %(workers_per_order)s + 1, 'new'
+    FROM generate_series(1, %(orders)s) AS n
+    ''',
+    '''
+    INSERT INTO order_workers (order_id, order_date, worker_id)
+    SELECT o.id, o.order_date, %(users_from)s + 1 + mod(o.id * 7 + k * 131, %(users)s)
+    FROM orders AS o, generate_series(1, %(workers_per_order)s) AS k
+    WHERE o.id > %(orders_from)s
+    ''',
+    '''
+    INSERT INTO change_log (table_name, operation, row_id, row_data)
+    SELECT 'orders', 'U', %(orders_from)s + 1 + mod(n, %(orders)s), '{}'
+    FROM generate_series(1, %(changes)s) AS n
+    ''',
+    # Статистика по всем строкам, а не по случайной выборке, чтобы планы не менялись от запуска к запуску
+    'SET LOCAL default_statistics_target = 1000',
+    'ANALYZE users, customers, orders, order_workers, change_log',
+]
+
+
+class RecordingCursor(DictCursor):
+    """Курсор, который запоминает текст каждого выполненного запроса с подставленными параметрами."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.queries = []
+
+    def execute(self, query, vars=None):
+        result = super().execute(query, vars)
+        self.queries.append(self.query)
+        return result
+
+
+@unittest.skipUnless(PLAN_TEST_DB, 'PLAN_TEST_DB не задан')
+class QueryPlanTest(unittest.TestCase):
+    """
+    Планы запросов, которые строят методы DataBase, на заполненной базе.
+    Для каждого запроса проверяется, что большие таблицы читаются по индексу, а оценка стоимости не выше бюджета.
+    План в виде дерева узлов сравнивается с сохранённым в tests/query_plans, изменение выводится как diff.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.db = DataBase(PLAN_TEST_DB, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT)
+        cls.addClassCleanup(cls.db.disconnect)
+        # Откаченные строки остаются в таблицах до VACUUM и увеличивают стоимость следующего запуска
+        cls.addClassCleanup(cls.db.cursor.execute, 'VACUUM ANALYZE users, customers, orders, order_workers, change_log')
+        cls.db._begin()
+        cls.addClassCleanup(cls.db._end, commit=False)
+
+        cursor = cls.db.cursor
+        cursor.execute('SELECT (SELECT coalesce(max(id), 0) FROM users) AS users_from, '
+                       '(SELECT coalesce(max(id), 0) FROM customers) AS customers_from, '
+                       '(SELECT coalesce(max(id), 0) FROM orders) AS orders_from')
+        cls.seed = dict(cursor.fetchone(), users=USERS, customers=CUSTOMERS, orders=ORDERS,
+                        workers_per_order=WORKERS_PER_ORDER, changes=CHANGES)
+        for query in SEED_QUERIES:
+            cursor.execute(query, cls.seed)
+        cls.db.cursor = cls.db.connection.cursor(cursor_factory=RecordingCursor)
+
+    def setUp(self):
+        self.db.cursor.execute('SAVEPOINT query_plan')
+
+    def tearDown(self):
+        self.db.cursor.execute('ROLLBACK TO SAVEPOINT query_plan')
+
+    def user_id(self, n: int = 1) -> int:
+        return self.seed['users_from'] + n
+
+    def order_id(self, n: int = 1) -> int:
+        return self.seed['orders_from'] + n
+
+    def check_plans(self, name: str, call, seq_scans: tuple[str, ...] = (), max_cost: float = MAX_COST):
+        """
+        Выполняет call(db), строит EXPLAIN для каждого выполненного запроса и проверяет планы.
+
+        Args:
+            name: имя файла сохранённого плана в tests/query_plans
+            call: функция, которая вызывает метод DataBase
+            seq_scans: таблицы, которые запросу разрешено читать последовательно
+            max_cost: бюджет оценки стоимости каждого запроса
+        """
+
+        self.db.cursor.queries.clear()
+        call(self.db)
+        queries = [query for query in self.db.cursor.queries if _explainable(query)]
+        self.assertTrue(queries, f'{name}: метод не выполнил ни одного запроса')
+
+        rendered = []
+        with self.db.connection.cursor() as cursor:
+            for query in queries:
+                cursor.execute(b'EXPLAIN (FORMAT JSON) ' + query)
+                plan = cursor.fetchone()[0][0]['Plan']
+                description = f'{name}: {query.decode()}'
+                self.assertLessEqual(plan['Total Cost'], max_cost, f'Стоимость выше бюджета, {description}')
+                for node in _nodes(plan):
+                    relation = node.get('Relation Name')
+                    if node['Node Type'] == 'Seq Scan' and relation not in seq_scans:
+                        cursor.execute('SELECT reltuples FROM pg_class WHERE oid = to_regclass(%s)', (relation,))
+                        self.assertLess(cursor.fetchone()[0], LARGE_TABLE_ROWS,
+                                        f'Последовательное чтение {relation}, {description}')
+                rendered.append('\n'.join(_render(plan)))
+        self.assert_plan_unchanged(name, '\n\n'.join(rendered) + '\n')
+
+    def assert_plan_unchanged(self, name: str, plan: str):
+        path = os.path.join(PLANS_DIR, f'{name}.plan')
+        if UPDATE_QUERY_PLANS or not os.path.exists(path):
+            os.makedirs(PLANS_DIR, exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as file:
+                file.write(plan)
+            return
+        with open(path, encoding='utf-8') as file:
+            stored = file.read()
+        if plan != stored:
+            diff = difflib.unified_diff(stored.splitlines(keepends=True), plan.splitlines(keepends=True),
+                                        f'{name}.plan (сохранённый)', f'{name}.plan (текущий)')
+            self.fail(f'План {name} изменился, если так и задумано, запустите с UPDATE_QUERY_PLANS=1:\n'
+                      + ''.join(diff))
+
+    def test_get_by_id(self):
+        self.check_plans('get_by_id_users', lambda db: db.get_by_id('users', self.user_id()))
+        self.check_plans('get_by_id_customers', lambda db: db.get_by_id('customers', self.seed['customers_from'] + 1))
+        # Без order_date проверяется индекс первичного ключа каждой секции
+        self.check_plans('get_by_id_orders', lambda db: db.get_by_id('orders', self.order_id()), max_cost=1000)
+
+    def test_get_by_param(self):
+        self.check_plans('get_by_param_order_workers_order_id',
+                         lambda db: db.get_by_param('order_workers', 'order_id', self.order_id()))
+        self.check_plans('get_by_param_order_workers_worker_id',
+                         lambda db: db.get_by_param('order_workers', 'worker_id', self.user_id()))
+        today = date.today()
+        self.check_plans('get_by_param_order_workers_worker_id_window',
+                         lambda db: db.get_by_param('order_workers', 'worker_id', self.user_id(),
+                                                    date_from=today - timedelta(days=30), date_to=today))
+
+    def test_get_all_orders_day(self):
+        # Первый день прошлого месяца: диапазон всегда попадает в одну заполненную секцию
+        day = (date.today().replace(day=1) - timedelta(days=1)).replace(day=1)
+        self.check_plans('get_all_orders_day', lambda db: db.get_all('orders', date_from=day, date_to=day),
+                         max_cost=300)
+
+    def test_get_by_phone(self):
+        self.check_plans('get_by_phone_users', lambda db: db.get_by_phone('users', '8 (901) 000-00-01'))
+        self.check_plans('get_by_phone_users_prefix', lambda db: db.get_by_phone('users', '+7 901', prefix=True),
+                         max_cost=300)
+        self.check_plans('get_by_phone_customers', lambda db: db.get_by_phone('customers', '+7 912 000-00-01'))
+
+    def test_get_by_pattern_str(self):
+        # Поиск подстроки через ILIKE '%...%' не использует B-tree индекс, для него нужен pg_trgm
+        self.check_plans('get_by_pattern_str_users_name',
+                         lambda db: db.get_by_pattern_str('users', 'name', 'Исполнитель 42'),
+                         seq_scans=('users',), max_cost=2000)
+
+    def test_get_by_size(self):
+        # Индекса по born_date нет: диапазон дат рождения обычно захватывает большую часть исполнителей
+        self.check_plans('get_by_size_users_born_date',
+                         lambda db: db.get_by_size('users', 'born_date', date(1990, 12, 31), date(1990, 1, 1)),
+                         seq_scans=('users',), max_cost=2000)
+
+    def test_writes_by_id(self):
+        self.check_plans('update_record_users', lambda db: db.update_record('users', self.user_id(), {'rating': 5}))
+        self.check_plans('increment_counters_users',
+                         lambda db: db.increment_counters('users', {self.user_id(1): {'orders': 1},
+                                                                    self.user_id(2): {'orders': 1, 'profit': 100}}))
+
+    def test_staff_order(self):
+        self.check_plans('staff_order', lambda db: db.staff_order(self.order_id(), skills=['skill_1', 'skill_2'],
+                                                                  tools=[], count=1), max_cost=1000)
+
+    def test_get_changes(self):
+        self.check_plans('get_changes', lambda db: db.get_changes(since=CHANGES // 2, limit=500))
+
+    def test_get_change_positions(self):
+        self.check_plans('get_change_positions', lambda db: db.get_change_positions())
+
+
+def _explainable(query: bytes) -> bool:
+    return query.lstrip().split(None, 1)[0].upper() in (b'SELECT', b'INSERT', b'UPDATE', b'DELETE', b'WITH')
+
+
+def _nodes(plan: dict):
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from _nodes(child)
+
+
+def _render(plan: dict, depth: int = 0) -> list[str]:
+    """
+    Дерево узлов плана без оценок стоимости и числа строк, по строке на узел.
+    Имена месячных секций orders заменяются на orders_YYYY_MM, одинаковые поддеревья одного узла
+    (чтение каждой секции) выводятся один раз, чтобы план не зависел от числа и порядка секций.
+    """
+
+    label = plan['Node Type']
+    if plan.get('Join Type', 'Inner') != 'Inner':
+        label += f' {plan["Join Type"]}'
+    if 'Index Name' in plan:
+        label += f' using {plan["Index Name"]}'
+    if 'Relation Name' in plan:
+        label += f' on {plan["Relation Name"]}'
+    lines = ['  ' * depth + re.sub(r'orders_\d{4}_\d{2}', 'orders_YYYY_MM', label)]
+
+    children = []
+    for child in plan.get('Plans', []):
+        child_lines = _render(child, depth + 1)
+        if child_lines not in children:
+            children.append(child_lines)
+    if plan['Node Type'] in ('Append', 'Merge Append'):
+        children.sort()
+    for child_lines in children:
+        lines.extend(child_lines)
+    return lines
+
+
+if __name__ == '__main__':
+    unittest.main()
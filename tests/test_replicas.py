@@ -0,0 +1,215 @@
+import threading
+import time
+import unittest
+from unittest import mock
+import psycopg2
+from psycopg2.errors import QueryCanceled
+from psycopg2.pool import PoolError
+from database import DataBase, ReplicaSet, read_your_writes
+from config import DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_REPLICAS
+
+# Для запуска нужны два экземпляра PostgreSQL: основной из DB_HOST/DB_PORT и реплика из DB_REPLICAS,
+# например DB_REPLICAS='host=127.0.0.1 port=5434 dbname=mbt user=postgres'
+
+RECOVERY_QUERY = 'SELECT pg_is_in_recovery() AS recovery'
+
+
+@unittest.skipUnless(DB_REPLICAS, 'DB_REPLICAS не задан')
+class ReplicaRoutingTest(unittest.TestCase):
+    def setUp(self):
+        self.db = DataBase(DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT,
+                           replicas=ReplicaSet(DB_REPLICAS, sticky_seconds=60))
+        self.db.cursor.execute('CREATE TABLE IF NOT EXISTS test_replicas (id SERIAL PRIMARY KEY, name VARCHAR(100))')
+
+    def read_from_replica(self) -> bool:
+        return self.db._read(RECOVERY_QUERY)[0]['recovery']
+
+    def test_read_goes_to_replica(self):
+        self.assertTrue(self.read_from_replica())
+        self.assertEqual(self.db.replicas.replicas[0].in_use, 0)
+
+    def test_read_after_write_goes_to_primary(self):
+        self.db.insert('test_replicas', name='Test')
+        self.assertFalse(self.read_from_replica())
+
+    def test_read_in_transaction_goes_to_primary(self):
+        with self.db.transaction():
+            self.assertFalse(self.read_from_replica())
+
+    def test_lagging_replica_is_ejected(self):
+        self.db.replicas.max_lag = -1
+        self.db.replicas.check_interval = 0
+        self.assertFalse(self.read_from_replica())
+        self.assertFalse(self.db.replicas.replicas[0].healthy)
+
+    def test_replica_behind_session_lsn_is_skipped(self):
+        token = read_your_writes.set({'min_lsn': 2 ** 63, 'write_lsn': 0})
+        try:
+            self.assertFalse(self.read_from_replica())
+        finally:
+            read_your_writes.reset(token)
+
+    def test_unreachable_replica_falls_back_to_primary(self):
+        self.db.replicas = ReplicaSet(['host=127.0.0.1 port=1 connect_timeout=1'])
+        self.assertFalse(self.read_from_replica())
+
+    def tearDown(self):
+        self.db.cursor.execute('DROP TABLE IF EXISTS test_replicas')
+        self.db.replicas.close()
+        self.db.disconnect()
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def execute(self, query, params=None):
+        if self.connection.error is not None:
+            raise self.connection.error
+
+    def fetchone(self):
+        return 0, '0/10'
+
+    def fetchall(self):
+        return [{'recovery': True}]
+
+
+class FakeConnection:
+    autocommit = False
+    closed = 0
+    # Ошибка, которую выбрасывает каждый запрос на соединении
+    error = None
+
+    def __init__(self):
+        self.prepared = set()
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+class FakePool:
+    """Пул реплики без сервера: создаётся медленно и выдаёт не больше maxconn соединений."""
+
+    created = []
+
+    def __init__(self, minconn, maxconn, dsn, **kwargs):
+        time.sleep(0.05)
+        self.maxconn = maxconn
+        self.kwargs = kwargs
+        self.in_use = 0
+        self.closed = False
+        FakePool.created.append(self)
+
+    def getconn(self):
+        if self.in_use >= self.maxconn:
+            raise PoolError('connection pool exhausted')
+        self.in_use += 1
+        return FakeConnection()
+
+    def putconn(self, connection, close=False):
+        self.in_use -= 1
+
+    def closeall(self):
+        self.closed = True
+
+
+class ReplicaSetTest(unittest.TestCase):
+    def setUp(self):
+        FakePool.created = []
+        patcher = mock.patch('database.ThreadedConnectionPool', FakePool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_concurrent_acquire_creates_one_pool(self):
+        replicas = ReplicaSet(['host=replica'], maxconn=10, check_interval=60, connect_timeout=3)
+        barrier = threading.Barrier(8)
+        acquired = []
+
+        def acquire():
+            barrier.wait()
+            acquired.append(replicas.acquire())
+
+        threads = [threading.Thread(target=acquire) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(FakePool.created), 1)
+        self.assertEqual(FakePool.created[0].kwargs['connect_timeout'], 3)
+        # Потоки, которые не проверяли реплику, читают с основного сервера, а не ждут проверки
+        self.assertEqual(len(acquired), 8)
+        self.assertIn(None, acquired)
+        for result in acquired:
+            if result is not None:
+                replicas.release(*result)
+        self.assertEqual(replicas.replicas[0].in_use, 0)
+
+    def test_exhausted_replica_stays_healthy(self):
+        replicas = ReplicaSet(['host=replica'], maxconn=1, check_interval=0)
+        replica, connection = replicas.acquire()
+        # Проверка не получает соединение, а следующее чтение уходит на основной сервер
+        self.assertIsNone(replicas.acquire())
+        self.assertTrue(replica.healthy)
+        self.assertEqual(replica.in_use, 1)
+        replicas.release(replica, connection)
+        self.assertIsNotNone(replicas.acquire())
+
+    def test_close(self):
+        replicas = ReplicaSet(['host=replica'])
+        replicas.check(replicas.replicas[0])
+        replicas.close()
+        self.assertTrue(FakePool.created[0].closed)
+        self.assertIsNone(replicas.replicas[0].pool)
+        self.assertFalse(replicas.replicas[0].healthy)
+
+
+class ReplicaReadTest(unittest.TestCase):
+    def setUp(self):
+        FakePool.created = []
+        patcher = mock.patch('database.ThreadedConnectionPool', FakePool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.db = DataBase.__new__(DataBase)
+        self.db._pool = None
+        self.db.connection = None
+        self.db.replicas = ReplicaSet(['host=replica'], check_interval=60)
+        self.db._transaction_depth = 0
+        self.db._last_write = None
+        self.replica = self.db.replicas.replicas[0]
+        self.db.replicas.check(self.replica)
+
+    def read(self, error: Exception):
+        with mock.patch.object(FakeConnection, 'error', error), \
+                mock.patch.object(self.db, '_read_primary', return_value=[]) as primary:
+            try:
+                self.db._read(RECOVERY_QUERY)
+            finally:
+                self.assertEqual(self.replica.in_use, 0)
+                self.assertEqual(self.replica.pool.in_use, 0)
+        return primary
+
+    def test_read_from_replica(self):
+        primary = self.read(None)
+        primary.assert_not_called()
+
+    def test_cancelled_read_keeps_replica(self):
+        # Запрос, отменённый по сроку или при отключении клиента, не повторяется на основном сервере
+        with self.assertRaises(QueryCanceled):
+            self.read(QueryCanceled())
+        self.assertTrue(self.replica.healthy)
+
+    def test_lost_replica_falls_back_to_primary(self):
+        primary = self.read(psycopg2.OperationalError('server closed the connection unexpectedly'))
+        primary.assert_called_once()
+        self.assertFalse(self.replica.healthy)
+
+
+if __name__ == '__main__':
+    unittest.main()
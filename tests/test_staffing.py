@@ -0,0 +1,211 @@
+import threading
+import unittest
+from datetime import date, time
+from unittest import mock
+from psycopg2.errors import ExclusionViolation
+from database import RecordNotFound
+from db_case import DataBaseCase, ServerCase, connect
+
+# Тесты добавляют исполнителей с id от WORKER_BASE и свои заказы и удаляют их после себя.
+WORKER_BASE = 9_100_000_000
+DAY = date(2030, 1, 15)
+
+
+class StaffingCase(DataBaseCase):
+    """Исполнители с разными навыками и инструментами и заказы на один день."""
+
+    def setUp(self):
+        super().setUp()
+        self.db.create_order_partitions(DAY, DAY)
+        self.workers = []
+        self.orders = []
+        self.add_worker(1, 'погрузка, сборка', 'шуруповёрт', rating=90)
+        self.add_worker(2, 'погрузка', 'шуруповёрт', rating=80)
+        self.add_worker(3, 'погрузка, сборка', '', rating=70)
+        self.add_worker(4, 'уборка', '', rating=100)
+
+    def tearDown(self):
+        self.db.cursor.execute('DELETE FROM orders WHERE id = ANY(%s)', (self.orders,))
+        self.db.cursor.execute('DELETE FROM users WHERE id = ANY(%s)', (self.workers,))
+        super().tearDown()
+
+    def add_worker(self, n: int, skills: str, tools: str, rating: int) -> int:
+        worker_id = WORKER_BASE + n
+        self.db.insert('users', id=worker_id, name=f'Исполнитель {n}', skills=skills, tools=tools, rating=rating)
+        self.workers.append(worker_id)
+        return worker_id
+
+    def add_order(self, start: time | None = time(9), finish: time | None = time(13), count_workers: int = 2,
+                  tools: list[str] | None = None) -> int:
+        order = self.db.insert('orders', order_date=DAY, start_time=start, finish_time=finish,
+                               count_workers=count_workers, tools=tools)
+        self.orders.append(order['id'])
+        return order['id']
+
+    def assigned(self, order_id: int) -> list[int]:
+        return sorted(record['worker_id'] for record in self.db.get_by_param('order_workers', 'order_id', order_id))
+
+
+class StaffOrderTest(StaffingCase):
+    def test_skills_and_tools_filter_candidates(self):
+        order_id = self.add_order(count_workers=5, tools=['Шуруповёрт'])
+        added = self.db.staff_order(order_id, skills=['Сборка'])
+        self.assertEqual([record['worker_id'] for record in added], [WORKER_BASE + 1])
+
+    def test_candidates_are_ordered_by_rating_and_limited_by_count(self):
+        order_id = self.add_order(count_workers=2)
+        added = self.db.staff_order(order_id, skills=['погрузка'], tools=[])
+        self.assertEqual([record['worker_id'] for record in added], [WORKER_BASE + 1, WORKER_BASE + 2])
+        # Заказ укомплектован, повторный вызов ничего не добавляет даже с count
+        self.assertEqual(self.db.staff_order(order_id, skills=['погрузка'], tools=[]), [])
+        self.assertEqual(self.db.staff_order(order_id, skills=['погрузка'], tools=[], count=1), [])
+
+    def test_count_is_capped_by_remaining_slots(self):
+        order_id = self.add_order(count_workers=2)
+        added = self.db.staff_order(order_id, skills=['погрузка'], tools=[], count=1)
+        self.assertEqual([record['worker_id'] for record in added], [WORKER_BASE + 1])
+        added = self.db.staff_order(order_id, skills=['погрузка'], tools=[], count=10)
+        self.assertEqual([record['worker_id'] for record in added], [WORKER_BASE + 2])
+
+    def test_worker_busy_on_overlapping_order_is_skipped(self):
+        busy = self.add_order(start=time(8), finish=time(10))
+        self.db.insert('order_workers', order_id=busy, worker_id=WORKER_BASE + 1)
+        later = self.add_order(start=time(10), finish=time(12))
+        self.db.insert('order_workers', order_id=later, worker_id=WORKER_BASE + 2)
+
+        order_id = self.add_order(start=time(9), finish=time(11), count_workers=1)
+        added = self.db.staff_order(order_id, skills=['погрузка'], tools=[])
+        self.assertEqual([record['worker_id'] for record in added], [WORKER_BASE + 3])
+
+    def test_candidates_are_inserted_in_one_statement(self):
+        order_id = self.add_order(count_workers=3)
+        with mock.patch.object(self.db, '_execute', wraps=self.db._execute) as execute:
+            added = self.db.staff_order(order_id, skills=['погрузка'], tools=[])
+        self.assertEqual([record['worker_id'] for record in added], [WORKER_BASE + 1, WORKER_BASE + 2, WORKER_BASE + 3])
+        inserts = [call for call in execute.call_args_list if 'INSERT' in call.args[1]]
+        self.assertEqual(len(inserts), 1)
+
+    def test_busy_candidate_falls_back_to_single_inserts(self):
+        busy = self.add_order(start=time(8), finish=time(10))
+        self.db.insert('order_workers', order_id=busy, worker_id=WORKER_BASE + 1)
+        order_id = self.add_order(start=time(9), finish=time(11), count_workers=2)
+        original = self.db._execute
+        inserts = []
+
+        def execute(cursor, query, params=None):
+            if 'INSERT' in query:
+                inserts.append(params[1])
+            original(cursor, query, params)
+            if 'SKIP LOCKED' in query and not inserts:
+                # Исполнителя 1 назначили на пересекающийся заказ после того, как его выбрали кандидатом
+                records = cursor.fetchall()
+
+                def fetchall():
+                    del cursor.fetchall
+                    return [{'id': WORKER_BASE + 1}] + records
+
+                cursor.fetchall = fetchall
+
+        with mock.patch.object(self.db, '_execute', execute):
+            added = self.db.staff_order(order_id, skills=['погрузка'], tools=[])
+        self.assertEqual([record['worker_id'] for record in added], [WORKER_BASE + 2, WORKER_BASE + 3])
+        self.assertEqual(inserts, [[WORKER_BASE + 1, WORKER_BASE + 2, WORKER_BASE + 3],
+                                   [WORKER_BASE + 1], [WORKER_BASE + 2], [WORKER_BASE + 3]])
+        self.assertEqual(self.assigned(busy), [WORKER_BASE + 1])
+
+    def test_missing_order(self):
+        with self.assertRaises(RecordNotFound):
+            self.db.staff_order(0)
+
+    def test_overlapping_assignment_is_rejected(self):
+        first = self.add_order(start=time(9), finish=time(13))
+        second = self.add_order(start=time(12), finish=time(14))
+        other = self.add_order(start=time(13), finish=time(15))
+        self.db.insert('order_workers', order_id=first, worker_id=WORKER_BASE + 1)
+        with self.assertRaises(ExclusionViolation):
+            self.db.insert('order_workers', order_id=second, worker_id=WORKER_BASE + 1)
+        with self.assertRaises(ExclusionViolation):
+            self.db.insert('order_workers', order_id=first, worker_id=WORKER_BASE + 1)
+        self.db.insert('order_workers', order_id=other, worker_id=WORKER_BASE + 1)
+        # Перенос заказа на занятое время тоже отклоняется
+        with self.assertRaises(ExclusionViolation):
+            self.db.update_record('orders', other, {'start_time': time(11)})
+
+    def test_assignment_waits_for_concurrent_assignment(self):
+        first = self.add_order(start=time(9), finish=time(13))
+        second = self.add_order(start=time(10), finish=time(11))
+        other = connect()
+        try:
+            with other.transaction():
+                other.insert('order_workers', order_id=first, worker_id=WORKER_BASE + 1)
+                errors = []
+
+                def assign():
+                    db = connect()
+                    try:
+                        db.insert('order_workers', order_id=second, worker_id=WORKER_BASE + 1)
+                    except ExclusionViolation as e:
+                        errors.append(e)
+                    finally:
+                        db.disconnect()
+
+                thread = threading.Thread(target=assign)
+                thread.start()
+                # Назначение ждёт блокировку исполнителя, пока первая транзакция не зафиксирована
+                thread.join(0.5)
+                self.assertTrue(thread.is_alive())
+            thread.join(5)
+        finally:
+            other.disconnect()
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(self.assigned(second), [])
+
+    def test_concurrent_staffing_does_not_double_book(self):
+        orders = [self.add_order(start=time(9), finish=time(13), count_workers=1) for _ in range(6)]
+        barrier = threading.Barrier(len(orders))
+        errors = []
+
+        def staff(order_id):
+            db = connect()
+            try:
+                barrier.wait()
+                db.staff_order(order_id, skills=['погрузка'], tools=[])
+            except Exception as e:
+                errors.append(e)
+            finally:
+                db.disconnect()
+
+        threads = [threading.Thread(target=staff, args=(order_id,)) for order_id in orders]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+
+        self.assertEqual(errors, [])
+        workers = [worker for order_id in orders for worker in self.assigned(order_id)]
+        self.assertEqual(sorted(workers), [WORKER_BASE + 1, WORKER_BASE + 2, WORKER_BASE + 3])
+
+
+class StaffEndpointTest(ServerCase, StaffingCase):
+    def test_staff_endpoint(self):
+        order_id = self.add_order(count_workers=1)
+        response = self.client.post(f'/api/orders/{order_id}/staff', json={'skills': ['погрузка'], 'tools': []})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([record['worker_id'] for record in response.json()], [WORKER_BASE + 1])
+        self.assertEqual(self.client.post('/api/orders/0/staff').status_code, 404)
+        response = self.client.post(f'/api/orders/{order_id}/staff', json={'count': 0})
+        self.assertEqual(response.status_code, 422)
+
+    def test_manual_assignment_conflict(self):
+        first = self.add_order(start=time(9), finish=time(13))
+        second = self.add_order(start=time(12), finish=time(14))
+        response = self.client.post(f'/api/orders/{first}/workers/', params={'worker_id': WORKER_BASE + 1})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post(f'/api/orders/{second}/workers/', params={'worker_id': WORKER_BASE + 1})
+        self.assertEqual(response.status_code, 409)
+        response = self.client.post(f'/api/orders/{second}/staff', json={'skills': ['сборка'], 'tools': []})
+        self.assertEqual([record['worker_id'] for record in response.json()], [WORKER_BASE + 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import asyncio
+import os
+import subprocess
+import sys
+import unittest
+from unittest import mock
+from fastapi.testclient import TestClient
+import config
+import server
+from db_case import TEST_DB, connection_pool
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class LazyConfigTest(unittest.TestCase):
+    def tearDown(self):
+        config.load.cache_clear()
+
+    def test_import_does_not_read_settings(self):
+        # Импорт сервера не читает .env и не подключается к базе данных
+        code = 'import config, server; print(config.load.cache_info().currsize, server._pool)'
+        env = dict(os.environ, DB_POOL_MIN='не число', DB_HOST='127.0.0.1', DB_PORT='1')
+        result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env, capture_output=True, text=True,
+                                timeout=60)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.split(), ['0', 'None'])
+
+    def test_invalid_setting_fails_on_first_access(self):
+        config.load.cache_clear()
+        with mock.patch.dict(os.environ, {'DB_POOL_MIN': 'не число'}):
+            with self.assertRaises(ValueError):
+                config.DB_POOL_MIN
+        config.load.cache_clear()
+        self.assertIsInstance(config.DB_POOL_MIN, int)
+
+    def test_unknown_setting(self):
+        with self.assertRaises(AttributeError):
+            config.NO_SUCH_SETTING
+
+
+class FakePool:
+    def __init__(self):
+        self.ready_during_prewarm = None
+
+    def prewarm(self):
+        self.ready_during_prewarm = server._startup['ready']
+
+
+class ReadinessTest(unittest.TestCase):
+    def test_ready_after_lifespan_startup(self):
+        pool = FakePool()
+        listener = mock.Mock(start=mock.AsyncMock(), stop=mock.AsyncMock())
+
+        async def maintenance():
+            await asyncio.Event().wait()
+
+        with mock.patch.object(server, 'get_pool', return_value=pool), \
+                mock.patch.object(server, 'get_counters'), \
+                mock.patch.object(server, 'get_listener', return_value=listener), \
+                mock.patch.object(server, 'run_maintenance_periodically', maintenance):
+            client = TestClient(server.app)
+            self.assertEqual(client.get('/health/ready').status_code, 503)
+            self.assertEqual(client.get('/health/live').status_code, 200)
+            with client:
+                response = client.get('/health/ready')
+                self.assertEqual(response.status_code, 200)
+                self.assertIsNotNone(response.json()['startup_seconds'])
+            self.assertEqual(client.get('/health/ready').status_code, 503)
+        # Сервер не сообщает о готовности, пока пул не прогрет
+        self.assertIs(pool.ready_during_prewarm, False)
+        listener.start.assert_awaited_once()
+
+
+@unittest.skipUnless(TEST_DB, 'TEST_DB не задан')
+class PrewarmTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = connection_pool(minconn=3, maxconn=5)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_prewarm_prepares_minconn_connections(self):
+        self.pool.prewarm()
+        connections = [self.pool.connect() for _ in range(self.pool.minconn)]
+        try:
+            self.assertEqual(len({id(connection) for connection in connections}), 3)
+            for connection in connections:
+                self.assertEqual(connection.prepared, {'get_by_id_users', 'get_by_id_customers', 'get_by_id_orders'})
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT name FROM pg_prepared_statements ORDER BY name')
+                    self.assertEqual([row['name'] for row in cursor.fetchall()],
+                                     ['get_by_id_customers', 'get_by_id_orders', 'get_by_id_users'])
+        finally:
+            for connection in connections:
+                self.pool.put(connection)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import asyncio
+import unittest
+from psycopg2.errors import ReadOnlySqlTransaction, UniqueViolation, InFailedSqlTransaction
+from db_case import DataBaseCase, connect
+
+
+class TransactionTest(DataBaseCase):
+    def setUp(self):
+        super().setUp()
+        self.other = connect()
+        self.db.cursor.execute('CREATE TABLE IF NOT EXISTS test_transactions (id SERIAL PRIMARY KEY, name TEXT)')
+        self.db.cursor.execute('TRUNCATE test_transactions')
+
+    def tearDown(self):
+        self.db.cursor.execute('DROP TABLE IF EXISTS test_transactions')
+        self.other.disconnect()
+        super().tearDown()
+
+    def names(self) -> list[str]:
+        # Читает через другое соединение, поэтому видит только зафиксированные записи
+        return sorted(record['name'] for record in self.other.get_all('test_transactions'))
+
+    def test_write_outside_transaction_is_committed_immediately(self):
+        self.db.insert('test_transactions', name='a')
+        self.assertEqual(self.names(), ['a'])
+        self.assertTrue(self.db.connection.autocommit)
+
+    def test_operations_are_committed_together(self):
+        with self.db.transaction():
+            self.db.insert('test_transactions', name='a')
+            self.db.insert('test_transactions', name='b')
+            self.assertEqual(self.names(), [])
+        self.assertEqual(self.names(), ['a', 'b'])
+        self.assertTrue(self.db.connection.autocommit)
+
+    def test_exception_rolls_back(self):
+        with self.assertRaises(ValueError):
+            with self.db.transaction():
+                self.db.insert('test_transactions', name='a')
+                raise ValueError
+        self.assertEqual(self.names(), [])
+        self.assertTrue(self.db.connection.autocommit)
+        # Соединение после отката пригодно для работы
+        self.db.insert('test_transactions', name='b')
+        self.assertEqual(self.names(), ['b'])
+
+    def test_nested_transaction_joins_outer(self):
+        with self.db.transaction():
+            self.db.insert('test_transactions', name='a')
+            with self.db.transaction():
+                self.db.insert('test_transactions', name='b')
+            # Выход из вложенного контекста не фиксирует транзакцию
+            self.assertEqual(self.names(), [])
+        self.assertEqual(self.names(), ['a', 'b'])
+
+    def test_exception_in_nested_transaction_rolls_back_outer(self):
+        with self.assertRaises(ValueError):
+            with self.db.transaction():
+                self.db.insert('test_transactions', name='a')
+                with self.db.transaction():
+                    self.db.insert('test_transactions', name='b')
+                    raise ValueError
+        self.assertEqual(self.names(), [])
+        self.assertEqual(self.db._transaction_depth, 0)
+
+    def test_caught_exception_in_nested_transaction_keeps_outer(self):
+        with self.db.transaction():
+            first = self.db.insert('test_transactions', name='a')
+            with self.assertRaises(UniqueViolation):
+                with self.db.transaction():
+                    self.db.insert('test_transactions', name='b')
+                    self.db.insert('test_transactions', id=first['id'], name='c')
+            # Откатываются только изменения вложенного контекста
+            self.db.insert('test_transactions', name='d')
+        self.assertEqual(self.names(), ['a', 'd'])
+
+    def test_caught_query_error_aborts_transaction(self):
+        with self.assertRaises(InFailedSqlTransaction):
+            with self.db.transaction():
+                first = self.db.insert('test_transactions', name='a')
+                try:
+                    self.db.insert('test_transactions', id=first['id'], name='b')
+                except UniqueViolation:
+                    pass
+        self.assertEqual(self.names(), [])
+        self.assertTrue(self.db.connection.autocommit)
+        self.db.insert('test_transactions', name='c')
+        self.assertEqual(self.names(), ['c'])
+
+    def test_caught_query_error_in_nested_transaction(self):
+        with self.db.transaction():
+            first = self.db.insert('test_transactions', name='a')
+            with self.assertRaises(InFailedSqlTransaction):
+                with self.db.transaction():
+                    self.db.insert('test_transactions', name='b')
+                    try:
+                        self.db.insert('test_transactions', id=first['id'], name='c')
+                    except UniqueViolation:
+                        pass
+        self.assertEqual(self.names(), ['a'])
+
+    def test_readonly_transaction_rejects_writes(self):
+        with self.db.transaction(readonly=True):
+            self.assertEqual(self.db.get_all('test_transactions'), [])
+        with self.assertRaises(ReadOnlySqlTransaction):
+            with self.db.transaction(readonly=True):
+                self.db.insert('test_transactions', name='a')
+        self.assertEqual(self.names(), [])
+        # Следующая транзакция снова разрешает запись
+        with self.db.transaction():
+            self.db.insert('test_transactions', name='b')
+        self.assertEqual(self.names(), ['b'])
+
+    def test_async_transaction(self):
+        async def commit():
+            async with self.db.transaction() as db:
+                await asyncio.to_thread(db.insert, 'test_transactions', name='a')
+
+        async def rollback():
+            async with self.db.transaction() as db:
+                await asyncio.to_thread(db.insert, 'test_transactions', name='b')
+                raise ValueError
+
+        asyncio.run(commit())
+        with self.assertRaises(ValueError):
+            asyncio.run(rollback())
+        self.assertEqual(self.names(), ['a'])
+        self.assertTrue(self.db.connection.autocommit)
+
+
+if __name__ == '__main__':
+    unittest.main()